@@ -31,14 +31,18 @@ import uuid
 from datetime import datetime
 from collections import OrderedDict, defaultdict
 
+from sqlalchemy import inspect
+from sqlalchemy.orm import undefer
+
 from settings import NoIndexWords
 from db import SessionContext, DataError, desc
 from db.models import Article as ArticleRow, Word, Root
+from db.jobqueue import JobQueue
 from fetcher import Fetcher
 from reynir import TOK
 from reynir.fastparser import Fast_Parser, ParseForestDumper
 from reynir.incparser import IncrementalParser
-from tree import Tree
+from tree import Tree, TreeCodec
 from treeutil import TreeUtility
 from settings import Settings
 from tokenizer import __version__ as tokenizer_version
@@ -49,6 +53,25 @@ from tokenizer import __version__ as tokenizer_version
 # minutes to parse
 MAX_SENTENCE_TOKENS = 90
 
+# Maximum number of rows in each multi-row insert into the words table
+WORD_INSERT_CHUNK = 1000
+
+# Kind of the jobs in the persistent job queue for deferred word indexing
+INDEX_JOB_KIND = "index"
+
+# Kind of the jobs for updating the daily word frequency rollup
+# (the wordfreq table) with the words of newly indexed articles
+WORDFREQ_JOB_KIND = "wordfreq"
+
+# Query options that load the deferred content columns of an article row
+# that are needed to initialize a complete Article instance
+_LOAD_CONTENT = (
+    undefer(ArticleRow.html),
+    undefer(ArticleRow.tree),
+    undefer(ArticleRow.tree_bin),
+    undefer(ArticleRow.tokens),
+)
+
 
 class Article:
 
@@ -109,6 +132,7 @@ class Article:
         self._ambiguity = 1.0
         self._html = None
         self._tree = None
+        self._tree_bin = None  # Binary encoding of the tree, see tree.TreeCodec
         self._root_id = None
         self._root_domain = None
         self._helper = None
@@ -118,7 +142,10 @@ class Article:
 
     @classmethod
     def _init_from_row(cls, ar):
-        """ Initialize a fresh Article instance from a database row object """
+        """ Initialize a fresh Article instance from a database row object.
+            Deferred content columns that the query did not load are
+            left as None, rather than being fetched one by one. """
+        unloaded = inspect(ar).unloaded
         a = cls(uuid=ar.id)
         a._url = ar.url
         a._heading = ar.heading
@@ -137,23 +164,24 @@ class Article:
         a._num_sentences = ar.num_sentences
         a._num_parsed = ar.num_parsed
         a._ambiguity = ar.ambiguity
-        a._html = ar.html
-        a._tree = ar.tree
-        a._tokens = ar.tokens
+        a._html = None if "html" in unloaded else ar.html
+        a._tree = None if "tree" in unloaded else ar.tree
+        a._tree_bin = None if "tree_bin" in unloaded else ar.tree_bin
+        a._tokens = None if "tokens" in unloaded else ar.tokens
         assert a._raw_tokens is None
         a._root_id = ar.root_id
         a._root_domain = ar.root.domain if ar.root else None
         return a
 
     @classmethod
-    def _init_from_scrape(cls, url, enclosing_session=None):
-        """ Scrape an article from its URL """
+    def _init_from_scrape(cls, url, enclosing_session=None, html=None):
+        """ Scrape an article from its URL, or from its already fetched HTML """
         if url is None:
             return None
         a = cls(url=url)
         with SessionContext(enclosing_session) as session:
             # Obtain a helper corresponding to the URL
-            html, metadata, helper = Fetcher.fetch_url_html(url, session)
+            html, metadata, helper = Fetcher.fetch_url_html(url, session, html)
             if html is None:
                 return a
             a._html = html
@@ -175,18 +203,29 @@ class Article:
     def load_from_url(cls, url, enclosing_session=None):
         """ Load or scrape an article, given its URL """
         with SessionContext(enclosing_session) as session:
-            ar = session.query(ArticleRow).filter(ArticleRow.url == url).one_or_none()
+            ar = (
+                session.query(ArticleRow)
+                .options(*_LOAD_CONTENT)
+                .filter(ArticleRow.url == url)
+                .one_or_none()
+            )
             if ar is not None:
                 return cls._init_from_row(ar)
             # Not found in database: attempt to fetch
             return cls._init_from_scrape(url, session)
 
     @classmethod
-    def scrape_from_url(cls, url, enclosing_session=None):
-        """ Force fetch of an article, given its URL """
+    def scrape_from_url(cls, url, enclosing_session=None, html=None):
+        """ Force fetch of an article, given its URL. If the HTML
+            has already been fetched, it can be passed in html. """
         with SessionContext(enclosing_session) as session:
-            ar = session.query(ArticleRow).filter(ArticleRow.url == url).one_or_none()
-            a = cls._init_from_scrape(url, session)
+            # Only the UUID of an existing article is needed
+            ar = (
+                session.query(ArticleRow.id)
+                .filter(ArticleRow.url == url)
+                .one_or_none()
+            )
+            a = cls._init_from_scrape(url, session, html)
             if a is not None and ar is not None:
                 # This article already existed in the database, so note its UUID
                 a._uuid = ar.id
@@ -199,6 +238,7 @@ class Article:
             try:
                 ar = (
                     session.query(ArticleRow)
+                    .options(*_LOAD_CONTENT)
                     .filter(ArticleRow.id == uuid)
                     .one_or_none()
                 )
@@ -247,6 +287,35 @@ class Article:
             add_entity_to_register(name, register, session, all_names=all_names)
         return register
 
+    @staticmethod
+    def _word_rows(article_id, words):
+        """ Return a list of rows for the words table, for the
+            interesting words in the given word bag """
+        rows = []
+        for word, cnt in words.items():
+            if word.cat not in NoIndexWords.CATEGORIES_TO_INDEX:
+                # We do not index closed word categories and non-distinctive constructs
+                continue
+            if (word.stem, word.cat) in NoIndexWords.SET:
+                # Specifically excluded from indexing in Greynir.conf (Main.conf)
+                continue
+            if len(word.stem) > Word.MAX_WORD_LEN:
+                # Shield the database from too long words
+                continue
+            # Interesting word: let's index it
+            rows.append(
+                dict(article_id=article_id, stem=word.stem, cat=word.cat, cnt=cnt)
+            )
+        return rows
+
+    @staticmethod
+    def _insert_words(session, rows):
+        """ Insert rows into the words table, using multi-row inserts
+            bypassing the ORM """
+        table = Word.table()
+        for i in range(0, len(rows), WORD_INSERT_CHUNK):
+            session.execute(table.insert().values(rows[i : i + WORD_INSERT_CHUNK]))
+
     def _store_words(self, session):
         """ Store word stems """
         assert session is not None
@@ -254,19 +323,47 @@ class Article:
         session.execute(Word.table().delete().where(Word.article_id == self._uuid))
         # Index the words by storing them in the words table
         if self._words:
-            for word, cnt in self._words.items():
-                if word.cat not in NoIndexWords.CATEGORIES_TO_INDEX:
-                    # We do not index closed word categories and non-distinctive constructs
-                    continue
-                if (word.stem, word.cat) in NoIndexWords.SET:
-                    # Specifically excluded from indexing in Greynir.conf (Main.conf)
-                    continue
-                if len(word.stem) > Word.MAX_WORD_LEN:
-                    # Shield the database from too long words
-                    continue
-                # Interesting word: let's index it
-                w = Word(article_id=self._uuid, stem=word.stem, cat=word.cat, cnt=cnt)
-                session.add(w)
+            self._insert_words(session, self._word_rows(self._uuid, self._words))
+        if self._words is not None:
+            # Have the word frequency rollup updated for the article's day
+            q = session.query(ArticleRow.url).filter(ArticleRow.id == self._uuid)
+            JobQueue(WORDFREQ_JOB_KIND).enqueue(session, q)
+
+    def _index_words(self, session, index_words):
+        """ Store the word stems of the article, or, if indexing is deferred,
+            add the article to the queue of the word indexing stage """
+        if index_words is None:
+            index_words = not Settings.DEFER_WORD_INDEX
+        if index_words or self._words is None:
+            self._store_words(session)
+        else:
+            q = session.query(ArticleRow.url).filter(ArticleRow.id == self._uuid)
+            JobQueue(INDEX_JOB_KIND).enqueue(session, q)
+
+    @classmethod
+    def index_words(cls, session, urls):
+        """ Index the words of the articles having the given URLs, in bulk,
+            from the token lists stored when they were parsed. Returns the
+            list of URLs of the articles that were found and indexed. """
+        q = (
+            session.query(ArticleRow.id, ArticleRow.url, ArticleRow.tokens)
+            .filter(ArticleRow.url.in_(urls))
+            .filter(ArticleRow.tokens != None)
+        )
+        ids = []
+        indexed = []
+        rows = []
+        for a in q:
+            ids.append(a.id)
+            indexed.append(a.url)
+            words = TreeUtility.word_bag(json.loads(a.tokens))
+            rows.extend(cls._word_rows(a.id, words))
+        if ids:
+            session.execute(Word.table().delete().where(Word.article_id.in_(ids)))
+            cls._insert_words(session, rows)
+            q = session.query(ArticleRow.url).filter(ArticleRow.id.in_(ids))
+            JobQueue(WORDFREQ_JOB_KIND).enqueue(session, q)
+        return indexed
 
     def _parse(self, enclosing_session=None, verbose=False):
         """ Parse the article content to yield parse trees and annotated token list """
@@ -357,9 +454,13 @@ class Article:
             self._tree = "".join(
                 "S{0}\n{1}\n".format(key, val) for key, val in trees.items()
             )
+            self._tree_bin = TreeCodec.encode(self._tree)
 
-    def store(self, enclosing_session=None):
-        """ Store an article in the database, inserting it or updating """
+    def store(self, enclosing_session=None, index_words=None):
+        """ Store an article in the database, inserting it or updating.
+            The word stems of the article are indexed as well, unless
+            index_words is False, or it is None and word indexing is
+            deferred in the settings. """
         with SessionContext(enclosing_session, commit=True) as session:
             if self._uuid is None:
                 # Insert a new row
@@ -385,18 +486,19 @@ class Article:
                     ambiguity=self._ambiguity,
                     html=self._html,
                     tree=self._tree,
+                    tree_bin=self._tree_bin,
                     tokens=self._tokens,
                 )
                 # Delete any existing rows with the same URL
                 session.execute(
                     ArticleRow.table().delete().where(ArticleRow.url == self._url)
                 )
-                # Add the new row with a fresh UUID
+                # Add the new row with a fresh UUID, and offload it to
+                # PostgreSQL so that the word rows can refer to it
                 session.add(ar)
-                # Store the word stems occurring in the article
-                self._store_words(session)
-                # Offload the new data from Python to PostgreSQL
                 session.flush()
+                # Store the word stems occurring in the article
+                self._index_words(session, index_words)
                 return True
 
             # Update an already existing row by UUID
@@ -430,11 +532,12 @@ class Article:
             ar.ambiguity = self._ambiguity
             ar.html = self._html
             ar.tree = self._tree
+            ar.tree_bin = self._tree_bin
             ar.tokens = self._tokens
             # If the article has been parsed, update the index of word stems
             # (This may cause all stems for the article to be deleted, if
             # there are no successfully parsed sentences in the article)
-            self._store_words(session)
+            self._index_words(session, index_words)
             # Offload the new data from Python to PostgreSQL
             session.flush()
             return True
@@ -515,6 +618,10 @@ class Article:
     def tree(self):
         return self._tree
 
+    @property
+    def tree_bin(self):
+        return self._tree_bin
+
     @property
     def tokens(self):
         return self._tokens
@@ -606,7 +713,8 @@ class Article:
     @classmethod
     def articles(cls, criteria, enclosing_session=None):
         """ Generator of Article objects from the database that
-            meet the given criteria """
+            meet the given criteria. Only the parse trees of the
+            articles are loaded, not their HTML or tokens. """
         # The criteria are currently "timestamp", "author" and "domain",
         # as well as "order_by_parse" which if True indicates that the result
         # should be ordered with the most recently parsed articles first.
@@ -615,7 +723,11 @@ class Article:
         ) as session:
 
             # Only fetch articles that have a parse tree
-            q = session.query(ArticleRow).filter(ArticleRow.tree != None)
+            q = (
+                session.query(ArticleRow)
+                .options(undefer(ArticleRow.tree), undefer(ArticleRow.tree_bin))
+                .filter(ArticleRow.tree != None)
+            )
 
             # timestamp is assumed to contain a tuple: (from, to)
             if criteria and "timestamp" in criteria:
@@ -668,7 +780,7 @@ class Article:
             for a in cls.articles(criteria, enclosing_session=session):
                 acnt += 1
                 tree = Tree(url=a.url, authority=a.authority)
-                tree.load(a.tree)
+                tree.load_stored(a.tree, a.tree_bin)
                 for ix, simple_tree in tree.simple_trees():
                     tcnt += 1
                     for match in simple_tree.all_matches(pattern):
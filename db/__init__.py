@@ -21,12 +21,23 @@
 
     This module contains database-related functionality.
 
+    Each process has its own pool of database connections, whose size
+    and health checks are configured in settings.py. A forked process
+    replaces the pool that it inherits from its parent with a new, empty
+    one before using the database. The inherited pool is kept referenced
+    and never used, so that the child does not ping, recycle or close the
+    connections in it, which are still in use by the parent.
+
 """
 
-from typing import Optional
+from typing import Any, Dict, List, Optional
+
+import os
+import weakref
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool, reset_none
 
 from settings import Settings, ConfigError
 
@@ -40,6 +51,27 @@ from sqlalchemy import func as dbfunc
 from .models import Base
 
 
+# Connection pools inherited from a parent process, which are kept
+# referenced so that the child does not close their connections
+_inherited_pools = []  # type: List[Any]
+
+# The Scraper_DB instances of the process
+_instances = weakref.WeakSet()  # type: weakref.WeakSet
+
+
+def _after_fork_in_child() -> None:
+    """ Give the Scraper_DB instances of a newly forked child process
+        pools of their own """
+    for db in list(_instances):
+        db.check_fork()
+
+
+if hasattr(os, "register_at_fork"):
+    # Python 3.7+: replace the pools immediately after a fork. On older
+    # versions, Scraper_DB checks for a fork when a session is created.
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
 class Scraper_DB:
     """ Wrapper around the SQLAlchemy connection, engine and session """
 
@@ -56,21 +88,117 @@ class Scraper_DB:
             Settings.DB_PORT,
         )
 
+        if Settings.DB_PGBOUNCER:
+            # An external pooler such as pgbouncer (in transaction mode)
+            # pools the connections: open a connection for each session
+            # and close it afterwards
+            kwargs = dict(poolclass=NullPool)  # type: Dict[str, Any]
+        else:
+            kwargs = dict(
+                pool_size=Settings.DB_POOL_SIZE,
+                max_overflow=Settings.DB_MAX_OVERFLOW,
+                pool_timeout=Settings.DB_POOL_TIMEOUT,
+                pool_recycle=Settings.DB_POOL_RECYCLE,
+                pool_pre_ping=Settings.DB_PRE_PING,
+            )
+
         # Create engine and bind session
-        self._engine = create_engine(conn_str)
+        self._engine = create_engine(conn_str, **kwargs)
         self._Session = sessionmaker(bind=self._engine)
+        # The process that owns the pool of the engine
+        self._pid = os.getpid()
+        _instances.add(self)
+
+        # Pool usage counters
+        self.connects = 0
+        self.checkouts = 0
+        self.invalidated = 0
+        self.discarded = 0
+
+        event.listen(self._engine, "connect", self._on_connect)
+        event.listen(self._engine, "checkout", self._on_checkout)
+        event.listen(self._engine, "invalidate", self._on_invalidate)
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        """ Count new connections """
+        self.connects += 1
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        """ Count connection checkouts """
+        self.checkouts += 1
+
+    def _new_pool(self):
+        """ Return a new, empty pool with the settings of the current one """
+        pool = self._engine.pool
+        new_pool = pool.recreate()
+        # Pool.recreate() does not carry the pre-ping setting over
+        new_pool._pre_ping = pool._pre_ping
+        return new_pool
+
+    def check_fork(self) -> None:
+        """ If the process has been forked since the pool was created,
+            replace the pool inherited from the parent with a new one,
+            before any of its connections is checked out, pinged or
+            recycled. This happens right after a fork on Python 3.7+,
+            otherwise when a session is first created in the child. """
+        pid = os.getpid()
+        if pid == self._pid:
+            return
+        self._pid = pid
+        pool = self._engine.pool
+        # Don't roll back connections that are returned to the inherited
+        # pool, in case the child drops sessions that it inherited
+        pool._reset_on_return = reset_none
+        _inherited_pools.append(pool)
+        self._engine.pool = self._new_pool()
+        # Start counting anew for this process
+        self.connects = self.checkouts = self.invalidated = 0
+        self.discarded = pool.checkedin() if hasattr(pool, "checkedin") else 0
+
+    def _on_invalidate(self, dbapi_connection, connection_record, exception):
+        """ Count connections that were found to be stale or broken """
+        self.invalidated += 1
+
+    def pool_status(self):
+        """ Return a dict of pool usage metrics """
+        self.check_fork()
+        pool = self._engine.pool
+        status = dict(
+            connects=self.connects,
+            checkouts=self.checkouts,
+            invalidated=self.invalidated,
+            discarded=self.discarded,
+        )
+        if hasattr(pool, "checkedout"):
+            status.update(
+                size=pool.size(),
+                checked_in=pool.checkedin(),
+                checked_out=pool.checkedout(),
+                overflow=pool.overflow(),
+            )
+        return status
 
     def create_tables(self):
         """ Create all missing tables in the database """
+        self.check_fork()
         Base.metadata.create_all(self._engine)
 
     def execute(self, sql, **kwargs):
         """ Execute raw SQL directly on the engine """
+        self.check_fork()
         return self._engine.execute(sql, **kwargs)
 
+    def dispose(self):
+        """ Close the pooled connections of the engine, for instance
+            before forking worker processes that use the database """
+        self.check_fork()
+        self._engine.pool.dispose()
+        self._engine.pool = self._new_pool()
+
     @property
     def session(self):
         """ Returns a freshly created Session instance from the sessionmaker """
+        self.check_fork()
         return self._Session()
 
 
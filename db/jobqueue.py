@@ -0,0 +1,226 @@
+"""
+
+    Greynir: Natural language processing for Icelandic
+
+    Persistent work queue
+
+    Copyright (C) 2020 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+
+    This module implements a work queue on top of the jobs table.
+
+    Jobs refer to articles and have a kind, such as 'parse' or 'process'.
+    Workers claim batches of pending jobs using SELECT ... FOR UPDATE
+    SKIP LOCKED, so that any number of workers, on any number of hosts,
+    can pull from the same queue without blocking each other or claiming
+    the same job twice. A claimed job is leased to its worker for a
+    limited time; if the worker does not complete the job before the
+    lease expires, for instance because it crashed, the job becomes
+    available to other workers again. Jobs that fail repeatedly are
+    eventually marked as failed.
+
+"""
+
+from typing import Dict, List, Tuple, Optional, Iterable
+
+import os
+import socket
+
+from datetime import datetime
+
+from sqlalchemy import text, literal, select, case
+from sqlalchemy.dialects.postgresql import insert
+
+from .models import Job
+
+
+class JobQueue:
+
+    """ A queue of jobs of a particular kind """
+
+    # Default lease duration, in seconds
+    LEASE_SECONDS = 30 * 60
+    # Default number of times a job is attempted before it is marked as failed
+    MAX_ATTEMPTS = 3
+
+    _CLAIM = """
+        update jobs set
+            status = 'leased',
+            leased_by = :worker,
+            lease_expires = now() at time zone 'utc' + :lease * interval '1 second',
+            attempts = attempts + 1
+        where id in (
+            select id from jobs
+                where kind = :kind
+                and (
+                    status = 'pending'
+                    or (status = 'leased' and lease_expires < now() at time zone 'utc')
+                )
+                and attempts < :max_attempts
+                order by id
+                limit :limit
+                for update skip locked
+        )
+        returning id, article_url;
+        """
+
+    _EXPIRE = """
+        update jobs set
+            status = 'failed',
+            leased_by = null,
+            lease_expires = null,
+            error = 'Lease expired'
+        where kind = :kind
+            and status = 'leased'
+            and lease_expires < now() at time zone 'utc'
+            and attempts >= :max_attempts;
+        """
+
+    _STATS = """
+        select status, count(*) as cnt, sum(attempts) as attempts
+            from jobs
+            where kind = :kind
+            group by status;
+        """
+
+    def __init__(
+        self,
+        kind: str,
+        lease_seconds: int = LEASE_SECONDS,
+        max_attempts: int = MAX_ATTEMPTS,
+        worker: Optional[str] = None,
+    ) -> None:
+        self.kind = kind
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.worker = worker or "{0}:{1}".format(socket.gethostname(), os.getpid())
+
+    def enqueue(self, session, url_query) -> int:
+        """ Add jobs for the article URLs selected by url_query, which is a
+            query yielding a single column of URLs. Jobs that are already
+            pending or leased are left alone, while finished or failed jobs
+            for the same articles are reset to pending. Returns the number
+            of jobs added or reset. """
+        table = Job.__table__
+        q = url_query.subquery()
+        urls = select([list(q.c)[0].label("url")]).distinct().alias()
+        stmt = insert(table).from_select(
+            ["kind", "article_url", "status", "attempts", "created"],
+            select(
+                [
+                    literal(self.kind),
+                    urls.c.url,
+                    literal("pending"),
+                    literal(0),
+                    literal(datetime.utcnow()),
+                ]
+            ),
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.kind, table.c.article_url],
+            set_=dict(
+                status="pending",
+                attempts=0,
+                leased_by=None,
+                lease_expires=None,
+                finished=None,
+                error=None,
+                created=stmt.excluded.created,
+            ),
+            where=table.c.status.in_(("done", "failed")),
+        )
+        return session.execute(stmt).rowcount
+
+    def claim(self, session, limit: int) -> List[Tuple[int, str]]:
+        """ Lease up to limit jobs to this worker, returning a list of
+            (job id, article url) tuples. The caller should commit the
+            session right away so that the lease is visible to others. """
+        # Jobs whose last allowed attempt timed out are marked as failed
+        session.execute(
+            text(self._EXPIRE), dict(kind=self.kind, max_attempts=self.max_attempts)
+        )
+        result = session.execute(
+            text(self._CLAIM),
+            dict(
+                worker=self.worker,
+                lease=self.lease_seconds,
+                kind=self.kind,
+                max_attempts=self.max_attempts,
+                limit=limit,
+            ),
+        )
+        return sorted((r.id, r.article_url) for r in result)
+
+    def complete(self, session, ids: Iterable[int]) -> None:
+        """ Mark the given jobs as done """
+        ids = list(ids)
+        if ids:
+            session.execute(
+                Job.__table__.update()
+                .where(Job.__table__.c.id.in_(ids))
+                .values(
+                    status="done",
+                    leased_by=None,
+                    lease_expires=None,
+                    finished=datetime.utcnow(),
+                    error=None,
+                )
+            )
+
+    def fail(self, session, ids: Iterable[int], error: str = "") -> None:
+        """ Release the given jobs after a failure. They will be retried
+            unless they have used up their attempts, in which case they
+            are marked as failed. """
+        ids = list(ids)
+        if ids:
+            c = Job.__table__.c
+            session.execute(
+                Job.__table__.update()
+                .where(c.id.in_(ids))
+                .values(
+                    status=case(
+                        [(c.attempts >= self.max_attempts, "failed")], else_="pending"
+                    ),
+                    leased_by=None,
+                    lease_expires=None,
+                    error=error[0:1024],
+                )
+            )
+
+    def stats(self, session) -> Dict[str, Tuple[int, int]]:
+        """ Return a dict of (number of jobs, total attempts) tuples,
+            keyed by status """
+        return {
+            r.status: (r.cnt, r.attempts or 0)
+            for r in session.execute(text(self._STATS), dict(kind=self.kind))
+        }
+
+    def progress(self, session) -> str:
+        """ Return a human-readable summary of the queue status """
+        st = self.stats(session)
+        total = sum(cnt for cnt, _ in st.values())
+        done = st.get("done", (0, 0))[0]
+        return (
+            "Job queue '{0}': {1} of {2} done ({3:.1f}%), "
+            "{4} pending, {5} leased, {6} failed"
+        ).format(
+            self.kind,
+            done,
+            total,
+            100.0 * done / total if total else 100.0,
+            st.get("pending", (0, 0))[0],
+            st.get("leased", (0, 0))[0],
+            st.get("failed", (0, 0))[0],
+        )
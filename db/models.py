@@ -23,19 +23,22 @@
 
 """
 
+from datetime import timedelta
 
 from sqlalchemy import text
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship, backref
+from sqlalchemy.orm import relationship, backref, deferred
 from sqlalchemy import (
     Table,
     Column,
     Integer,
     String,
     Float,
+    Date,
     DateTime,
     Sequence,
     Boolean,
+    LargeBinary,
     UniqueConstraint,
     Index,
     ForeignKey,
@@ -159,14 +162,30 @@ class Article(Base):
     num_parsed = Column(Integer)
     ambiguity = Column(Float)
 
+    # The large content columns below are deferred, i.e. they are not loaded
+    # along with the rest of the row but only when they are first accessed,
+    # unless a query requests them up front using the undefer() option.
+    # PostgreSQL stores their values compressed and out of line (TOAST),
+    # so they cost nothing to read unless they are actually selected.
+
     # The HTML obtained in the last scrape
-    html = Column(String)
+    html = deferred(Column(String))
     # The parse tree obtained in the last parse
-    tree = Column(String)
+    tree = deferred(Column(String))
     # The tokens of the article in JSON string format
-    tokens = Column(String)
+    tokens = deferred(Column(String))
     # The article topic vector as an array of floats in JSON string format
-    topic_vector = Column(String)
+    # (superseded by topic_vector_bin, but still read if that is missing)
+    topic_vector = deferred(Column(String))
+
+    # Columns added to the original schema are appended below, so that the
+    # layout of existing tables and positional loads of them stay intact
+
+    # The parse tree of the tree column in the compact binary format
+    # of tree.TreeCodec
+    tree_bin = deferred(Column(LargeBinary))
+    # The article topic vector as little-endian float32 values
+    topic_vector_bin = deferred(Column(LargeBinary))
 
     # The back-reference to the Root parent of this Article
     root = relationship(
@@ -369,6 +388,85 @@ class Word(Base):
         )
 
 
+class WordFrequency(Base):
+    """ Represents the number of occurrences of a word stem in articles
+        published on a given day. This is a rollup of the words table,
+        grouped by article date, that is kept up to date by recomputing
+        the days of recently indexed articles. """
+
+    __tablename__ = "wordfreq"
+
+    # The word stem
+    stem = Column(String(Word.MAX_WORD_LEN), nullable=False)
+
+    # The word category
+    cat = Column(String(16), nullable=False)
+
+    # The day of publication (the date part of the article timestamp)
+    day = Column(Date, nullable=False, index=True)
+
+    # Total count of occurrences in articles from that day
+    cnt = Column(Integer, nullable=False)
+
+    __table_args__ = (
+        PrimaryKeyConstraint("stem", "cat", "day", name="wordfreq_pkey"),
+    )
+
+    # Recompute the rollup for the given days from the words table
+    _DELETE = """
+        delete from wordfreq where day = any(:days);
+        """
+
+    _INSERT = """
+        insert into wordfreq (stem, cat, day, cnt)
+            select w.stem, w.cat, a.timestamp::date as day, sum(w.cnt)
+            from words w join articles a on w.article_id = a.id
+            where a.timestamp >= :start and a.timestamp < :end
+            and a.timestamp::date = any(:days)
+            group by w.stem, w.cat, day;
+        """
+
+    _REBUILD = """
+        insert into wordfreq (stem, cat, day, cnt)
+            select w.stem, w.cat, a.timestamp::date as day, sum(w.cnt)
+            from words w join articles a on w.article_id = a.id
+            where a.timestamp is not null
+            group by w.stem, w.cat, day;
+        """
+
+    # Serializes refreshes of the rollup, so that concurrent refreshes
+    # of the same day do not collide (the key is arbitrary but fixed)
+    _LOCK = """
+        select pg_advisory_xact_lock(7413042);
+        """
+
+    @staticmethod
+    def refresh(session, days):
+        """ Recompute the word frequencies of the given days
+            (a collection of datetime.date objects) """
+        days = sorted(set(days))
+        if not days:
+            return
+        session.execute(text(WordFrequency._LOCK))
+        session.execute(text(WordFrequency._DELETE), dict(days=days))
+        session.execute(
+            text(WordFrequency._INSERT),
+            dict(days=days, start=days[0], end=days[-1] + timedelta(days=1)),
+        )
+
+    @staticmethod
+    def rebuild(session):
+        """ Recompute the entire rollup from the words table """
+        session.execute(text(WordFrequency._LOCK))
+        session.execute(text("delete from wordfreq;"))
+        session.execute(text(WordFrequency._REBUILD))
+
+    def __repr__(self):
+        return "WordFrequency(stem='{0}', cat='{1}', day='{2}', cnt='{3}')".format(
+            self.stem, self.cat, self.day, self.cnt
+        )
+
+
 class Topic(Base):
     """ Represents a topic for an article """
 
@@ -711,3 +809,81 @@ class QueryData(Base):
         return "QueryData(client_id='{0}', created='{1}', modified='{2}', key='{3}', data='{4}')".format(
             self.client_id, self.created, self.modified, self.key, self.data
         )
+
+
+class Job(Base):
+    """ Represents a unit of work on an article, such as parsing or
+        processing it, in a persistent work queue (see db/jobqueue.py) """
+
+    __tablename__ = "jobs"
+
+    # Primary key
+    id = Column(Integer, Sequence("jobs_id_seq"), primary_key=True)
+
+    # Kind of job, e.g. 'parse' or 'process'
+    kind = Column(String(16), nullable=False)
+
+    # The article to work on
+    article_url = Column(
+        String,
+        # Jobs are deleted along with their article
+        ForeignKey("articles.url", onupdate="CASCADE", ondelete="CASCADE"),
+        nullable=False,
+    )
+
+    # Status: 'pending', 'leased', 'done' or 'failed'
+    status = Column(String(16), nullable=False, index=True)
+
+    # Number of times the job has been leased to a worker
+    attempts = Column(Integer, nullable=False, default=0)
+
+    # Identifier of the worker holding the lease, if any
+    leased_by = Column(String(128))
+
+    # Expiry time of the current lease
+    lease_expires = Column(DateTime)
+
+    # Creation time of the job
+    created = Column(DateTime, nullable=False)
+
+    # Completion time of the job
+    finished = Column(DateTime)
+
+    # Last error message, if any
+    error = Column(String)
+
+    # There can be only one job of each kind for each article
+    __table_args__ = (
+        UniqueConstraint("kind", "article_url"),
+        Index("ix_jobs_kind_status_id", "kind", "status", "id"),
+    )
+
+    def __repr__(self):
+        return "Job(id='{0}', kind='{1}', article_url='{2}', status='{3}')".format(
+            self.id, self.kind, self.article_url, self.status
+        )
+
+
+class FetchState(Base):
+    """ Represents the HTTP validators (ETag and Last-Modified) of a
+        periodically fetched URL, such as a root page or an RSS feed,
+        allowing conditional requests on the next fetch """
+
+    __tablename__ = "fetchstate"
+
+    # The URL is the primary key
+    url = Column(String, primary_key=True)
+
+    # Value of the ETag header in the last response, if any
+    etag = Column(String)
+
+    # Value of the Last-Modified header in the last response, if any
+    last_modified = Column(String)
+
+    # Time of the last fetch
+    fetched = Column(DateTime)
+
+    def __repr__(self):
+        return "FetchState(url='{0}', etag='{1}', last_modified='{2}')".format(
+            self.url, self.etag, self.last_modified
+        )
@@ -201,7 +201,7 @@ class TermTopicsQuery(_BaseQuery):
         query result is limited by a specified limit. """
 
     _Q = """
-        select topic_vector, q.cnt
+        select topic_vector_bin, topic_vector, q.cnt
             from (
                 select a.id as id, sum(w.cnt) as cnt
                 from articles a, words w
@@ -272,46 +272,68 @@ class ArticleListQuery(_BaseQuery):
 
 
 class WordFrequencyQuery(_BaseQuery):
-    """ A query yielding the number of times a given word occurs in
+    """ A query yielding the number of times given words occur in
         articles over a given period of time, broken down by either
-        day or week. """
+        day or week. The counts are read from the daily rollup in the
+        wordfreq table, and summed up by week if required. """
 
     _Q = """
         with days as (
-            select to_char(d, :datefmt) date
+            select to_char(d, :datefmt) date, ix
             from generate_series(
                 :start,
                 :end,
                 :timeunit
-            ) d
+            ) with ordinality as g(d, ix)
+        ),
+        words as (
+            select
+                unnest(cast(:stems as varchar[])) stem,
+                unnest(cast(:cats as varchar[])) cat
         ),
         appearances as (
-            select to_char(a.timestamp, :datefmt) date, sum(w.cnt) cnt
-            from words w, articles a
-            where w.stem = :stem
-            and w.cat = :cat
-            and w.article_id = a.id
-            and a.timestamp >= :start
-            and a.timestamp <= :end
-            group by date
-            order by date
+            select f.stem, f.cat, to_char(f.day, :datefmt) date, sum(f.cnt) cnt
+            from wordfreq f
+            where (f.stem, f.cat) in (select stem, cat from words)
+            and f.day >= :start
+            and f.day < :end
+            group by f.stem, f.cat, date
         )
-        select days.date, coalesce(appearances.cnt,0) from days
-        left outer join appearances on days.date = appearances.date;
+        select words.stem, words.cat, days.date, coalesce(appearances.cnt,0)
+        from words cross join days
+        left outer join appearances
+            on appearances.stem = words.stem
+            and appearances.cat = words.cat
+            and appearances.date = days.date
+        order by words.stem, words.cat, days.ix;
         """
 
     @classmethod
-    def frequency(cls, stem, cat, start, end, timeunit="day", enclosing_session=None):
+    def frequencies(cls, words, start, end, timeunit="day", enclosing_session=None):
+        """ Return a dict of lists of (date, count) tuples for the given
+            list of (stem, cat) tuples, keyed by (stem, cat) """
+        assert timeunit in ["week", "day"]
+        result = {(stem, cat): [] for stem, cat in words}
+        if not result:
+            return result
         with SessionContext(session=enclosing_session, commit=False) as session:
-            assert timeunit in ["week", "day"]
             datefmt = "IYYY-IW" if timeunit == "week" else "YYYY-MM-DD"
             tu = "1 {0}".format(timeunit)
-            return cls().execute(
+            for stem, cat, date, cnt in cls().execute(
                 session,
-                stem=stem,
-                cat=cat,
+                stems=[stem for stem, _ in result],
+                cats=[cat for _, cat in result],
                 start=start,
                 end=end,
                 timeunit=tu,
                 datefmt=datefmt,
-            )
+            ):
+                result[(stem, cat)].append((date, cnt))
+        return result
+
+    @classmethod
+    def frequency(cls, stem, cat, start, end, timeunit="day", enclosing_session=None):
+        """ Return a list of (date, count) tuples for a single word """
+        return cls.frequencies(
+            [(stem, cat)], start, end, timeunit, enclosing_session
+        )[(stem, cat)]
@@ -23,24 +23,43 @@
 
 """
 
-from typing import Dict
+from typing import Dict, Optional
 from types import ModuleType
 
 import re
+import time
 import importlib
 import logging
+import threading
+from collections import namedtuple
 
-import requests
 import urllib.parse as urlparse
-from urllib.error import HTTPError
 
 from bs4 import BeautifulSoup, NavigableString
 
 from reynir import tokenize
+
+import httpfetch
 from nertokenizer import recognize_entities
 from db import SessionContext
 from db.models import Root, Article as ArticleRow
 
+# A snapshot of the attributes of a Root, which remains valid
+# after the session that loaded the Root has been closed
+RootInfo = namedtuple(
+    "RootInfo",
+    [
+        "id",
+        "domain",
+        "url",
+        "description",
+        "author",
+        "authority",
+        "scr_module",
+        "scr_class",
+    ],
+)
+
 # The HTML parser to use with BeautifulSoup
 # _HTML_PARSER = "html5lib"
 _HTML_PARSER = "html.parser"
@@ -93,6 +112,16 @@ class Fetcher:
     # Cache of instantiated scrape helpers
     _helpers: Dict[str, ModuleType] = dict()
 
+    # Index of roots by domain, built from the roots table on demand
+    # (see helper_for()), and the time when it was built
+    _root_index: Optional[Dict[str, RootInfo]] = None
+    _root_index_time = 0.0
+    _root_index_lock = threading.Lock()
+    # Number of seconds after which the root index is rebuilt, so that
+    # processes pick up changes to the roots table made by other processes
+    # (such as scraper.py --init), which is where the roots are written
+    ROOT_INDEX_TTL = 5 * 60.0
+
     def __init__(self):
         """ No instances are supposed to be created of this class """
         assert False
@@ -204,38 +233,10 @@ class Fetcher:
     @classmethod
     def raw_fetch_url(cls, url):
         """ Low-level fetch of an URL, returning a decoded string """
-        html_doc = None
-        try:
-
-            # Normal external HTTP/HTTPS fetch
-            r = requests.get(url)
-            if r is None:
-                logging.warning("No document returned for URL {0}".format(url))
-                return None
-            # pylint: disable=no-member
-            if r.status_code == requests.codes.ok:
-                html_doc = r.text
-            else:
-                logging.warning(
-                    "HTTP status {0} for URL {1}".format(r.status_code, url)
-                )
-
-        except requests.exceptions.ConnectionError as e:
-            logging.error("ConnectionError: {0} for URL {1}".format(e, url))
-            html_doc = None
-        except requests.exceptions.ChunkedEncodingError as e:
-            logging.error("ChunkedEncodingError: {0} for URL {1}".format(e, url))
-            html_doc = None
-        except HTTPError as e:
-            logging.error("HTTPError: {0} for URL {1}".format(e, url))
-            html_doc = None
-        except UnicodeEncodeError as e:
-            logging.error("Exception when opening URL {0}: {1}".format(url, e))
-            html_doc = None
-        except UnicodeDecodeError as e:
-            logging.error("Exception when decoding HTML of {0}: {1}".format(url, e))
-            html_doc = None
-        return html_doc
+        # The fetch uses a shared HTTP session with keep-alive connections,
+        # a timeout and retries (see httpfetch.py). Errors are logged there.
+        result = httpfetch.fetch(url)
+        return result.text if result.ok else None
 
     @classmethod
     def _get_helper(cls, root):
@@ -339,23 +340,47 @@ class Fetcher:
             fetch.add(url)
         return fetch
 
+    @classmethod
+    def root_index(cls, session) -> Dict[str, RootInfo]:
+        """ Return the root index, a dict mapping the domain of each root
+            (i.e. www.ruv.is -> ruv.is) to the root, building it if required """
+        with cls._root_index_lock:
+            index = cls._root_index
+            if index is None or time.time() - cls._root_index_time > cls.ROOT_INDEX_TTL:
+                index = dict()
+                for r in session.query(Root).order_by(Root.id):
+                    # Find the root of the domain, i.e. www.ruv.is -> ruv.is
+                    netloc = urlparse.urlsplit(r.url).netloc
+                    root_domain = ".".join(netloc.split(".")[-2:])
+                    if root_domain not in index:
+                        index[root_domain] = RootInfo(
+                            r.id,
+                            r.domain,
+                            r.url,
+                            r.description,
+                            r.author,
+                            r.authority,
+                            r.scr_module,
+                            r.scr_class,
+                        )
+                cls._root_index = index
+                cls._root_index_time = time.time()
+            return index
+
     @classmethod
     def helper_for(cls, session, url):
         """ Return a scrape helper for the root of the given url """
-        s = urlparse.urlsplit(url)
-        root = None
-        # Find which root this URL belongs to, if any
-        for r in session.query(Root).all():
-            root_s = urlparse.urlsplit(r.url)
-            # Find the root of the domain, i.e. www.ruv.is -> ruv.is
-            root_domain = ".".join(root_s.netloc.split(".")[-2:])
-            # This URL belongs to a root if the domain (netloc) part
-            # ends with the root domain
-            if s.netloc == root_domain or s.netloc.endswith("." + root_domain):
-                root = r
-                break
-        # Obtain a scrape helper for the root, if any
-        return cls._get_helper(root) if root else None
+        index = cls.root_index(session)
+        # This URL belongs to a root if the domain (netloc) part
+        # equals or ends with the root domain: look up the suffixes
+        # of the domain, longest first
+        labels = urlparse.urlsplit(url).netloc.split(".")
+        for i in range(len(labels)):
+            root = index.get(".".join(labels[i:]))
+            if root is not None:
+                # Obtain a scrape helper for the root
+                return cls._get_helper(root)
+        return None
 
     # noinspection PyComparisonWithNone
     @classmethod
@@ -436,15 +461,20 @@ class Fetcher:
             return (metadata, content)
 
     @classmethod
-    def fetch_url_html(cls, url, enclosing_session=None):
+    def fetch_url_html(cls, url, enclosing_session=None, html_doc=None):
         """ Fetch a URL using the scraping mechanism, returning
-            a tuple (html, metadata, helper) or None if error """
+            a tuple (html, metadata, helper) or None if error.
+            If the HTML document has already been fetched, it
+            can be passed in html_doc. """
 
         with SessionContext(enclosing_session) as session:
 
             helper = cls.helper_for(session, url)
 
-            if helper is None or not hasattr(helper, "fetch_url"):
+            if html_doc is not None:
+                # Already fetched
+                pass
+            elif helper is None or not hasattr(helper, "fetch_url"):
                 # Do a straight HTTP fetch
                 html_doc = cls.raw_fetch_url(url)
             else:
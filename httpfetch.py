@@ -0,0 +1,263 @@
+"""
+
+    Greynir: Natural language processing for Icelandic
+
+    HTTP fetching module
+
+    Copyright (C) 2020 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+
+    This module implements HTTP fetching for the scraper.
+
+    All requests in a process go through a shared requests.Session,
+    which keeps connections alive between requests to the same host.
+    Requests have a timeout and are retried, with exponential backoff,
+    upon connection errors and transient server errors.
+
+    FetchPool fetches many URLs concurrently in a pool of threads,
+    while limiting the number of concurrent requests to each domain
+    and the rate at which requests are sent to it. Conditional requests
+    are made when the ETag and/or Last-Modified validators of a URL are
+    known from a previous fetch.
+
+"""
+
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+import os
+import time
+import logging
+import threading
+import urllib.parse as urlparse
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from settings import Settings
+
+
+# Number of retries upon connection errors and transient server errors
+RETRIES = 3
+# Backoff factor for retries: the waits are 0.5, 1, 2... seconds
+BACKOFF_FACTOR = 0.5
+# HTTP statuses that cause a retry
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+USER_AGENT = "Mozilla/5.0 (compatible; Greynir/1.0; +https://greynir.is)"
+
+# Validators of a previously fetched URL: (ETag, Last-Modified)
+Validators = Tuple[Optional[str], Optional[str]]
+
+_session: Optional[requests.Session] = None
+_session_pid: Optional[int] = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """ Return the HTTP session of this process, creating it if required.
+        A forked child process creates its own session instead of sharing
+        the connections of its parent. """
+    global _session, _session_pid
+    with _session_lock:
+        if _session is None or _session_pid != os.getpid():
+            retry = Retry(
+                total=RETRIES,
+                backoff_factor=BACKOFF_FACTOR,
+                status_forcelist=RETRY_STATUSES,
+                method_whitelist=frozenset(["GET", "HEAD"]),
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(
+                pool_connections=Settings.FETCH_THREADS,
+                pool_maxsize=Settings.FETCH_THREADS,
+                max_retries=retry,
+            )
+            session = requests.Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.headers["User-Agent"] = USER_AGENT
+            _session = session
+            _session_pid = os.getpid()
+        return _session
+
+
+class FetchResult:
+
+    """ The result of fetching a URL """
+
+    __slots__ = ("url", "status", "text", "etag", "last_modified")
+
+    def __init__(
+        self,
+        url: str,
+        status: int,
+        text: Optional[str] = None,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+    ) -> None:
+        self.url = url
+        # HTTP status, or 0 if no response was received
+        self.status = status
+        self.text = text
+        self.etag = etag
+        self.last_modified = last_modified
+
+    @property
+    def ok(self) -> bool:
+        """ True if the document was fetched """
+        return self.status == requests.codes.ok and self.text is not None
+
+    @property
+    def not_modified(self) -> bool:
+        """ True if the document has not changed since it was last fetched """
+        return self.status == requests.codes.not_modified
+
+    @property
+    def validators(self) -> Validators:
+        return (self.etag, self.last_modified)
+
+    def __repr__(self) -> str:
+        return "FetchResult(url='{0}', status={1})".format(self.url, self.status)
+
+
+def fetch(
+    url: str, validators: Optional[Validators] = None, timeout: Optional[float] = None
+) -> FetchResult:
+    """ Fetch a URL, making a conditional request if validators from
+        a previous fetch are given """
+    headers = dict()
+    if validators:
+        etag, last_modified = validators
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+    try:
+        r = get_session().get(
+            url, headers=headers, timeout=timeout or Settings.FETCH_TIMEOUT
+        )
+    except requests.exceptions.RequestException as e:
+        logging.error("{0}: {1} for URL {2}".format(type(e).__name__, e, url))
+        return FetchResult(url, 0)
+    etag = r.headers.get("ETag")
+    last_modified = r.headers.get("Last-Modified")
+    # pylint: disable=no-member
+    if r.status_code == requests.codes.not_modified:
+        # Keep the validators that we sent, unless new ones were returned
+        if validators:
+            etag = etag or validators[0]
+            last_modified = last_modified or validators[1]
+        return FetchResult(url, r.status_code, None, etag, last_modified)
+    if r.status_code != requests.codes.ok:
+        logging.warning("HTTP status {0} for URL {1}".format(r.status_code, url))
+        return FetchResult(url, r.status_code)
+    try:
+        text = r.text
+    except (UnicodeDecodeError, requests.exceptions.RequestException) as e:
+        logging.error("Exception when decoding document at {0}: {1}".format(url, e))
+        return FetchResult(url, 0)
+    return FetchResult(url, r.status_code, text, etag, last_modified)
+
+
+class FetchPool:
+
+    """ Fetches URLs concurrently in a pool of threads, with a cap on the
+        number of concurrent requests to each domain and a minimum interval
+        between the starts of requests to the same domain """
+
+    def __init__(
+        self,
+        threads: Optional[int] = None,
+        per_domain: Optional[int] = None,
+        interval: Optional[float] = None,
+        timeout: Optional[float] = None,
+    ) -> None:
+        self.threads = threads or Settings.FETCH_THREADS
+        self.per_domain = per_domain or Settings.FETCH_PER_DOMAIN
+        self.interval = Settings.FETCH_INTERVAL if interval is None else interval
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        # The earliest time at which the next request to each domain may start
+        self._next_start: Dict[str, float] = dict()
+
+    @staticmethod
+    def domain(url: str) -> str:
+        return urlparse.urlsplit(url).netloc.lower()
+
+    def _fetch(self, domain: str, url: str, validators: Optional[Validators]):
+        """ Wait for the rate limit of the domain, then fetch the URL """
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_start.get(domain, 0.0))
+            self._next_start[domain] = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+        return fetch(url, validators, self.timeout)
+
+    def fetch_all(
+        self,
+        urls: Iterable[str],
+        validators: Optional[Dict[str, Validators]] = None,
+    ) -> Iterator[FetchResult]:
+        """ Fetch the given URLs, yielding FetchResult instances in order
+            of completion. If validators for a URL are given, a conditional
+            request is made. """
+        # Queue the URLs by domain, so that they can be dispatched
+        # round-robin while respecting the per-domain cap
+        queued = defaultdict(deque)
+        for url in urls:
+            queued[self.domain(url)].append(url)
+        domains = deque(queued.keys())
+        in_flight: Dict[str, int] = defaultdict(int)
+        futures = dict()
+        validators = validators or dict()
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            while domains or futures:
+                # Dispatch as many requests as the caps allow
+                blocked = 0
+                while domains and len(futures) < self.threads:
+                    if blocked >= len(domains):
+                        # All remaining domains are at their cap
+                        break
+                    d = domains[0]
+                    domains.rotate(-1)
+                    if in_flight[d] >= self.per_domain:
+                        blocked += 1
+                        continue
+                    blocked = 0
+                    url = queued[d].popleft()
+                    if not queued[d]:
+                        del queued[d]
+                        domains.remove(d)
+                    in_flight[d] += 1
+                    f = executor.submit(self._fetch, d, url, validators.get(url))
+                    futures[f] = (d, url)
+                if not futures:
+                    break
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for f in done:
+                    d, url = futures.pop(f)
+                    in_flight[d] -= 1
+                    try:
+                        result = f.result()
+                    except Exception as e:
+                        logging.error(
+                            "Exception when fetching {0}: {1!r}".format(url, e)
+                        )
+                        result = FetchResult(url, 0)
+                    yield result
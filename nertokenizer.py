@@ -27,20 +27,245 @@
     and is thus not appropriate for inclusion in reynir.bintokenizer,
     as GreynirPackage does not (and should not) require a database to be present.
 
+    To avoid a database query for every capitalized word, the names of known
+    entities are kept in a process-wide in-memory index (EntityNameIndex),
+    which is loaded from the entities table on first use and refreshed
+    periodically. Likewise, the results of BÍN lookups of last names are
+    kept in a process-wide LRU cache (see LookupCache).
+
 """
 
-from typing import List, Iterator, Dict, Union, Tuple
+from typing import List, Iterator, Dict, Union, Tuple, Set, Optional, Callable, Any
 
-from collections import defaultdict
+from collections import defaultdict, namedtuple, OrderedDict
+import os
+import time
+import pickle
 import logging
+import threading
 
 from reynir import Abbreviations, TOK, Tok
 from reynir.bindb import BIN_Db
 
+from settings import Settings
 from db import SessionContext, OperationalError
 from db.models import Entity
 
 
+# An entity name, as returned from EntityNameIndex.lookup()
+EntityName = namedtuple("EntityName", ["name"])
+
+
+class LookupCache:
+
+    """ A bounded, thread-safe LRU cache with hit and miss counters """
+
+    def __init__(self, maxsize: int) -> None:
+        self.maxsize = maxsize
+        self._cache: "OrderedDict[Any, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def lookup(self, key: Any, func: Callable[[Any], Any]) -> Any:
+        """ Look up a key in the cache, calling func(key) to obtain
+            the value if it is not already there """
+        with self._lock:
+            try:
+                value = self._cache[key]
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return value
+            except KeyError:
+                self.misses += 1
+        # Call func() without holding the lock, as it may be slow
+        value = func(key)
+        with self._lock:
+            self._cache[key] = value
+            self._cache.move_to_end(key)
+            if len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._cache.clear()
+            self.hits = self.misses = 0
+
+    def stats(self) -> Dict[str, int]:
+        """ Return the size of the cache and its hit and miss counts """
+        with self._lock:
+            return dict(size=len(self._cache), hits=self.hits, misses=self.misses)
+
+
+# Cache of whether a last name is an Icelandic patronym or matronym
+# according to BÍN, shared by all token streams in the process
+_PATRONYM_CACHE = LookupCache(maxsize=50000)
+
+
+def cache_stats() -> Dict[str, Dict[str, int]]:
+    """ Return statistics of the named entity recognizer's caches,
+        for monitoring """
+    return dict(patronyms=_PATRONYM_CACHE.stats())
+
+
+class EntityNameIndex:
+
+    """ A process-wide index of the distinct names of known entities,
+        keyed by their first word. New entities are added incrementally,
+        by id, every REFRESH_INTERVAL seconds, while the index is rebuilt
+        from scratch every REBUILD_INTERVAL seconds in order to drop the
+        names of deleted entities. If Settings.ENTITY_INDEX_FILE is set,
+        the index is saved to that file after being rebuilt, and loaded
+        from it when a process starts. """
+
+    REFRESH_INTERVAL = 60.0
+    REBUILD_INTERVAL = 60 * 60.0
+
+    # Version of the format of the index file
+    FILE_VERSION = 1
+
+    # Protects the index and its state below. The sets of names in a
+    # published index are never modified; updates build a new index,
+    # which is swapped in under the lock.
+    _lock = threading.Lock()
+    # Held by the thread that is updating the index, while lookups in
+    # other threads continue to use the current index
+    _update_lock = threading.Lock()
+    # First word of name -> set of names
+    _index: Dict[str, Set[str]] = dict()
+    # The highest entity id in the index
+    _max_id = 0
+    # Time of last refresh and last rebuild
+    _refreshed = 0.0
+    _rebuilt = 0.0
+    _loaded = False
+
+    @staticmethod
+    def _key(name: str) -> str:
+        return name.split(" ", 1)[0]
+
+    @classmethod
+    def _add(cls, index: Dict[str, Set[str]], name: Optional[str]) -> None:
+        if name:
+            index.setdefault(cls._key(name), set()).add(name)
+
+    @classmethod
+    def _load_file(cls, path: str) -> bool:
+        """ Load the index from a file, returning True if successful """
+        try:
+            with open(path, "rb") as f:
+                data = pickle.load(f)
+            if data.get("version") != cls.FILE_VERSION:
+                return False
+            with cls._lock:
+                cls._index = data["index"]
+                cls._max_id = data["max_id"]
+                cls._rebuilt = data["rebuilt"]
+            return True
+        except (OSError, EOFError, pickle.UnpicklingError, KeyError) as e:
+            logging.warning("Unable to load entity index {0}: {1}".format(path, e))
+            return False
+
+    @classmethod
+    def _save_file(cls, path: str) -> None:
+        """ Atomically replace the index file with the current index """
+        data = dict(
+            version=cls.FILE_VERSION,
+            index=cls._index,
+            max_id=cls._max_id,
+            rebuilt=cls._rebuilt,
+        )
+        tmp_path = "{0}.{1}.tmp".format(path, os.getpid())
+        try:
+            with open(tmp_path, "wb") as f:
+                pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logging.warning("Unable to save entity index {0}: {1}".format(path, e))
+
+    @classmethod
+    def _update(cls, session) -> None:
+        """ Bring the index up to date, if required. Must be called
+            with the update lock held, but not the index lock, since the
+            new index is read from the database before being swapped in. """
+        now = time.time()
+        if now - cls._refreshed < cls.REFRESH_INTERVAL:
+            # Another thread has updated the index in the meantime
+            return
+        path = Settings.ENTITY_INDEX_FILE
+        if not cls._loaded:
+            cls._loaded = True
+            if path and os.path.exists(path) and cls._load_file(path):
+                logging.info("Entity index loaded from {0}".format(path))
+        rebuild = now - cls._rebuilt >= cls.REBUILD_INTERVAL
+        try:
+            q = session.query(Entity.id, Entity.name)
+            if rebuild:
+                index: Dict[str, Set[str]] = dict()
+                max_id = 0
+                for eid, name in q.yield_per(5000):
+                    cls._add(index, name)
+                    max_id = max(max_id, eid)
+            else:
+                # Incremental refresh: only fetch new entities, and add
+                # them to copies of the sets of names that they belong to
+                index = cls._index
+                max_id = cls._max_id
+                added: Dict[str, Set[str]] = dict()
+                for eid, name in q.filter(Entity.id > max_id).yield_per(5000):
+                    cls._add(added, name)
+                    max_id = max(max_id, eid)
+                if added:
+                    index = dict(index)
+                    for key, names in added.items():
+                        index[key] = index.get(key, set()) | names
+        except OperationalError as e:
+            logging.warning("SQL error in EntityNameIndex: {0}".format(e))
+            # Try again after the refresh interval
+            with cls._lock:
+                cls._refreshed = now
+            return
+        with cls._lock:
+            cls._index = index
+            cls._max_id = max_id
+            cls._refreshed = now
+            if rebuild:
+                cls._rebuilt = now
+        if rebuild and path:
+            cls._save_file(path)
+
+    @classmethod
+    def invalidate(cls) -> None:
+        """ Force a rebuild of the index on next use """
+        with cls._lock:
+            cls._refreshed = cls._rebuilt = 0.0
+
+    @classmethod
+    def lookup(cls, session, w: str, fuzzy: bool = True) -> List[EntityName]:
+        """ Return a list of entity names matching the word(s) given,
+            exactly if fuzzy = False, otherwise also as starting word(s) """
+        if time.time() - cls._refreshed >= cls.REFRESH_INTERVAL:
+            # Update the index, unless another thread is already doing so,
+            # in which case the current index is used. If there is no
+            # index yet, wait for it.
+            if cls._update_lock.acquire(blocking=not cls._index):
+                try:
+                    cls._update(session)
+                finally:
+                    cls._update_lock.release()
+        with cls._lock:
+            index = cls._index
+        names = index.get(cls._key(w))
+        if not names:
+            return []
+        if fuzzy:
+            prefix = w + " "
+            return [
+                EntityName(n) for n in sorted(names) if n == w or n.startswith(prefix)
+            ]
+        return [EntityName(w)] if w in names else []
+
+
 def recognize_entities(
     token_stream: Iterator[Tok], enclosing_session=None, token_ctor=TOK
 ) -> Iterator[Tok]:
@@ -58,9 +283,9 @@ def recognize_entities(
     # Phrases we're considering. Note that an entry of None
     # indicates that the accumulated phrase so far is a complete
     # and valid known entity name.
-    state = defaultdict(list)  # type: Dict[Union[str, None], List[Tuple[List[str], Entity]]]
-    # Entitiy definition cache
-    ecache = dict()  # type: Dict[str, List[Entity]]
+    state = defaultdict(list)  # type: Dict[Union[str, None], List[Tuple[List[str], EntityName]]]
+    # Entity name cache
+    ecache = dict()  # type: Dict[str, List[EntityName]]
     # Last name to full name mapping ('Clinton' -> 'Hillary Clinton')
     lastnames = dict()  # type: Dict[str, str]
 
@@ -68,19 +293,10 @@ def recognize_entities(
         session=enclosing_session, commit=True, read_only=True
     ) as session:
 
-        def fetch_entities(w: str, fuzzy=True) -> List[Entity]:
-            """ Return a list of entities matching the word(s) given,
+        def fetch_entities(w: str, fuzzy=True) -> List[EntityName]:
+            """ Return a list of entity names matching the word(s) given,
                 exactly if fuzzy = False, otherwise also as a starting word(s) """
-            try:
-                q = session.query(Entity.name, Entity.verb, Entity.definition)
-                if fuzzy:
-                    q = q.filter(Entity.name.like(w + " %") | (Entity.name == w))
-                else:
-                    q = q.filter(Entity.name == w)
-                return q.all()
-            except OperationalError as e:
-                logging.warning("SQL error in fetch_entities(): {0}".format(e))
-                return []
+            return EntityNameIndex.lookup(session, w, fuzzy)
 
         def query_entities(w):
             """ Return a list of entities matching the initial word given """
@@ -89,6 +305,12 @@ def recognize_entities(
                 ecache[w] = e = fetch_entities(w)
             return e
 
+        def is_patronym(lastname: str) -> bool:
+            """ Return True if the last name is an Icelandic
+                patronym or matronym according to BÍN """
+            _, m = db.lookup_word(lastname, False)
+            return bool(m) and any(mm.fl in {"föð", "móð"} for mm in m)
+
         def lookup_lastname(lastname):
             """ Look up a last name in the lastnames registry,
                 eventually without a possessive 's' at the end, if present """
@@ -212,8 +434,7 @@ def recognize_entities(
                         # Clinton -> Hillary [Rodham] Clinton
                         if lastname[0].isupper():
                             # Look for Icelandic patronyms/matronyms
-                            _, m = db.lookup_word(lastname, False)
-                            if m and any(mm.fl in {"föð", "móð"} for mm in m):
+                            if _PATRONYM_CACHE.lookup(lastname, is_patronym):
                                 # We don't store Icelandic patronyms/matronyms
                                 # as surnames
                                 pass
@@ -230,7 +451,7 @@ def recognize_entities(
                             # were constructed by concatenation (indicated by a hyphen
                             # in the stem)
                             weak = False  # Accept single-word entity references
-                        # elist is a list of Entity instances
+                        # elist is a list of EntityName instances
                         elist = query_entities(w)
                     else:
                         elist = []
@@ -31,7 +31,7 @@
 
 """
 
-from typing import Optional, List
+from typing import Optional, List, Dict, Tuple, Any, Deque
 from types import ModuleType
 
 import getopt
@@ -43,12 +43,17 @@ import os
 
 # from multiprocessing.dummy import Pool
 from multiprocessing import Pool
+from collections import OrderedDict, deque
 from contextlib import closing
 from datetime import datetime
 
+from sqlalchemy import inspect, Sequence
+from sqlalchemy.orm import undefer
+
 from settings import Settings, ConfigError
 from db import Scraper_DB
 from db.models import Article, Person
+from db.jobqueue import JobQueue
 from tree import Tree
 
 
@@ -151,12 +156,91 @@ class TokenContainer:
             article_end(state)
 
 
+class BufferedSession:
+
+    """ Wrapper around an SQLAlchemy session that is passed to processor
+        modules instead of the session itself. Rows added via add() are
+        collected in a buffer and written with multi-row INSERT statements
+        when flush() is called, typically once per article or batch of
+        articles, before the transaction is committed. Statements passed to
+        execute(), such as the deletion of previous rows for an article, are
+        executed immediately, i.e. before any buffered rows are inserted.
+        Other attributes are delegated to the wrapped session. """
+
+    # Maximum number of rows in a single INSERT statement
+    MAX_ROWS_PER_INSERT = 500
+
+    def __init__(self, session) -> None:
+        self._session = session
+        self._rows = []  # type: List[Any]
+
+    def __getattr__(self, name):
+        return getattr(self._session, name)
+
+    def execute(self, *args, **kwargs):
+        return self._session.execute(*args, **kwargs)
+
+    def add(self, row) -> None:
+        """ Add an ORM row object to the buffer """
+        self._rows.append(row)
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def discard(self) -> None:
+        """ Discard any buffered rows, e.g. after a rollback """
+        self._rows = []
+
+    @staticmethod
+    def _values(row) -> Dict[str, Any]:
+        """ Return a dict of the non-NULL column values of an ORM row,
+            using the next sequence value for columns that have a
+            sequence default and no value """
+        d = dict()
+        for attr in inspect(row).mapper.column_attrs:
+            col = attr.columns[0]
+            val = getattr(row, attr.key)
+            if val is not None:
+                d[col.key] = val
+            elif isinstance(col.default, Sequence):
+                d[col.key] = col.default.next_value()
+        return d
+
+    def flush(self) -> int:
+        """ Insert all buffered rows into the database, returning their number """
+        rows, self._rows = self._rows, []
+        if not rows:
+            return 0
+        # Group rows by table and set of columns, since all rows
+        # of a multi-row INSERT must have the same columns
+        groups = OrderedDict()  # type: Dict[Tuple[Any, Tuple[str, ...]], List[Any]]
+        for row in rows:
+            values = self._values(row)
+            key = (row.__table__, tuple(sorted(values.keys())))
+            groups.setdefault(key, []).append(values)
+        chunk = self.MAX_ROWS_PER_INSERT
+        for (table, _), values in groups.items():
+            for i in range(0, len(values), chunk):
+                self._session.execute(table.insert().values(values[i : i + chunk]))
+        return len(rows)
+
+
 class Processor:
 
     """ The worker class that processes parsed articles """
 
     _db = None  # type: Optional[Scraper_DB]
 
+    # Session reused for batches within a worker process, and the id of that process
+    _session = None
+    _session_pid = None  # type: Optional[int]
+
+    # Default number of articles in each batch sent to a worker process
+    DEFAULT_BATCH_SIZE = 50
+
+    # Kind of jobs in the persistent job queue
+    JOB_KIND = "process"
+
     @classmethod
     def _init_class(cls) -> None:
         """ Initialize class attributes """
@@ -166,6 +250,10 @@ class Processor:
     @classmethod
     def cleanup(cls) -> None:
         """ Perform any cleanup """
+        if cls._session is not None and cls._session_pid == os.getpid():
+            cls._session.close()
+        cls._session = None
+        cls._session_pid = None
         cls._db = None
 
     def __init__(
@@ -217,6 +305,88 @@ class Processor:
                     "No processors found in directory {0}".format(processor_directory)
                 )
 
+    def _import_modules(self) -> None:
+        """ If first article within a new process, import the processor modules """
+        if self.pmodules is None:
+            self.pmodules = [
+                importlib.import_module(modname) for modname in self.processors
+            ]
+
+    def _process_article(self, output, url, authority, tree_txt, tree_bin, tokens):
+        """ Run all processors in turn on a single article """
+        assert self.pmodules is not None
+        tree = Tree(url, authority)
+        tree.load_stored(tree_txt, tree_bin)
+
+        token_container = TokenContainer(tokens, url, authority)
+
+        for p in self.pmodules:
+            ptype = getattr(p, "PROCESSOR_TYPE")  # type: str
+            if ptype == "tree":
+                tree.process(output, p)
+            elif ptype == "token":
+                token_container.process(output, p)
+            else:
+                assert False, (
+                    "Unknown processor type '{0}'; should be 'tree' or 'token'"
+                    .format(ptype)
+                )
+
+    @classmethod
+    def _worker_session(cls):
+        """ Return a session that is reused for all batches processed
+            within the current worker process """
+        assert cls._db is not None
+        if cls._session is None or cls._session_pid != os.getpid():
+            cls._session = cls._db.session
+            cls._session_pid = os.getpid()
+        return cls._session
+
+    def go_batch(
+        self, batch: List[Tuple], job_ids: Optional[List[int]] = None
+    ) -> int:
+        """ Process a batch of articles, given as (url, authority, tree,
+            tree_bin, tokens) tuples, in a single transaction. If the batch
+            comes from the job queue, its jobs are marked as done within the
+            same transaction. This is called by a process within a
+            multiprocessing pool. """
+
+        self._import_modules()
+        session = self._worker_session()
+        url = None
+        try:
+            output = BufferedSession(session)
+            for url, authority, tree_txt, tree_bin, tokens in batch:
+                print("Processing article {0}".format(url))
+                if (tree_txt or tree_bin) and tokens:
+                    self._process_article(
+                        output, url, authority, tree_txt, tree_bin, tokens
+                    )
+            output.flush()
+            # Mark the articles as being processed
+            session.execute(
+                Article.table()
+                .update()
+                .where(Article.url.in_([b[0] for b in batch]))
+                .values(processed=datetime.utcnow())
+            )
+            if job_ids:
+                JobQueue(self.JOB_KIND).complete(session, job_ids)
+            # So far, so good: commit to the database
+            session.commit()
+
+        except Exception as e:
+            # If an exception occurred, roll back the transaction
+            session.rollback()
+            print(
+                "Exception in article {0}, transaction for batch of {1} articles "
+                "rolled back\nException: {2}".format(url, len(batch), e)
+            )
+            raise
+
+        sys.stdout.flush()
+        return len(batch)
+
     def go_single(self, url: str) -> None:
         """ Single article processor that will be called by a process within a
             multiprocessing pool """
@@ -226,41 +396,39 @@ class Processor:
         print("Processing article {0}".format(url))
         sys.stdout.flush()
 
-        # If first article within a new process, import the processor modules
-        if self.pmodules is None:
-            self.pmodules = [
-                importlib.import_module(modname) for modname in self.processors
-            ]
+        self._import_modules()
 
         # Load the article
         with closing(self._db.session) as session:
 
             try:
-                article = session.query(Article).filter_by(url=url).one_or_none()
+                article = (
+                    session.query(Article)
+                    .options(
+                        undefer(Article.tree),
+                        undefer(Article.tree_bin),
+                        undefer(Article.tokens),
+                    )
+                    .filter_by(url=url)
+                    .one_or_none()
+                )
 
                 if article is None:
                     print("Article not found in scraper database")
                 else:
                     if article.tree and article.tokens:
-                        tree = Tree(url, article.authority)
-                        tree.load(article.tree)
-
-                        token_container = TokenContainer(
-                            article.tokens, url, article.authority
+                        # The processors' output rows are buffered and
+                        # inserted in bulk before committing
+                        output = BufferedSession(session)
+                        self._process_article(
+                            output,
+                            url,
+                            article.authority,
+                            article.tree,
+                            article.tree_bin,
+                            article.tokens,
                         )
-
-                        # Run all processors in turn
-                        for p in self.pmodules:
-                            ptype = getattr(p, "PROCESSOR_TYPE")  # type: str
-                            if ptype == "tree":
-                                tree.process(session, p)
-                            elif ptype == "token":
-                                token_container.process(session, p)
-                            else:
-                                assert False, (
-                                    "Unknown processor type '{0}'; should be 'tree' or 'token'"
-                                    .format(ptype)
-                                )
+                        output.flush()
 
                     # Mark the article as being processed
                     article.processed = datetime.utcnow()
@@ -279,61 +447,204 @@ class Processor:
 
         sys.stdout.flush()
 
-    def go(
+    # noinspection PyComparisonWithNone
+    def _article_query(self, session, columns, from_date, limit, force, update, title):
+        """ Return a query for the given columns of the articles to process """
+        q = session.query(*columns)
+        if title is not None:
+            # Use a title query on Person to find the URLs to process
+            qtitle = title.lower()
+            if "%" not in qtitle:
+                # Match start of title by default
+                qtitle += "%"
+            q = q.filter(
+                Article.url.in_(
+                    session.query(Person.article_url).filter(
+                        Person.title_lc.like(qtitle)
+                    )
+                )
+            )
+        else:
+            q = q.filter(Article.tree != None)
+            if not force:
+                # If force = True, re-process articles even if
+                # they have been processed before
+                if update:
+                    # If update, we re-process articles that have been parsed
+                    # again in the meantime
+                    q = q.filter(Article.processed < Article.parsed).order_by(
+                        Article.processed
+                    )
+                else:
+                    q = q.filter(Article.processed == None)
+            if from_date is not None:
+                # Only go through articles parsed since the given date
+                q = q.filter(Article.parsed >= from_date).order_by(Article.parsed)
+        if limit > 0:
+            q = q.limit(limit)
+        return q
+
+    def enqueue(
         self, from_date=None, limit=0, force=False, update=False, title=None
+    ) -> int:
+        """ Add jobs for the articles to process to the persistent job queue,
+            returning the number of jobs added """
+        assert self._db is not None
+        with closing(self._db.session) as session:
+            q = self._article_query(
+                session, (Article.url,), from_date, limit, force, update, title
+            )
+            count = JobQueue(self.JOB_KIND).enqueue(session, q)
+            session.commit()
+        return count
+
+    def go(
+        self,
+        from_date=None,
+        limit=0,
+        force=False,
+        update=False,
+        title=None,
+        batch_size=DEFAULT_BATCH_SIZE,
+        queue=False,
     ) -> None:
-        """ Process already parsed articles from the database """
+        """ Process already parsed articles from the database. If batch_size
+            is nonzero, articles are sent to the worker processes in batches
+            of that size, each batch being processed in a single transaction.
+            Otherwise, each worker process fetches and commits one article
+            at a time. If queue is True, the articles to process are claimed
+            in batches from the persistent job queue instead of being
+            selected by the other parameters. """
 
-        # noinspection PyComparisonWithNone,PyShadowingNames
-        def iter_parsed_articles():
+        assert self._db is not None
 
-            assert self._db is not None
+        columns = (
+            Article.url,
+            Article.authority,
+            Article.tree,
+            Article.tree_bin,
+            Article.tokens,
+        )
 
+        def iter_parsed_articles(columns):
+            """ Go through parsed articles and process them """
+            assert self._db is not None
             with closing(self._db.session) as session:
-                """ Go through parsed articles and process them """
-                if title is not None:
-                    # Use a title query on Person to find the URLs to process
-                    qtitle = title.lower()
-                    if "%" not in qtitle:
-                        # Match start of title by default
-                        qtitle += "%"
-                    q = session.query(Person.article_url).filter(
-                        Person.title_lc.like(qtitle)
+                q = self._article_query(
+                    session, columns, from_date, limit, force, update, title
+                )
+                # Use a server-side cursor to avoid loading
+                # the entire result set into memory
+                for a in q.execution_options(stream_results=True).yield_per(200):
+                    yield a
+
+        def iter_batches():
+            """ Yield (batch, None) tuples, where each batch is a list
+                of (url, authority, tree, tree_bin, tokens) tuples """
+            batch = []
+            for a in iter_parsed_articles(columns):
+                batch.append(tuple(a))
+                if len(batch) >= batch_size:
+                    yield batch, None
+                    batch = []
+            if batch:
+                yield batch, None
+
+        jq = JobQueue(self.JOB_KIND)
+
+        def iter_queued_batches():
+            """ Claim batches of jobs from the job queue, yielding
+                (batch, job ids) tuples until the queue is empty """
+            assert self._db is not None
+            while True:
+                with closing(self._db.session) as session:
+                    jobs = jq.claim(session, batch_size or self.DEFAULT_BATCH_SIZE)
+                    # Commit the lease right away
+                    session.commit()
+                    if not jobs:
+                        return
+                    q = session.query(*columns).filter(
+                        Article.url.in_([url for _, url in jobs])
                     )
-                    field = lambda x: x.article_url
-                else:
-                    q = session.query(Article.url).filter(Article.tree != None)
-                    field = lambda x: x.url
-                    if not force:
-                        # If force = True, re-process articles even if
-                        # they have been processed before
-                        if update:
-                            # If update, we re-process articles that have been parsed
-                            # again in the meantime
-                            q = q.filter(Article.processed < Article.parsed).order_by(
-                                Article.processed
-                            )
-                        else:
-                            q = q.filter(Article.processed == None)
-                    if from_date is not None:
-                        # Only go through articles parsed since the given date
-                        q = q.filter(Article.parsed >= from_date).order_by(
-                            Article.parsed
-                        )
-                if limit > 0:
-                    q = q.limit(limit)
-                for a in q.yield_per(200):
-                    yield field(a)
+                    batch = [tuple(a) for a in q]
+                    session.commit()
+                yield batch, [job_id for job_id, _ in jobs]
+
+        def fail_jobs(job_ids, e):
+            """ Release the jobs of a failed batch, for retry by any worker """
+            assert self._db is not None
+            with closing(self._db.session) as session:
+                jq.fail(session, job_ids, "{0!r}".format(e))
+                session.commit()
+
+        def show_progress():
+            assert self._db is not None
+            with closing(self._db.session) as session:
+                print(jq.progress(session))
+                session.commit()
+
+        if queue:
+            batches = iter_queued_batches()
+        elif batch_size:
+            batches = iter_batches()
+        else:
+            batches = None
 
         if _PROFILING:
             # If profiling, just do a simple map within a single thread and process
-            for url in iter_parsed_articles():
-                self.go_single(url)
+            if batches is not None:
+                for batch, job_ids in batches:
+                    try:
+                        self.go_batch(batch, job_ids)
+                    except Exception as e:
+                        if job_ids is None:
+                            raise
+                        fail_jobs(job_ids, e)
+            else:
+                for a in iter_parsed_articles((Article.url,)):
+                    self.go_single(a.url)
+        elif batches is not None:
+            # Use a multiprocessing pool to process batches of articles,
+            # limiting the number of batches that have been read from the
+            # database but not yet processed
+            with Pool(self.num_workers) as pool:
+                max_pending = 2 * (self.num_workers or os.cpu_count() or 1)
+                pending = deque()  # type: Deque[Tuple[Any, Optional[List[int]]]]
+                count = 0
+
+                def wait_for_batch():
+                    nonlocal count
+                    result, job_ids = pending.popleft()
+                    try:
+                        result.get()
+                    except Exception as e:
+                        if job_ids is None:
+                            raise
+                        # Processing a batch from the job queue failed:
+                        # release its jobs and carry on
+                        fail_jobs(job_ids, e)
+                    count += 1
+                    if job_ids is not None and count % 20 == 0:
+                        show_progress()
+
+                for batch, job_ids in batches:
+                    pending.append(
+                        (pool.apply_async(self.go_batch, (batch, job_ids)), job_ids)
+                    )
+                    if len(pending) >= max_pending:
+                        wait_for_batch()
+                while pending:
+                    wait_for_batch()
+                pool.close()
+                pool.join()
+            if queue:
+                show_progress()
         else:
             # Use a multiprocessing pool to process the articles
             # Defaults to using as many processes as there are CPUs
+            urls = (a.url for a in iter_parsed_articles((Article.url,)))
             with Pool(self.num_workers) as pool:
-                for _ in pool.imap_unordered(self.go_single, iter_parsed_articles()):
+                for _ in pool.imap_unordered(self.go_single, urls):
                     pass
                 pool.close()
                 pool.join()
@@ -347,6 +658,9 @@ def process_articles(
     title=None,
     processor=None,
     num_workers=None,
+    batch_size=Processor.DEFAULT_BATCH_SIZE,
+    enqueue=False,
+    queue=False,
 ) -> None:
     """ Process multiple articles according to the given parameters """
     print("------ Greynir starting processing -------")
@@ -364,6 +678,12 @@ def process_articles(
         print("Invoke single processor: {0}".format(processor))
     if num_workers:
         print("Number of workers: {0}".format(num_workers))
+    if batch_size:
+        print("Batch size: {0} articles".format(batch_size))
+    if enqueue:
+        print("Add articles to job queue: Yes")
+    if queue:
+        print("Process articles from job queue: Yes")
     ts = "{0}".format(datetime.utcnow())[0:19]
     print("Time: {0}\n".format(ts))
 
@@ -376,8 +696,24 @@ def process_articles(
             single_processor=processor,
             num_workers=num_workers,
         )
-        proc.go(from_date, limit=limit, force=force, update=update, title=title)
+        if enqueue:
+            count = proc.enqueue(
+                from_date, limit=limit, force=force, update=update, title=title
+            )
+            print("{0} articles added to the job queue".format(count))
+        if queue or not enqueue:
+            proc.go(
+                from_date,
+                limit=limit,
+                force=force,
+                update=update,
+                title=title,
+                batch_size=batch_size,
+                queue=queue,
+            )
     finally:
+        if Processor._db is not None:
+            print("Database connection pool: {0}".format(Processor._db.pool_status()))
         del proc
         Processor.cleanup()
 
@@ -432,6 +768,14 @@ __doc__ = """
         -t T, --title=T: Specify a title pattern in the persons table
                             to select articles to reprocess
         --update: Process files that have been reparsed but not reprocessed
+        -w N, --workers=N: Number of worker processes (default: number of CPUs)
+        -b N, --batch=N: Send articles to worker processes in batches of N,
+                            each processed in one transaction (default 50;
+                            0 to process one article at a time)
+        --enqueue: Add the selected articles to the persistent job queue
+                            instead of processing them directly
+        --queue: Process articles from the job queue until it is empty;
+                            several hosts can work on the same queue
 
 """
 
@@ -444,7 +788,7 @@ def _main(argv=None) -> int:
         try:
             opts, _ = getopt.getopt(
                 argv[1:],
-                "hifl:u:p:t:w:",
+                "hifl:u:p:t:w:b:",
                 [
                     "help",
                     "init",
@@ -455,6 +799,9 @@ def _main(argv=None) -> int:
                     "processor=",
                     "title=",
                     "workers=",
+                    "batch=",
+                    "enqueue",
+                    "queue",
                 ],
             )
         except getopt.error as msg:
@@ -467,6 +814,9 @@ def _main(argv=None) -> int:
         title = None  # Title pattern
         proc = None  # Single processor to invoke
         num_workers = None  # Number of workers to run simultaneously
+        batch_size = Processor.DEFAULT_BATCH_SIZE  # Articles per worker batch
+        enqueue = False  # Add articles to the job queue
+        queue = False  # Process articles from the job queue
         # Process options
         for o, a in opts:
             if o in ("-h", "--help"):
@@ -499,6 +849,13 @@ def _main(argv=None) -> int:
             elif o in ("-w", "--workers"):
                 # Limit the number of workers
                 num_workers = int(a) if int(a) else None
+            elif o in ("-b", "--batch"):
+                # Number of articles in each batch sent to a worker
+                batch_size = int(a)
+            elif o == "--enqueue":
+                enqueue = True
+            elif o == "--queue":
+                queue = True
 
         if init:
             # Initialize the scraper database
@@ -536,6 +893,9 @@ def _main(argv=None) -> int:
                     title=title,
                     processor=proc,
                     num_workers=num_workers,
+                    batch_size=batch_size,
+                    enqueue=enqueue,
+                    queue=queue,
                 )
                 # process_articles(limit = limit)
 
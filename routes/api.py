@@ -25,6 +25,7 @@
 
 from datetime import datetime
 import logging
+import os
 
 from flask import request, abort
 
@@ -34,6 +35,7 @@ from tnttagger import ifd_tag
 from db import SessionContext
 from db.models import ArticleTopic, Query, Feedback, QueryData
 from treeutil import TreeUtility
+from nertokenizer import cache_stats
 from correct import check_grammar
 from reynir.binparser import canonicalize_token
 from article import Article as ArticleProxy
@@ -591,6 +593,18 @@ def exit_api():
     return "The server has shut down"
 
 
+@routes.route("/cachestats.api", methods=["GET", "POST"])
+def cachestats_api():
+    """ Return the sizes and hit counts of the named entity recognizer's
+        caches in the web server process that serves the request, for
+        monitoring. Calling this endpoint requires the Greynir API key. """
+    key = request.values.get("api_key")
+    gak = greynir_api_key()
+    if not gak or not key or key != gak:
+        return better_jsonify(valid=False, errmsg="Invalid or missing API key.")
+    return better_jsonify(valid=True, pid=os.getpid(), caches=cache_stats())
+
+
 @routes.route("/register_query_data.api", methods=["POST"])
 @routes.route("/register_query_data.api/v<int:version>", methods=["POST"])
 def register_query_data_api(version=1):
@@ -243,17 +243,13 @@ def wordfreq():
         data = dict(
             labels=labels, labelDates=label_date_strings, datasets=[]
         )  # type: Dict[str, Any]
+        # Look up the frequencies of all the words for the given period
+        freqs = WordFrequencyQuery.frequencies(
+            words, date_from, date_to, timeunit=timeunit, enclosing_session=session
+        )
         for w in words:
-            # Look up frequency of word for the given period
             (wd, cat) = w
-            res = WordFrequencyQuery.frequency(
-                wd,
-                cat,
-                date_from,
-                date_to,
-                timeunit=timeunit,
-                enclosing_session=session,
-            )
+            res = freqs[(wd, cat)]
             # Generate data and config for chart
             label = "{0} ({1})".format(wd, CAT_DESC.get(cat))
             ds = dict(label=label, fill=False, lineTension=0)
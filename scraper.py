@@ -32,10 +32,10 @@
 
 import sys
 import os
-import gc
 import getopt
 import time
 import logging
+from datetime import datetime
 
 import traceback
 
@@ -47,23 +47,40 @@ from multiprocessing import Pool, cpu_count
 
 from settings import Settings, ConfigError
 from fetcher import Fetcher
-from article import Article
+from article import Article, INDEX_JOB_KIND, WORDFREQ_JOB_KIND
+from workerpool import WorkerPool
+from httpfetch import FetchPool
+from nertokenizer import cache_stats
 
 from db import SessionContext, IntegrityError
-from db.models import Root, Article as ArticleRow
+from db.models import Root, Article as ArticleRow, FetchState, WordFrequency
 from db.setup import init_roots
+from db.jobqueue import JobQueue
 
 import feedparser  # type: ignore
 
 
+# Kind of the jobs in the persistent job queue that are handled by the scraper
+JOB_KIND = "parse"
+
+# Number of articles whose words are indexed in each transaction
+# of the word indexing stage
+INDEX_CHUNK_SIZE = 200
+
+# Number of articles whose days are recomputed in each transaction
+# when updating the daily word frequency rollup
+WORDFREQ_CHUNK_SIZE = 5000
+
+
 class ArticleDescr:
 
     """ Unit of work descriptor that is shipped between processes """
 
-    def __init__(self, seq, root, url):
+    def __init__(self, seq, root, url, html=None):
         self.seq = seq  # Sequence number
         self.root = root
         self.url = url
+        self.html = html  # The HTML document, if already fetched
 
 
 class Scraper:
@@ -74,55 +91,129 @@ class Scraper:
 
         logging.info("Initializing scraper instance")
 
-    def urls2fetch(self, root, helper):
-        """ Returns a set of URLs to fetch. If the scraper helper class has
-            associated RSS feed URLs, these are used to acquire article URLs.
-            Otherwise, the URLs are found by scraping the root website and
+    @staticmethod
+    def sources(root, helper):
+        """ Return the URLs to fetch in order to find new articles of a root.
+            If the scraper helper class has associated RSS feed URLs, these
+            are used. Otherwise, the root website itself is fetched. """
+        feeds = None if helper is None else helper.feeds
+        return list(feeds) if feeds else [root.url]
+
+    def urls2fetch(self, root, helper, source_url, doc):
+        """ Returns a set of article URLs to fetch, found in the document
+            doc fetched from source_url, which is either an RSS feed or
+            the root website. In the latter case, the URLs are found by
             searching for links to subpages. """
         fetch_set = set()
-        feeds = None if helper is None else helper.feeds
 
-        if feeds:
+        if source_url != root.url:
 
-            for feed_url in feeds:
-                logging.info("Fetching feed {0}".format(feed_url))
-                try:
-                    d = feedparser.parse(feed_url)
-                except Exception as e:
-                    logging.warning(
-                        "Error fetching/parsing feed {0}: {1}".format(feed_url, str(e))
-                    )
-                    continue
-                for entry in d.entries:
-                    if entry.link and not helper.skip_rss_entry(entry):
-                        fetch_set.add(entry.link)
+            try:
+                d = feedparser.parse(doc)
+            except Exception as e:
+                logging.warning(
+                    "Error parsing feed {0}: {1}".format(source_url, str(e))
+                )
+                return fetch_set
+            for entry in d.entries:
+                if entry.link and not helper.skip_rss_entry(entry):
+                    fetch_set.add(entry.link)
 
         else:
 
-            # Fetch the root URL and scrape all child URLs
-            # that refer to the same domain suffix
-            logging.info("Fetching root {0}".format(root.url))
-
-            # Read the HTML document at the root URL
-            html_doc = Fetcher.raw_fetch_url(root.url)
-            if not html_doc:
-                logging.warning("Unable to fetch root {0}".format(root.url))
-                return
-
-            # Parse the HTML document
-            soup = Fetcher.make_soup(html_doc)
+            # Parse the HTML document at the root URL
+            soup = Fetcher.make_soup(doc)
 
             # Obtain the set of child URLs to fetch
+            # that refer to the same domain suffix
             fetch_set = Fetcher.children(root, soup)
 
         return fetch_set
 
-    def scrape_root(self, root, helper):
-        """ Scrape a root URL """
+    def scrape_roots(self, session, roots):
+        """ Fetch the sources (RSS feeds or root websites) of the given roots
+            concurrently and add any new article URLs found in them to the
+            articles table. Sources that have not changed since they were
+            last fetched are skipped, using conditional HTTP requests. """
 
         t0 = time.time()
 
-        fetch_set = self.urls2fetch(root, helper)
+        sources = dict()
+        for r in roots:
+            if r.domain.endswith(".local"):
+                # We do not scrape .local roots
+                continue
+            helper = Fetcher._get_helper(r)
+            if helper:
+                for url in self.sources(r, helper):
+                    sources[url] = (r, helper)
+
+        validators = {
+            fs.url: (fs.etag, fs.last_modified)
+            for fs in session.query(FetchState).filter(
+                FetchState.url.in_(list(sources.keys()))
+            )
+        }
+
+        # Map root ids to (root, helper, new URLs, fetch states)
+        fetch_sets = dict()
+        for result in FetchPool().fetch_all(sources.keys(), validators):
+            r, helper = sources[result.url]
+            fetch_set = set()
+            if result.not_modified:
+                logging.info("Not modified: {0}".format(result.url))
+            elif not result.ok:
+                logging.warning("Unable to fetch {0}".format(result.url))
+                continue
+            else:
+                logging.info("Fetched {0}".format(result.url))
+                try:
+                    fetch_set = self.urls2fetch(r, helper, result.url, result.text)
+                except Exception as e:
+                    logging.warning(
+                        "Exception when scraping root at {0}: {1!r}".format(r.url, e)
+                    )
+                    continue
+            state = FetchState(
+                url=result.url,
+                etag=result.etag,
+                last_modified=result.last_modified,
+                fetched=datetime.utcnow(),
+            )
+            entry = fetch_sets.setdefault(r.id, (r, helper, set(), []))
+            entry[2].update(fetch_set)
+            entry[3].append(state)
+
+        for r, helper, fetch_set, states in fetch_sets.values():
+            if fetch_set:
+                try:
+                    stored = self.scrape_root(r, helper, fetch_set)
+                except Exception as e:
+                    logging.warning(
+                        "Exception when storing URLs of root at {0}: {1!r}".format(
+                            r.url, e
+                        )
+                    )
+                    stored = False
+                if not stored:
+                    continue
+            # Remember the validators for the next conditional request,
+            # only now that the new URLs of the root have been stored.
+            # Otherwise, the next request would get a 304 Not Modified
+            # and the URLs would be lost.
+            for fs in states:
+                session.merge(fs)
+            session.commit()
+
+        t1 = time.time()
+
+        logging.info("Root scrape completed in {0:.2f} seconds".format(t1 - t0))
+
+    def scrape_root(self, root, helper, fetch_set):
+        """ Store the new article URLs of a root. Returns False if
+            any of them could not be stored, otherwise True. """
+
+        success = True
 
         # Add the children whose URLs we don't already have
         # stored in the scraper articles table
@@ -155,13 +246,13 @@ class Scraper:
                         )
                     )
                     session.rollback()
+                    success = False
 
-        t1 = time.time()
-
-        logging.info("Root scrape completed in {0:.2f} seconds".format(t1 - t0))
+        return success
 
-    def scrape_article(self, url, helper):
-        """ Scrape a single article, retrieving its HTML and metadata """
+    def scrape_article(self, url, helper, html=None):
+        """ Scrape a single article, retrieving its HTML and metadata.
+            If the HTML has already been fetched, it is passed in html. """
 
         if helper.skip_url(url):
             logging.info("Skipping article {0}".format(url))
@@ -174,7 +265,7 @@ class Scraper:
 
         with SessionContext(commit=True) as session:
 
-            a = Article.scrape_from_url(url, session)
+            a = Article.scrape_from_url(url, session, html)
             if a is not None:
                 a.store(session)
 
@@ -204,23 +295,37 @@ class Scraper:
             )
         )
 
-    def _scrape_single_root(self, r):
-        """ Single root scraper that will be called by a process within a
-            multiprocessing pool """
-        if r.domain.endswith(".local"):
-            # We do not scrape .local roots
-            return
-        try:
-            logging.info("Scraping root of {0} at {1}...".format(r.description, r.url))
-            # Process a single top-level domain and root URL,
-            # parsing child URLs that have not been seen before
-            helper = Fetcher._get_helper(r)
-            if helper:
-                self.scrape_root(r, helper)
-        except Exception as e:
-            logging.warning(
-                "Exception when scraping root at {0}: {1!r}".format(r.url, e)
-            )
+    def fetch_articles(self, descrs):
+        """ Return a generator that fetches the HTML of the given articles
+            concurrently, yielding their descriptors, with the HTML filled
+            in, as they arrive. Articles whose helpers have their own
+            fetch_url() method are yielded without HTML, to be fetched
+            by the helper. """
+        own = []
+        direct = dict()
+        # Look up the helpers here, in the calling thread, rather
+        # than in the thread that consumes the generator
+        for d in descrs:
+            helper = Fetcher._get_helper(d.root)
+            if not helper or helper.skip_url(d.url):
+                continue
+            if hasattr(helper, "fetch_url"):
+                own.append(d)
+            else:
+                direct[d.url] = d
+
+        def gen():
+            yield from own
+            for result in FetchPool().fetch_all(list(direct.keys())):
+                d = direct.pop(result.url)
+                if result.ok:
+                    d.html = result.text
+                    yield d
+                else:
+                    # The article remains unscraped and will be retried later
+                    logging.warning("Unable to fetch article {0}".format(result.url))
+
+        return gen()
 
     def _scrape_single_article(self, d):
         """ Single article scraper that will be called by a process within a
@@ -228,7 +333,7 @@ class Scraper:
         try:
             helper = Fetcher._get_helper(d.root)
             if helper:
-                self.scrape_article(d.url, helper)
+                self.scrape_article(d.url, helper, d.html)
         except Exception as e:
             logging.warning(
                 "[{2}] Exception when scraping article at {0}: {1!r}".format(
@@ -240,11 +345,12 @@ class Scraper:
 
     def _parse_single_article(self, d):
         """ Single article parser that will be called by a process within a
-            multiprocessing pool """
+            multiprocessing pool. Returns True if the article was parsed. """
         try:
             helper = Fetcher._get_helper(d.root)
-            if helper:
-                self.parse_article(d.seq, d.url, helper)
+            if not helper:
+                return False
+            self.parse_article(d.seq, d.url, helper)
         except KeyboardInterrupt:
             logging.info("KeyboardInterrupt in _parse_single_article()")
             sys.exit(1)
@@ -259,48 +365,159 @@ class Scraper:
             )
             # traceback.print_exc()
             # raise
+            return False
         return True
 
-    def go(self, reparse=False, limit=0, urls=None, uuid=None, numprocs=None):
+    def _parse_queued_articles(self, session, queue, chunk_size, pool, limit):
+        """ Parse articles from the job queue, a chunk at a time, using
+            the given worker pool, until the queue is empty or the limit
+            is reached """
+        cnt = 0
+        while True:
+            n = chunk_size if limit <= 0 else min(chunk_size, limit - cnt)
+            if n <= 0:
+                break
+            jobs = queue.claim(session, n)
+            # Commit the lease so that other workers skip these jobs
+            session.commit()
+            if not jobs:
+                break
+            by_url = {
+                a.url: a
+                for a in session.query(ArticleRow).filter(
+                    ArticleRow.url.in_([url for _, url in jobs])
+                )
+            }
+            adlist = []
+            job_ids = dict()
+            missing = []
+            for job_id, url in jobs:
+                a = by_url.get(url)
+                if a is None or a.root is None:
+                    missing.append(job_id)
+                else:
+                    adlist.append(ArticleDescr(cnt + len(adlist), a.root, a.url))
+                    job_ids[a.url] = job_id
+            queue.fail(session, missing, "Article or root not found")
+            done = []
+            failed = []
+            for ad, ok in pool.imap_unordered(adlist):
+                (done if ok else failed).append(job_ids[ad.url])
+            queue.complete(session, done)
+            queue.fail(session, failed, "Parsing failed")
+            session.commit()
+            cnt += len(jobs)
+            logging.info(queue.progress(session))
+        return cnt
+
+    def _index_queued_words(self, session, queue, chunk_size, limit):
+        """ Index the words of articles from the word indexing queue,
+            a chunk at a time, until the queue is empty or the limit
+            is reached """
+        cnt = 0
+        while True:
+            n = chunk_size if limit <= 0 else min(chunk_size, limit - cnt)
+            if n <= 0:
+                break
+            jobs = queue.claim(session, n)
+            # Commit the lease so that other workers skip these jobs
+            session.commit()
+            if not jobs:
+                break
+            indexed = set(Article.index_words(session, [url for _, url in jobs]))
+            queue.complete(session, (job_id for job_id, url in jobs if url in indexed))
+            queue.fail(
+                session,
+                (job_id for job_id, url in jobs if url not in indexed),
+                "Article not found or not parsed",
+            )
+            session.commit()
+            cnt += len(jobs)
+            logging.info(queue.progress(session))
+        return cnt
+
+    def update_word_frequencies(self, session):
+        """ Update the daily word frequency rollup by recomputing the days
+            of the articles whose words have been indexed since the last
+            update. Returns the number of articles handled. """
+        queue = JobQueue(WORDFREQ_JOB_KIND)
+        cnt = 0
+        while True:
+            jobs = queue.claim(session, WORDFREQ_CHUNK_SIZE)
+            session.commit()
+            if not jobs:
+                break
+            days = set(
+                ts.date()
+                for ts, in session.query(ArticleRow.timestamp)
+                .filter(ArticleRow.url.in_([url for _, url in jobs]))
+                .filter(ArticleRow.timestamp != None)
+            )
+            WordFrequency.refresh(session, days)
+            queue.complete(session, (job_id for job_id, _ in jobs))
+            session.commit()
+            cnt += len(jobs)
+        if cnt:
+            logging.info(
+                "Word frequencies updated for the days of {0} articles".format(cnt)
+            )
+        return cnt
+
+    def go(
+        self,
+        reparse=False,
+        limit=0,
+        urls=None,
+        uuid=None,
+        numprocs=None,
+        enqueue=False,
+        queue=False,
+        index=False,
+    ):
         """ Run a scraping pass from all roots in the scraping database """
         version = Article.parser_version()
 
         with SessionContext(commit=True) as session:
 
-            # Use a multiprocessing pool to parse the articles.
-            # Let the pool work on chunks of articles, recycling the
-            # processes after each chunk to contain memory creep.
             # Default to using as many processes as there are CPUs
             CPU_COUNT = numprocs or cpu_count() or 1
 
-            if urls is None and uuid is None and not reparse:
-
-                # Go through the roots and scrape them, inserting into the articles table
+            if index:
+                # Index the words of articles whose indexing was deferred
+                cnt = self._index_queued_words(
+                    session, JobQueue(INDEX_JOB_KIND), INDEX_CHUNK_SIZE, limit
+                )
+                self.update_word_frequencies(session)
+                return cnt
 
-                def iter_roots():
-                    """ Iterate the roots to be scraped """
-                    for r in session.query(Root).filter(Root.scrape == True).all():
-                        yield r
+            if enqueue:
+                # Add the articles to be parsed to the persistent job queue
+                q = session.query(ArticleRow.url).filter(ArticleRow.scraped != None)
+                if reparse:
+                    q = q.filter(ArticleRow.parser_version < version)
+                else:
+                    q = q.filter(ArticleRow.tree == None)
+                q = q.filter(ArticleRow.root_id != None)
+                if limit > 0:
+                    q = q.limit(limit)
+                count = JobQueue(JOB_KIND).enqueue(session, q)
+                logging.info("{0} articles added to the job queue".format(count))
+                return 0
 
-                # Use a multiprocessing pool to scrape the roots
+            if urls is None and uuid is None and not reparse and not queue:
 
-                with Pool(CPU_COUNT) as pool:
-                    try:
-                        for _ in pool.imap_unordered(
-                            self._scrape_single_root, iter_roots()
-                        ):
-                            pass
-                    except Exception as e:
-                        logging.warning("Caught exception: {0}".format(e))
-                    pool.close()
-                    pool.join()
+                # Go through the roots and scrape them, inserting into the articles table
+                self.scrape_roots(
+                    session, session.query(Root).filter(Root.scrape == True).all()
+                )
 
                 # noinspection PyComparisonWithNone
                 def iter_unscraped_articles():
                     """ Go through any unscraped articles and scrape them """
                     # Note that the query(ArticleRow) below cannot be directly changed
                     # to query(ArticleRow.root, ArticleRow.url) since
-                    # ArticleRow.root is a joined subrecord
+                    # ArticleRow.root is a joined subrecord. The large content
+                    # columns of ArticleRow are deferred and thus not loaded.
                     seq = 0
                     for a in (
                         session.query(ArticleRow)
@@ -311,12 +528,16 @@ class Scraper:
                         yield ArticleDescr(seq, a.root, a.url)
                         seq += 1
 
-                # Use a multiprocessing pool to scrape the articles
+                # Fetch the articles concurrently in a pool of threads, and
+                # analyze and store them in a multiprocessing pool. Fetching is
+                # network-bound, so the number of concurrent requests does not
+                # depend on the number of CPUs.
 
                 with Pool(CPU_COUNT) as pool:
                     try:
                         for _ in pool.imap_unordered(
-                            self._scrape_single_article, iter_unscraped_articles()
+                            self._scrape_single_article,
+                            self.fetch_articles(list(iter_unscraped_articles())),
                         ):
                             pass
                     except Exception as e:
@@ -330,7 +551,8 @@ class Scraper:
                 # Fetch 100 rows at a time
                 # Note that the query(ArticleRow) below cannot be directly changed
                 # to query(ArticleRow.root, ArticleRow.url) since
-                # ArticleRow.root is a joined subrecord
+                # ArticleRow.root is a joined subrecord. The large content
+                # columns of ArticleRow are deferred and thus not loaded.
                 q = session.query(ArticleRow).filter(ArticleRow.scraped != None)
                 if reparse:
                     # Reparse articles that were originally parsed with an older
@@ -376,53 +598,60 @@ class Scraper:
                     # Found the article: yield it
                     yield ArticleDescr(0, a.root, a.url)
 
-            # Distribute the load between the CPUs, although never exceeding
-            # 100 articles per CPU per process cycle
+            # Report progress (and claim jobs from the job queue)
+            # in chunks of 100 articles per CPU
             if limit > 0:
                 CHUNK_SIZE = min(100 * CPU_COUNT, limit)
             else:
                 CHUNK_SIZE = 100 * CPU_COUNT
-            if uuid is not None:
-                g = iter_uuid(uuid)
-                limit = 0
-            elif urls is not None:
-                g = iter_urls(urls)
-                limit = 0
-            else:
-                g = iter_unparsed_articles(reparse, limit)
-            cnt = 0
-            while True:
-                adlist = []
-                lcnt = 0
-                for ad in g:
-                    adlist.append(ad)
-                    lcnt += 1
-                    if lcnt == CHUNK_SIZE or (0 < limit <= cnt + lcnt):
-                        break
-                if lcnt:
-                    # Run garbage collection to minimize common memory footprint
-                    gc.collect()
-                    logging.info(
-                        "Parser processes forking, chunk of {0} articles".format(lcnt)
-                    )
-                    with Pool(CPU_COUNT) as pool:
-                        try:
-                            for _ in pool.imap_unordered(self._parse_single_article, adlist):
-                                pass
-                        except Exception as e:
-                            logging.warning("Caught exception: {0}".format(e))
-                        pool.close()
-                        pool.join()
-                    cnt += lcnt
-                    logging.info(
-                        "Parser processes joined, chunk of {0} articles parsed, "
-                        "total {1}".format(lcnt, cnt)
+
+            # Use a pool of long-lived worker processes to parse the articles.
+            # The workers are forked after the parser and its grammar have
+            # been loaded (by parser_version() above), so they start out warm
+            # and share that memory with the parent. To contain memory creep,
+            # a worker is recycled after a number of articles or when its
+            # resident memory grows beyond a limit.
+            logging.info("Parser processes forking")
+            with WorkerPool(
+                self._parse_single_article,
+                CPU_COUNT,
+                max_tasks=Settings.PARSER_MAX_TASKS,
+                max_rss=Settings.PARSER_MAX_RSS_MB,
+                on_exit=self.worker_stats,
+            ) as pool:
+                if queue:
+                    # Parse articles from the persistent job queue, which
+                    # may be shared with scrapers running on other hosts
+                    cnt = self._parse_queued_articles(
+                        session, JobQueue(JOB_KIND), CHUNK_SIZE, pool, limit
                     )
-                if lcnt < CHUNK_SIZE:
-                    break
+                else:
+                    if uuid is not None:
+                        g = iter_uuid(uuid)
+                    elif urls is not None:
+                        g = iter_urls(urls)
+                    else:
+                        g = iter_unparsed_articles(reparse, limit)
+                    cnt = 0
+                    for _ in pool.imap_unordered(g):
+                        cnt += 1
+                        if cnt % CHUNK_SIZE == 0:
+                            logging.info("{0} articles parsed".format(cnt))
+            # Bring the word frequency rollup up to date with the
+            # words of the newly parsed articles
+            self.update_word_frequencies(session)
             # Return the total number of articles parsed
             return cnt
 
+    @staticmethod
+    def worker_stats():
+        """ Log the statistics of a parser worker process as it exits """
+        logging.info(
+            "Parser process {0} entity recognizer caches: {1}".format(
+                os.getpid(), cache_stats()
+            )
+        )
+
     @staticmethod
     def stats():
         """ Return statistics from the scraping database """
@@ -477,8 +706,19 @@ class Scraper:
             )
         )
 
+        logging.info("Database connection pool: {0}".format(db.pool_status()))
 
-def scrape_articles(reparse=False, limit=0, urls=None, uuid=None, numprocs=None):
+
+def scrape_articles(
+    reparse=False,
+    limit=0,
+    urls=None,
+    uuid=None,
+    numprocs=None,
+    enqueue=False,
+    queue=False,
+    index=False,
+):
 
     # Create kwargs dict that will be passed to Scraper.go()
     kwargs = dict(locals())
@@ -488,6 +728,13 @@ def scrape_articles(reparse=False, limit=0, urls=None, uuid=None, numprocs=None)
         logging.info("Parsing single article with UUID {0}".format(uuid))
     elif urls is not None:
         logging.info("URLs read from: {0}".format(urls))
+    elif index:
+        logging.info("Indexing words of queued articles, limit: {0}".format(limit))
+    elif enqueue:
+        logging.info(
+            "Adding articles to job queue, limit: {0}, reparse: {1}"
+            .format(limit, reparse)
+        )
     else:
         ncpus = numprocs or cpu_count()
         logging.info(
@@ -536,6 +783,15 @@ __doc__ = """
         -u filename, --urls=filename: Reparse the URLs listed in the given file
         -d uuid, --uuid=filename: Reparse the article having the given UUID
         -l N, --limit=N: Limit parsing session to N articles (default 10)
+        -n N, --numprocs=N: Number of parser processes (default: CPU count)
+        --enqueue: Add articles to be parsed (or reparsed, with --reparse)
+                   to the persistent job queue, without parsing them
+        --queue: Parse articles from the job queue, without scraping.
+                 Several scrapers, on different hosts, can work on the
+                 same queue; jobs that are not completed are retried.
+        --index: Index the words of articles that were stored while
+                 word indexing was deferred (GREYNIR_DEFER_WORD_INDEX=1),
+                 in batches, without scraping or parsing.
 
     If --reparse is not specified, the scraper will read all previously
     unseen articles from the root domains and then proceed to parse any
@@ -559,7 +815,19 @@ def main(argv=None):
             opts, _ = getopt.getopt(
                 argv[1:],
                 "hirbl:u:d:n:",
-                ["help", "init", "reparse", "debug", "limit=", "urls=", "uuid=", "numprocs="],
+                [
+                    "help",
+                    "init",
+                    "reparse",
+                    "debug",
+                    "limit=",
+                    "urls=",
+                    "uuid=",
+                    "numprocs=",
+                    "enqueue",
+                    "queue",
+                    "index",
+                ],
             )
         except getopt.error as msg:
             raise Usage(msg)
@@ -571,6 +839,9 @@ def main(argv=None):
         uuid = None
         numprocs = None
         debug = False
+        enqueue = False
+        queue = False
+        index = False
 
         def parse_int(i):
             try:
@@ -605,6 +876,15 @@ def main(argv=None):
                 # Max number of processes to fork when parsing
                 # (default: use all CPU cores)
                 numprocs = parse_int(a)
+            elif o == "--enqueue":
+                # Add articles to the job queue instead of parsing them
+                enqueue = True
+            elif o == "--queue":
+                # Parse articles from the job queue
+                queue = True
+            elif o == "--index":
+                # Index the words of articles queued for word indexing
+                index = True
 
         # Set logging format
         logging.basicConfig(
@@ -626,7 +906,14 @@ def main(argv=None):
         else:
             # Run the scraper
             scrape_articles(
-                reparse=reparse, limit=limit, urls=urls, uuid=uuid, numprocs=numprocs
+                reparse=reparse,
+                limit=limit,
+                urls=urls,
+                uuid=uuid,
+                numprocs=numprocs,
+                enqueue=enqueue,
+                queue=queue,
+                index=index,
             )
 
     except Usage as err:
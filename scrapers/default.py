@@ -29,10 +29,12 @@
 import re
 import logging
 import urllib.parse as urlparse
-import requests
 from datetime import datetime
 from bs4 import BeautifulSoup, NavigableString, Tag
 
+from settings import Settings
+from httpfetch import get_session
+
 
 MODULE_NAME = __name__
 
@@ -1488,7 +1490,7 @@ class HagstofanScraper(ScrapeHelper):
     def fetch_url(self, url):
         # Requests defaults to ISO-8859-1 because content-type
         # does not declare encoding. In fact, charset is UTF-8.
-        r = requests.get(url)
+        r = get_session().get(url, timeout=Settings.FETCH_TIMEOUT)
         r.encoding = r.apparent_encoding
         return r.text
 
@@ -0,0 +1,10 @@
+#!/bin/bash
+
+# Incremental model update, folding newly parsed articles into the
+# LSI model, followed by retagging of all articles with the updated
+# model. This is run once a week by cron; full model rebuilds
+# (python builder.py model) are only needed occasionally.
+cd ~/Greynir/vectors
+source venv/bin/activate
+python builder.py update && python builder.py --all --workers=4 --notify tag
+deactivate
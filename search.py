@@ -29,6 +29,7 @@
 from typing import Optional, List, Dict, Any
 
 from datetime import timedelta
+from collections import defaultdict
 
 from settings import Settings
 from db.models import Root, Article
@@ -92,13 +93,26 @@ class Search:
     @classmethod
     def list_articles(cls, session, result, n):
         """ Convert similarity result tuples into article descriptors """
+        # Skip the original article (or at least verbatim copies of it)
+        result = [(sid, sim) for sid, sim in result if sim <= 0.9999]
+        if not result:
+            return []
+        # Fetch the displayed columns of all the articles in a single query
+        q = (
+            session.query(Article)
+            .join(Root)
+            .filter(Article.id.in_([sid for sid, _ in result]))
+            .with_entities(
+                Article.id, Article.heading, Article.url, Article.timestamp, Root.domain
+            )
+        )
+        rows = {sa.id: sa for sa in q}
         similar = []  # type: List[Dict[str, Any]]
+        # Indices of the entries in the similar list, by domain,
+        # since only articles from the same domain can be duplicates
+        by_domain = defaultdict(list)  # type: Dict[str, List[int]]
         for sid, similarity in result:
-            if similarity > 0.9999:
-                # The original article (or at least a verbatim copy of it)
-                continue
-            q = session.query(Article).join(Root).filter(Article.id == sid)
-            sa = q.one_or_none()
+            sa = rows.get(sid)
             if (
                 sa and sa.heading and sa.heading.strip()
             ):  # Skip articles without headings
@@ -106,11 +120,9 @@ class Search:
                 spercent = 100.0 * similarity
 
                 def is_probably_same_as(last):
-                    """ Return True if the current article is probably different from
-                        the one already described in the last object """
-                    if last["domain"] != sa.root.domain:
-                        # Another root domain: can't be the same content
-                        return False
+                    """ Return True if the current article is probably the same as
+                        the one already described in the last object, which
+                        is from the same root domain """
                     if abs(last["ts"] - sa.timestamp) > timedelta(minutes=10):
                         # More than 10 minutes timestamp difference
                         return False
@@ -122,7 +134,7 @@ class Search:
                                 "Rejecting {0}, domain {1}, ts {2} because of similarity with {3},"
                                 " {4}, {5}; ratio is {6:.3f}".format(
                                     sa.heading,
-                                    sa.root.domain,
+                                    sa.domain,
                                     sa.timestamp,
                                     last["heading"],
                                     last["domain"],
@@ -136,7 +148,8 @@ class Search:
                 def gen_similar():
                     """ Generate the entries in the result list that are probably
                         the same as the one we are considering """
-                    for ix, p in enumerate(similar):
+                    for ix in by_domain[sa.domain]:
+                        p = similar[ix]
                         if is_probably_same_as(p):
                             yield (ix, p)
 
@@ -144,7 +157,7 @@ class Search:
                     heading=sa.heading,
                     url=sa.url,
                     uuid=sid,
-                    domain=sa.root.domain,
+                    domain=sa.domain,
                     ts=sa.timestamp,
                     ts_text=sa.timestamp.isoformat()[0:10],
                     similarity=spercent,
@@ -154,6 +167,7 @@ class Search:
                 same = next(gen_similar(), None)
                 if same is None:
                     # No similar article
+                    by_domain[sa.domain].append(len(similar))
                     similar.append(d)
                     if len(similar) == n:
                         # Enough articles: we're done
@@ -213,6 +213,40 @@ class Settings:
             "Invalid environment variable value: DB_PORT={0}".format(DB_PORT_STR)
         )
 
+    # Database connection pool of each process: number of connections kept
+    # open, additional connections allowed under load, seconds to wait for
+    # a connection, and maximum age of a connection in seconds (-1 = none).
+    # Connections are tested before use if DB_PRE_PING is set. If
+    # DB_PGBOUNCER is set, connections are not pooled in the process,
+    # leaving that to an external pooler such as pgbouncer.
+    DB_POOL_SIZE_STR = os.environ.get("GREYNIR_DB_POOL_SIZE", "5")
+    DB_MAX_OVERFLOW_STR = os.environ.get("GREYNIR_DB_MAX_OVERFLOW", "10")
+    DB_POOL_TIMEOUT_STR = os.environ.get("GREYNIR_DB_POOL_TIMEOUT", "30")
+    DB_POOL_RECYCLE_STR = os.environ.get("GREYNIR_DB_POOL_RECYCLE", "1800")
+    DB_PRE_PING_STR = os.environ.get("GREYNIR_DB_PRE_PING", "1")
+    DB_PGBOUNCER_STR = os.environ.get("GREYNIR_DB_PGBOUNCER", "0")
+    try:
+        DB_POOL_SIZE = int(DB_POOL_SIZE_STR)
+        DB_MAX_OVERFLOW = int(DB_MAX_OVERFLOW_STR)
+        DB_POOL_TIMEOUT = float(DB_POOL_TIMEOUT_STR)
+        DB_POOL_RECYCLE = int(DB_POOL_RECYCLE_STR)
+        DB_PRE_PING = bool(int(DB_PRE_PING_STR))
+        DB_PGBOUNCER = bool(int(DB_PGBOUNCER_STR))
+    except ValueError:
+        raise ConfigError(
+            "Invalid environment variable value: GREYNIR_DB_POOL_SIZE={0}, "
+            "GREYNIR_DB_MAX_OVERFLOW={1}, GREYNIR_DB_POOL_TIMEOUT={2}, "
+            "GREYNIR_DB_POOL_RECYCLE={3}, GREYNIR_DB_PRE_PING={4}, "
+            "GREYNIR_DB_PGBOUNCER={5}".format(
+                DB_POOL_SIZE_STR,
+                DB_MAX_OVERFLOW_STR,
+                DB_POOL_TIMEOUT_STR,
+                DB_POOL_RECYCLE_STR,
+                DB_PRE_PING_STR,
+                DB_PGBOUNCER_STR,
+            )
+        )
+
     # Flask server host and port
     HOST = os.environ.get("GREYNIR_HOST", "localhost")
     PORT_STR = os.environ.get("GREYNIR_PORT", "5000")
@@ -238,6 +272,21 @@ class Settings:
             )
         )
 
+    # Size of the similarity client's connection pool, and the timeout
+    # in seconds of each call to the similarity server
+    SIMSERVER_POOL_SIZE_STR = os.environ.get("SIMSERVER_POOL_SIZE", "4")
+    SIMSERVER_TIMEOUT_STR = os.environ.get("SIMSERVER_TIMEOUT", "5.0")
+    try:
+        SIMSERVER_POOL_SIZE = int(SIMSERVER_POOL_SIZE_STR)
+        SIMSERVER_TIMEOUT = float(SIMSERVER_TIMEOUT_STR)
+    except ValueError:
+        raise ConfigError(
+            "Invalid environment variable value: SIMSERVER_POOL_SIZE={0}, "
+            "SIMSERVER_TIMEOUT={1}".format(
+                SIMSERVER_POOL_SIZE_STR, SIMSERVER_TIMEOUT_STR
+            )
+        )
+
     if SIMSERVER_PORT == PORT:
         raise ConfigError(
             "Can't run both main server and "
@@ -284,6 +333,63 @@ class Settings:
             )
         )
 
+    # Parser worker processes in the scraper are recycled after this many
+    # articles, or when their resident memory exceeds this many megabytes
+    # (0 = no limit)
+    PARSER_MAX_TASKS_STR = os.environ.get("GREYNIR_PARSER_MAX_TASKS", "500")
+    PARSER_MAX_RSS_STR = os.environ.get("GREYNIR_PARSER_MAX_RSS_MB", "2048")
+    try:
+        PARSER_MAX_TASKS = int(PARSER_MAX_TASKS_STR)
+        PARSER_MAX_RSS_MB = int(PARSER_MAX_RSS_STR)
+    except ValueError:
+        raise ConfigError(
+            "Invalid environment variable value: "
+            "GREYNIR_PARSER_MAX_TASKS={0}, GREYNIR_PARSER_MAX_RSS_MB={1}".format(
+                PARSER_MAX_TASKS_STR, PARSER_MAX_RSS_STR
+            )
+        )
+
+    # HTTP fetching in the scraper: number of concurrent requests in total
+    # and per domain, minimum interval between the starts of requests to
+    # the same domain (seconds), and request timeout (seconds)
+    FETCH_THREADS_STR = os.environ.get("GREYNIR_FETCH_THREADS", "16")
+    FETCH_PER_DOMAIN_STR = os.environ.get("GREYNIR_FETCH_PER_DOMAIN", "4")
+    FETCH_INTERVAL_STR = os.environ.get("GREYNIR_FETCH_INTERVAL", "0.25")
+    FETCH_TIMEOUT_STR = os.environ.get("GREYNIR_FETCH_TIMEOUT", "20")
+    try:
+        FETCH_THREADS = int(FETCH_THREADS_STR)
+        FETCH_PER_DOMAIN = int(FETCH_PER_DOMAIN_STR)
+        FETCH_INTERVAL = float(FETCH_INTERVAL_STR)
+        FETCH_TIMEOUT = float(FETCH_TIMEOUT_STR)
+    except ValueError:
+        raise ConfigError(
+            "Invalid environment variable value: GREYNIR_FETCH_THREADS={0}, "
+            "GREYNIR_FETCH_PER_DOMAIN={1}, GREYNIR_FETCH_INTERVAL={2}, "
+            "GREYNIR_FETCH_TIMEOUT={3}".format(
+                FETCH_THREADS_STR,
+                FETCH_PER_DOMAIN_STR,
+                FETCH_INTERVAL_STR,
+                FETCH_TIMEOUT_STR,
+            )
+        )
+
+    # Defer the indexing of the word stems of stored articles to a separate,
+    # batched indexing stage (scraper.py --index) instead of indexing them
+    # in the same transaction as the article itself
+    DEFER_WORD_INDEX_STR = os.environ.get("GREYNIR_DEFER_WORD_INDEX", "0")
+    try:
+        DEFER_WORD_INDEX = bool(int(DEFER_WORD_INDEX_STR))
+    except ValueError:
+        raise ConfigError(
+            "Invalid environment variable value: GREYNIR_DEFER_WORD_INDEX={0}".format(
+                DEFER_WORD_INDEX_STR
+            )
+        )
+
+    # File for persisting the in-memory index of entity names
+    # (see nertokenizer.py), or None to always build it from the database
+    ENTITY_INDEX_FILE = os.environ.get("GREYNIR_ENTITY_INDEX_FILE") or None
+
     # Configuration settings from the Greynir.conf file
 
     @staticmethod
@@ -317,6 +423,10 @@ class Settings:
                 Settings.SIMSERVER_HOST = val
             elif par == "simserver_port":
                 Settings.SIMSERVER_PORT = int(val)
+            elif par == "simserver_pool_size":
+                Settings.SIMSERVER_POOL_SIZE = int(val)
+            elif par == "simserver_timeout":
+                Settings.SIMSERVER_TIMEOUT = float(val)
             elif par == "debug":
                 Settings.DEBUG = bool(val)
             else:
@@ -27,6 +27,7 @@
 
 import os
 import sys
+import struct
 from contextlib import closing
 from multiprocessing.connection import Connection, answer_challenge, deliver_challenge
 
@@ -37,15 +38,19 @@ from settings import Settings
 # Under Gunicorn/eventlet, the socket class is 'monkey-patched' in ways
 # that are not compatible with multiprocessing.connection.Connection().
 # We make sure that we obtain access to the original, non-patched
-# socket module. This, alas, means that our calls to the similarity
-# server are truly blocking, even under Gunicorn/eventlet.
+# socket and threading modules. Calls to the similarity server are
+# blocking, and are therefore run in eventlet's pool of real OS threads
+# (eventlet.tpool), so that other green threads can run in the meantime.
 
 try:
     import eventlet
+    from eventlet import tpool
     USING_EVENTLET = True
     socket = eventlet.patcher.original("socket")
+    threading = eventlet.patcher.original("threading")
 except ImportError:
     import socket  # type: ignore
+    import threading  # type: ignore
     USING_EVENTLET = False
 
 # The following two functions replicate and hack/tweak corresponding functions
@@ -55,17 +60,26 @@ except ImportError:
 # that eventlet inserts instead of the original socket class.
 
 
-def _SocketClient(address):
-    """ Return a connection object connected to the socket given by `address` """
+def _SocketClient(address, timeout):
+    """ Return a connection object connected to the socket given by `address`.
+        Reads and writes on the connection fail with an OSError if they
+        take longer than `timeout` seconds. """
     with closing(socket.socket(socket.AF_INET)) as s:
-        s.setblocking(True)
+        s.settimeout(timeout)
         s.connect(address)
+        s.setblocking(True)
+        # The connection does blocking reads and writes on the raw file
+        # descriptor, so the timeout is enforced by the kernel instead
+        sec = int(timeout)
+        tv = struct.pack("ll", sec, int((timeout - sec) * 1e6))
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVTIMEO, tv)
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_SNDTIMEO, tv)
         return Connection(s.detach())
 
 
-def _Client(address, authkey=None):
+def _Client(address, authkey=None, timeout=None):
     """ Returns a connection to the address of a `Listener` """
-    c = _SocketClient(address)
+    c = _SocketClient(address, timeout)
     if authkey is not None:
         if not isinstance(authkey, bytes):
             raise TypeError("Expected a byte string as an authentication key")
@@ -77,22 +91,31 @@ def _Client(address, authkey=None):
 class SimilarityClient:
 
     """ A client that interacts with the similarity server over a
-        TCP socket, typically on port 5001 """
+        TCP socket, typically on port 5001. The client keeps a small
+        pool of connections to the server, so that it can be shared
+        by concurrent threads or green threads, each call using its
+        own connection. A call that does not complete within the
+        timeout returns an empty result. """
 
     BASE_PATH = os.path.dirname(os.path.realpath(__file__))
     KEY_FILE = os.path.join(BASE_PATH, "resources", "SimilarityServerKey.txt")
 
-    def __init__(self):
-        self._conn = None
+    def __init__(self, pool_size=None, timeout=None):
+        self._timeout = timeout or Settings.SIMSERVER_TIMEOUT
+        # Limits the number of connections that are open at a time
+        self._slots = threading.BoundedSemaphore(
+            pool_size or Settings.SIMSERVER_POOL_SIZE
+        )
+        # Connections that are not in use
+        self._lock = threading.Lock()
+        self._idle = []
 
     def _connect(self):
-        """ Connect to a similarity server, with authentication """
-        if self._conn is not None:
-            # Already connected
-            return
+        """ Connect to a similarity server, with authentication.
+            Returns the connection, or None if unable to connect. """
         if not Settings.SIMSERVER_PORT:
             # No similarity server configured
-            return
+            return None
         try:
             with open(self.KEY_FILE, "rb") as file:
                 secret_password = file.read()
@@ -104,10 +127,10 @@ class SimilarityClient:
                 )
             )
             sys.stdout.flush()
-            return
+            return None
         address = (Settings.SIMSERVER_HOST, Settings.SIMSERVER_PORT)
         try:
-            self._conn = _Client(address, authkey=secret_password)
+            return _Client(address, authkey=secret_password, timeout=self._timeout)
         except Exception as ex:
             print(
                 "Unable to connect to similarity server at {0}:{1}; error {2}".format(
@@ -115,43 +138,66 @@ class SimilarityClient:
                 )
             )
             sys.stdout.flush()
-            # Leave self._conn set to None
+            return None
+
+    def _call(self, request, reply):
+        """ Send a request to the server, and return its reply if one is
+            expected, or None if the call failed. Under a monkey-patched
+            eventlet, the call runs in a real OS thread, so that it does not
+            block the other green threads. """
+        if USING_EVENTLET and eventlet.patcher.is_monkey_patched("socket"):
+            return tpool.execute(self._request, request, reply)
+        return self._request(request, reply)
+
+    def _request(self, request, reply):
+        """ Send a request on a pooled connection, retrying on a new
+            connection if the server has closed the connection in the
+            meantime. A connection where a call fails or times out is
+            closed, since a late reply could otherwise be mistaken for
+            the reply to the next call on it. """
+        if not self._slots.acquire(timeout=self._timeout):
+            print("Timed out waiting for a similarity server connection")
+            sys.stdout.flush()
+            return None
+        try:
+            retries = 0
+            while retries < 2:
+                with self._lock:
+                    conn = self._idle.pop() if self._idle else None
+                if conn is None:
+                    conn = self._connect()
+                    if conn is None:
+                        break
+                try:
+                    conn.send(request)
+                    result = conn.recv() if reply else True
+                except (EOFError, ConnectionError):
+                    # Stale connection: close it and try again
+                    conn.close()
+                    retries += 1
+                    continue
+                except OSError as ex:
+                    # Timeout or other error: give up on this call
+                    conn.close()
+                    print("Similarity server call failed; error {0}".format(ex))
+                    sys.stdout.flush()
+                    break
+                with self._lock:
+                    self._idle.append(conn)
+                return result
+            return None
+        finally:
+            self._slots.release()
 
     def _retry_list(self, **kwargs):
-        """ Connect to the server and send it a request, retrying if the
-            server has closed the connection in the meantime. Return a
-            dict with a result list or an empty list if no connection. """
-        retries = 0
-        while retries < 2:
-            self._connect()
-            if self._conn is None:
-                break
-            try:
-                self._conn.send(kwargs)
-                return self._conn.recv()
-            except (EOFError, BlockingIOError):
-                self.close()
-                retries += 1
-                continue
-        return dict(articles=[])
+        """ Send a request to the server and return its reply, a dict
+            with a result list, or an empty list if the call failed """
+        result = self._call(kwargs, reply=True)
+        return dict(articles=[]) if result is None else result
 
     def _retry_cmd(self, **kwargs):
-        """ Connect to the server and send it a command, retrying if the
-            server has closed the connection in the meantime. """
-        retries = 0
-        while retries < 2:
-            self._connect()
-            if self._conn is None:
-                break
-            try:
-                self._conn.send(kwargs)
-                # Successful: we're done
-                return
-            except EOFError:
-                # Close the connection from the client side and re-connect
-                self.close()
-                retries += 1
-                continue
+        """ Send a command to the server, without waiting for a reply """
+        self._call(kwargs, reply=False)
 
     def list_similar_to_article(self, article_id, n=10):
         """ Returns a dict containing a list of (article_id, similarity) tuples """
@@ -167,6 +213,15 @@ class SimilarityClient:
             list of (article_id, similarity) tuples """
         return self._retry_list(cmd="similar", terms=terms, n=n)
 
+    def list_similar_batch(self, queries, n=10):
+        """ Run several similarity queries in a single round trip to the
+            server. Each query is a dict with an id, topic or terms key,
+            as in the methods above, and optionally n. Returns a list of
+            result dicts, in the same order as the queries. """
+        requests = [dict(q, cmd="similar", n=q.get("n", n)) for q in queries]
+        result = self._retry_list(cmd="batch", requests=requests)
+        return result.get("results") or [dict(articles=[]) for _ in queries]
+
     def refresh_topics(self):
         """ Cause the server to refresh article topic vectors from the database """
         self._retry_cmd(cmd="refresh")
@@ -176,7 +231,8 @@ class SimilarityClient:
         self._retry_cmd(cmd="reload")
 
     def close(self):
-        """ Close a client connection """
-        if self._conn is not None:
-            self._conn.close()
-            self._conn = None
+        """ Close the client's idle connections """
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
@@ -0,0 +1,130 @@
+"""
+
+    Greynir: Natural language processing for Icelandic
+
+    Copyright (C) 2020 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+
+    Tests for the database connection pool of Scraper_DB (db/__init__.py),
+    using an SQLite database in place of PostgreSQL
+
+"""
+
+import os, sys
+import time
+import sqlite3
+
+import pytest
+
+# Shenanigans to enable Pytest to discover modules in the
+# main workspace directory (the parent of /tests)
+basepath, _ = os.path.split(os.path.realpath(__file__))
+mainpath = os.path.join(basepath, "..")
+if mainpath not in sys.path:
+    sys.path.insert(0, mainpath)
+
+import sqlalchemy
+from sqlalchemy.pool import QueuePool
+
+import db
+from settings import Settings
+
+
+class TrackedConnection(sqlite3.Connection):
+
+    """ An SQLite connection that records the calls made on it """
+
+    # All connections opened, in order
+    opened = []
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.calls = []
+        TrackedConnection.opened.append(self)
+
+    def cursor(self, *args, **kwargs):
+        self.calls.append("cursor")
+        return super().cursor(*args, **kwargs)
+
+    def rollback(self):
+        self.calls.append("rollback")
+        return super().rollback()
+
+    def close(self):
+        self.calls.append("close")
+        return super().close()
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="requires os.fork()")
+def test_fork_safe_pool(tmpdir, monkeypatch):
+    path = str(tmpdir.join("test.db"))
+
+    def sqlite_engine(conn_str, **kwargs):
+        return sqlalchemy.create_engine(
+            "sqlite://",
+            creator=lambda: sqlite3.connect(
+                path, factory=TrackedConnection, check_same_thread=False
+            ),
+            poolclass=QueuePool,
+            **kwargs
+        )
+
+    monkeypatch.setattr(db, "create_engine", sqlite_engine)
+    monkeypatch.setattr(Settings, "DB_PGBOUNCER", False)
+    monkeypatch.setattr(Settings, "DB_PRE_PING", True)
+    monkeypatch.setattr(Settings, "DB_POOL_RECYCLE", 1)
+    monkeypatch.setattr(TrackedConnection, "opened", [])
+
+    sdb = db.Scraper_DB()
+    session = sdb.session
+    assert session.execute("select 1").scalar() == 1
+    session.close()
+    inherited = list(TrackedConnection.opened)
+    assert len(inherited) == 1
+    assert sdb.pool_status()["checked_in"] == 1
+
+    # Let the pooled connection expire, so that a checkout in the
+    # child would recycle it (closing it) or else ping it
+    time.sleep(1.1)
+    for c in inherited:
+        c.calls.clear()
+
+    pid = os.fork()
+    if pid == 0:
+        # Child process: use the database and report whether
+        # the parent's connection was left alone
+        status = 1
+        try:
+            session = sdb.session
+            ok = session.execute("select 1").scalar() == 1
+            session.close()
+            if (
+                ok
+                and all(not c.calls for c in inherited)
+                and len(TrackedConnection.opened) == 2
+                and sdb.pool_status()["discarded"] == 1
+            ):
+                status = 0
+        finally:
+            os._exit(status)
+
+    _, status = os.waitpid(pid, 0)
+    assert os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0
+
+    # The parent still has its pool and its connection
+    assert sdb.pool_status()["discarded"] == 0
+    session = sdb.session
+    assert session.execute("select 1").scalar() == 1
+    session.close()
@@ -0,0 +1,159 @@
+"""
+
+    Greynir: Natural language processing for Icelandic
+
+    Copyright (C) 2020 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+
+    Tests for concurrent HTTP fetching (httpfetch.py),
+    using a local HTTP server stub
+
+"""
+
+import os, sys
+import time
+import threading
+from socketserver import ThreadingMixIn
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+# Shenanigans to enable Pytest to discover modules in the
+# main workspace directory (the parent of /tests)
+basepath, _ = os.path.split(os.path.realpath(__file__))
+mainpath = os.path.join(basepath, "..")
+if mainpath not in sys.path:
+    sys.path.insert(0, mainpath)
+
+import pytest
+
+import httpfetch
+from httpfetch import FetchPool, fetch
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+
+    """ An HTTP server that handles each request in a new thread
+        (http.server.ThreadingHTTPServer is only in Python 3.7+) """
+
+    daemon_threads = True
+
+
+class StubHandler(BaseHTTPRequestHandler):
+
+    """ Serves /doc/N with an ETag, fails /flaky once with 503
+        and takes its time with /slow """
+
+    lock = threading.Lock()
+    active = 0
+    max_active = 0
+    hits = dict()
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        cls = StubHandler
+        with cls.lock:
+            cls.active += 1
+            cls.max_active = max(cls.max_active, cls.active)
+            cls.hits[self.path] = cls.hits.get(self.path, 0) + 1
+            hits = cls.hits[self.path]
+        try:
+            if self.path == "/slow":
+                time.sleep(2.0)
+            else:
+                time.sleep(0.05)
+            if self.path == "/flaky" and hits == 1:
+                self.send_response(503)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            etag = '"{0}"'.format(self.path)
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.end_headers()
+                return
+            body = "<html><body>{0}</body></html>".format(self.path).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("ETag", etag)
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            with cls.lock:
+                cls.active -= 1
+
+
+@pytest.fixture(scope="module")
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    t = threading.Thread(target=httpd.serve_forever, daemon=True)
+    t.start()
+    yield "http://127.0.0.1:{0}".format(httpd.server_address[1])
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_fetch(server):
+    r = fetch(server + "/doc/1")
+    assert r.ok
+    assert "/doc/1" in r.text
+    assert r.etag == '"/doc/1"'
+
+    # A conditional request for an unchanged document
+    r2 = fetch(server + "/doc/1", r.validators)
+    assert r2.not_modified
+    assert not r2.ok
+    assert r2.etag == r.etag
+
+    # Transient server errors are retried
+    r3 = fetch(server + "/flaky")
+    assert r3.ok
+    assert StubHandler.hits["/flaky"] == 2
+
+    # Requests time out
+    r4 = fetch(server + "/slow", timeout=0.5)
+    assert r4.status == 0
+    assert not r4.ok
+
+    # The session is reused
+    assert httpfetch.get_session() is httpfetch.get_session()
+
+
+def test_fetch_pool(server):
+    # Wait for any timed-out request from the previous test to finish
+    while StubHandler.active:
+        time.sleep(0.1)
+    StubHandler.max_active = 0
+    urls = [server + "/doc/{0}".format(i) for i in range(12)]
+    pool = FetchPool(threads=8, per_domain=3, interval=0.0)
+    results = list(pool.fetch_all(urls))
+    assert sorted(r.url for r in results) == sorted(urls)
+    assert all(r.ok for r in results)
+    # All URLs are on the same domain, so at most 3 requests are concurrent
+    assert 1 < StubHandler.max_active <= 3
+
+    # Conditional requests for the same URLs
+    validators = {r.url: r.validators for r in results}
+    results = list(pool.fetch_all(urls, validators))
+    assert all(r.not_modified for r in results)
+
+    # Requests to the same domain are spaced by the rate limit
+    pool = FetchPool(threads=8, per_domain=8, interval=0.1)
+    t0 = time.monotonic()
+    results = list(pool.fetch_all(urls[0:5]))
+    assert time.monotonic() - t0 >= 0.4
+    assert len(results) == 5
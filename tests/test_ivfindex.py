@@ -0,0 +1,74 @@
+"""
+
+    Greynir: Natural language processing for Icelandic
+
+    Copyright (C) 2020 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+
+    Tests for the inverted file index of the similarity server
+    (vectors/ivfindex.py)
+
+"""
+
+import os, sys
+
+# Shenanigans to enable Pytest to discover modules in the
+# vectors directory (a sibling of /tests)
+basepath, _ = os.path.split(os.path.realpath(__file__))
+vectorspath = os.path.join(basepath, "..", "vectors")
+if vectorspath not in sys.path:
+    sys.path.insert(0, vectorspath)
+
+import pytest
+
+# NumPy is a requirement of the vectors directory only
+np = pytest.importorskip("numpy")
+
+from ivfindex import IVFIndex
+
+
+def clustered_matrix(rng, num_clusters, per_cluster, dims):
+    """ Return a matrix of unit vectors in well separated clusters """
+    centers = rng.standard_normal((num_clusters, dims))
+    m = np.repeat(centers, per_cluster, axis=0)
+    m += 0.1 * rng.standard_normal(m.shape)
+    m /= np.linalg.norm(m, axis=1, keepdims=True)
+    return m.astype(np.float32), centers
+
+
+def test_ivfindex_load(tmpdir):
+    rng = np.random.default_rng(3)
+    matrix, centers = clustered_matrix(rng, 8, 100, 16)
+    ivf = IVFIndex.train(matrix, 8, seed=1)
+    fname = str(tmpdir.join("ivf.npz"))
+    ivf.save(fname, "1|2020-01-01")
+
+    # Move some vectors to another cluster, as when articles are retagged
+    changed = [5, 150, 420]
+    target = centers[7] / np.linalg.norm(centers[7])
+    for ix in changed:
+        matrix[ix] = target
+
+    # A different model: the index is not loaded
+    assert IVFIndex.load(fname, matrix, "2|2020-02-01") is None
+
+    loaded = IVFIndex.load(fname, matrix, "1|2020-01-01")
+    assert loaded is not None
+    assert loaded.num_lists == ivf.num_lists
+    # All rows are assigned to lists anew, including the changed ones
+    assert np.array_equal(loaded.assign, IVFIndex.nearest(ivf.centroids, matrix))
+    rows, scores = loaded.search(matrix, 3, target.astype(np.float32), probes=1)
+    assert set(rows.tolist()) == set(changed)
+    assert np.all(scores > 0.99)
@@ -0,0 +1,125 @@
+"""
+
+    Greynir: Natural language processing for Icelandic
+
+    Copyright (C) 2020 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+
+    Tests for the topic matrix of the similarity server
+    (vectors/topicmatrix.py)
+
+"""
+
+import os, sys
+
+# Shenanigans to enable Pytest to discover modules in the
+# vectors directory (a sibling of /tests)
+basepath, _ = os.path.split(os.path.realpath(__file__))
+vectorspath = os.path.join(basepath, "..", "vectors")
+if vectorspath not in sys.path:
+    sys.path.insert(0, vectorspath)
+
+import pytest
+
+# NumPy is a requirement of the vectors directory only
+np = pytest.importorskip("numpy")
+
+from ivfindex import IVFIndex
+from topicmatrix import TopicMatrix
+
+
+def unit(dims, ix):
+    """ Return the unit vector along the given axis """
+    v = np.zeros(dims, dtype=np.float32)
+    v[ix] = 1.0
+    return v
+
+
+def test_topicmatrix_update():
+    dims = 8
+    ids = ["a{0}".format(i) for i in range(20)]
+    # Each article points in its own direction, close to axis 0
+    vectors = [unit(dims, 0) + 0.01 * (i + 1) * unit(dims, 1) for i in range(20)]
+    tm = TopicMatrix(dims).updated(ids, vectors)
+    assert len(tm) == 20
+    assert tm.dead == 0
+    assert tm.live.all()
+
+    # Replace one vector: its old row is dead until the matrix is compacted
+    tm2 = tm.updated(["a0"], [unit(dims, 2)])
+    assert len(tm2) == 20
+    assert tm2.dead == 1
+    assert len(tm2.ids) == 21
+    assert tm2.ids[0] is None
+    assert not tm2.live[0]
+    assert tm2.live[1:].all()
+    assert np.allclose(tm2.vector("a0"), unit(dims, 2))
+    # The earlier snapshot is unchanged
+    assert tm.dead == 0
+    assert tm.live.all()
+    assert len(tm.ids) == 20
+    assert np.allclose(tm.vector("a0"), tm.normalize([vectors[0]])[0])
+
+    # The dead row is never returned, even when all rows are asked for
+    result = tm2.most_similar(100, unit(dims, 0), exact=True)
+    assert len(result) == 20
+    assert sorted(article_id for article_id, _ in result) == sorted(ids)
+    assert result[-1][0] == "a0"
+    assert result[-1][1] < 0.01
+    result = tm2.most_similar(3, unit(dims, 2), exact=True)
+    assert result[0][0] == "a0"
+    assert abs(result[0][1] - 1.0) < 1.0e-6
+    assert len(result) == 3
+
+    # Replace enough vectors to trigger a compaction
+    tm3 = tm2.updated(["a1", "a2"], [unit(dims, 3), unit(dims, 4)])
+    assert tm3.dead == 0
+    assert len(tm3.ids) == 20
+    assert tm3.live.all()
+    assert None not in tm3.ids
+    assert all(tm3.ids[tm3.index[article_id]] == article_id for article_id in ids)
+    assert np.allclose(tm3.vector("a2"), unit(dims, 4))
+    assert tm3.most_similar(1, unit(dims, 3))[0][0] == "a1"
+
+
+def test_topicmatrix_ivf():
+    rng = np.random.default_rng(5)
+    dims = 16
+    ids = ["a{0}".format(i) for i in range(400)]
+    vectors = rng.standard_normal((400, dims)).astype(np.float32)
+    tm = TopicMatrix(dims).updated(ids, vectors)
+    tm.ivf = IVFIndex.train(tm.matrix, 4, seed=1)
+
+    # Move an article: the approximate search finds it at its new place
+    # but not at its old one
+    query = vectors[7]
+    tm2 = tm.updated(["a7"], [-query])
+    assert tm2.dead == 1
+    assert len(tm2.ivf.assign) == len(tm2.ids)
+    result = tm2.most_similar(10, query, probes=4)
+    assert len(result) == 10
+    assert "a7" not in [article_id for article_id, _ in result]
+    assert tm2.most_similar(1, -query, probes=4)[0][0] == "a7"
+    # The approximate search agrees with the exact one when probing all lists
+    assert result == tm2.most_similar(10, query, exact=True)
+
+    # The index follows the rows when the matrix is compacted
+    tm3 = tm2.compacted()
+    assert tm3.dead == 0
+    assert len(tm3.ivf.assign) == len(tm3.ids) == 400
+    assert np.array_equal(
+        tm3.ivf.assign, IVFIndex.nearest(tm3.ivf.centroids, tm3.matrix)
+    )
+    assert tm3.most_similar(10, query, probes=4) == result
@@ -0,0 +1,158 @@
+"""
+
+    Greynir: Natural language processing for Icelandic
+
+    Copyright (C) 2020 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+
+    Tests for loading stored parse trees (tree.py)
+
+"""
+
+from collections import OrderedDict, defaultdict
+import os, sys
+import json
+
+# Shenanigans to enable Pytest to discover modules in the
+# main workspace directory (the parent of /tests)
+basepath, _ = os.path.split(os.path.realpath(__file__))
+mainpath = os.path.join(basepath, "..")
+if mainpath not in sys.path:
+    sys.path.insert(0, mainpath)
+
+import pytest
+
+from reynir import tokenize
+from reynir.incparser import IncrementalParser
+from reynir.fastparser import Fast_Parser, ParseForestDumper
+from tree import Tree, TreeGist, TreeTokenList, TreeCodec
+from treeutil import TreeUtility
+
+
+@pytest.fixture(scope="module")
+def tree_string():
+    """ Create a tree string in the format stored by the scraper """
+    text = """
+
+       Jón Jónsson seðlabankastjóri keypti 3 hús á 15 milljónir króna
+       þann 3. mars 2020.
+
+       Ég skipti við flugfélagið AirBerlin áður en það varð gjaldþrota.
+
+       Hestinum fara hundur það með að á af.
+
+       Danska byggingavörukeðjan Bygma hefur keypt íslenska
+       verslunarfyrirtækið Húsasmiðjuna.
+
+    """
+    toklist = tokenize(text)
+    fp = Fast_Parser(verbose=False)
+    ip = IncrementalParser(fp, toklist, verbose=False)
+    trees = OrderedDict()
+    num_sent = 0
+    for p in ip.paragraphs():
+        for sent in p.sentences():
+            num_sent += 1
+            if sent.parse():
+                token_dicts = TreeUtility.dump_tokens(sent.tokens, sent.tree)
+                tree = ParseForestDumper.dump_forest(
+                    sent.tree, token_dicts=token_dicts
+                )
+                trees[num_sent] = "\n".join(
+                    ["C{0}".format(sent.score), "L{0}".format(len(sent)), tree]
+                )
+            else:
+                trees[num_sent] = "E{0}".format(sent.err_index)
+    return "".join("S{0}\n{1}\n".format(key, val) for key, val in trees.items())
+
+
+def test_load(tree_string):
+    data = TreeCodec.encode(tree_string)
+    assert len(data) < len(tree_string.encode("utf-8"))
+
+    # A lazy tree only builds sentence nodes when they are accessed
+    t = Tree()
+    t.load(tree_string)
+    assert len(t._pending) == 3
+    assert 3 not in t
+    assert t[2] is not None
+    assert len(t._pending) == 2
+
+    t1 = Tree(lazy=False)
+    t1.load(tree_string)
+    assert len(t1.s) == 3  # One sentence does not parse
+    for lazy, binary in ((True, False), (False, True), (True, True)):
+        t2 = Tree(lazy=lazy)
+        if binary:
+            t2.load_binary(data)
+        else:
+            t2.load(tree_string)
+        assert list(t1.s.keys()) == list(t2.s.keys())
+        assert t1.scores == t2.scores
+        assert t1.lengths == t2.lengths
+        for ix, sent in t1.sentences():
+            assert str(sent) == str(t2[ix])
+
+    l1 = TreeTokenList()
+    l1.load(tree_string)
+    l2 = TreeTokenList()
+    l2.load_stored(None, data)
+    assert list(l1.sentences()) == list(l2.sentences())
+
+    g1 = TreeGist()
+    g1.load(tree_string)
+    g2 = TreeGist()
+    g2.load_stored(tree_string, data)
+    assert g1.scores == g2.scores
+    assert g1.lengths == g2.lengths
+
+    with pytest.raises(ValueError):
+        TreeCodec.decode(b"XYZ" + data[3:])
+
+
+def test_word_bag():
+    """ The word bag recreated from stored token dicts matches
+        the one collected while parsing """
+    text = """
+
+       Jón Jónsson seðlabankastjóri keypti 3 hús af Önnu Guðmundsdóttur
+       fyrir 15 milljónir króna í gær.
+
+       Hestinum fara hundur það með að á af.
+
+       Danska byggingavörukeðjan Bygma hefur keypt íslenska
+       verslunarfyrirtækið Húsasmiðjuna.
+
+    """
+    fp = Fast_Parser(verbose=False)
+    ip = IncrementalParser(fp, tokenize(text), verbose=False)
+    words = defaultdict(int)
+    pgs = []
+    for p in ip.paragraphs():
+        pgs.append([])
+        for sent in p.sentences():
+            if sent.parse():
+                token_dicts = TreeUtility.dump_tokens(
+                    sent.tokens, sent.tree, words=words
+                )
+            else:
+                token_dicts = TreeUtility.dump_tokens(
+                    sent.tokens, None, error_index=sent.err_index
+                )
+            pgs[-1].append(token_dicts)
+    assert ("Anna Guðmundsdóttir", "person_kvk") in words
+    # Round-trip through JSON, as the token dicts are stored
+    stored = json.loads(json.dumps(pgs, ensure_ascii=False))
+    assert TreeUtility.word_bag(stored) == words
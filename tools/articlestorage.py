@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+"""
+
+    Greynir: Natural language processing for Icelandic
+
+    Copyright (C) 2020 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+
+    Utility script that reports on and configures the storage of the
+    large content columns of the articles table (html, tree, tree_bin,
+    tokens, topic_vector and topic_vector_bin).
+
+    PostgreSQL stores large column values out of line, in the TOAST
+    table belonging to the articles table, and compresses them. The
+    main table thus remains small, and sequential scans of it only read
+    the content columns that a query actually selects (see the deferred
+    columns in db/models.py).
+
+    On PostgreSQL 14 and later, --lz4 switches the compression of the
+    content columns from the default pglz to the faster and usually
+    tighter lz4. Only values written afterwards are affected; existing
+    values are recompressed as their articles are scraped or parsed
+    again, or in batches with --rewrite.
+
+"""
+
+import os
+import sys
+import time
+
+# Hack to make this Python program executable from the tools subdirectory
+basepath, _ = os.path.split(os.path.realpath(__file__))
+_TOOLS = os.sep + "tools"
+if basepath.endswith(_TOOLS):
+    basepath = basepath[0 : -len(_TOOLS)]
+    sys.path.append(basepath)
+
+from sqlalchemy import text
+
+from settings import Settings, ConfigError
+from db import SessionContext
+
+
+CONTENT_COLUMNS = (
+    "html",
+    "tree",
+    "tree_bin",
+    "tokens",
+    "topic_vector",
+    "topic_vector_bin",
+)
+
+_SIZES = """
+    select
+        pg_size_pretty(pg_relation_size('articles')) as main,
+        pg_size_pretty(pg_total_relation_size('articles')) as total,
+        pg_size_pretty(
+            coalesce(pg_total_relation_size(reltoastrelid), 0)
+        ) as toast
+    from pg_class where relname = 'articles';
+    """
+
+_COLUMN_SIZES = """
+    select {0}
+    from (select * from articles tablesample system (:percent)) as sample;
+    """
+
+
+def report(percent):
+    """ Print the size of the articles table and, based on a sample of
+        its rows, the average stored (compressed) and raw size of each
+        content column """
+    with SessionContext(commit=True, read_only=True) as session:
+        r = session.execute(text(_SIZES)).fetchone()
+        print(
+            "Table articles: {0} in main table, {1} in TOAST table, "
+            "{2} in total (including indexes)".format(r.main, r.toast, r.total)
+        )
+        cols = ", ".join(
+            "avg(pg_column_size({0})) as {0}_stored, "
+            "avg(octet_length({0})) as {0}_raw".format(c)
+            for c in CONTENT_COLUMNS
+        )
+        r = session.execute(
+            text(_COLUMN_SIZES.format(cols)), dict(percent=percent)
+        ).fetchone()
+        print("Average bytes per article in a {0}% sample:".format(percent))
+        for c in CONTENT_COLUMNS:
+            stored = getattr(r, c + "_stored") or 0
+            raw = getattr(r, c + "_raw") or 0
+            print(
+                "  {0:<14} {1:>10.0f} stored {2:>10.0f} raw  {3:5.1f}%".format(
+                    c, stored, raw, 100.0 * stored / raw if raw else 100.0
+                )
+            )
+
+
+def set_lz4():
+    """ Use lz4 compression for the content columns (PostgreSQL 14+) """
+    with SessionContext(commit=True) as session:
+        version = session.execute(text("show server_version_num;")).scalar()
+        if int(version) < 140000:
+            print("lz4 column compression requires PostgreSQL 14 or later")
+            return False
+        for c in CONTENT_COLUMNS:
+            session.execute(
+                text(
+                    "alter table articles alter column {0} "
+                    "set compression lz4;".format(c)
+                )
+            )
+    print("The content columns of the articles table now use lz4 compression")
+    return True
+
+
+def rewrite(batch_size):
+    """ Rewrite the content columns of all articles, in batches, so that
+        they are recompressed with the current compression method """
+    # Concatenating an empty value creates a new value, which is compressed
+    # anew, while assigning a column to itself would keep the old value
+    assignments = ", ".join(
+        "{0} = {0} || ''{1}".format(c, "::bytea" if c.endswith("_bin") else "")
+        for c in CONTENT_COLUMNS
+    )
+    stmt = text(
+        "update articles set {0} where url in ("
+        "select url from articles where url > :last_url order by url limit :limit"
+        ") returning url;".format(assignments)
+    )
+    last_url = ""
+    count = 0
+    t0 = time.time()
+    while True:
+        with SessionContext(commit=True) as session:
+            urls = [
+                r.url
+                for r in session.execute(
+                    stmt, dict(last_url=last_url, limit=batch_size)
+                )
+            ]
+        if not urls:
+            break
+        last_url = max(urls)
+        count += len(urls)
+        print(
+            "{0} articles rewritten in {1:.1f} seconds".format(count, time.time() - t0)
+        )
+    return count
+
+
+def main():
+
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Reports on and configures the storage of article content"
+    )
+    parser.add_argument(
+        "--sample",
+        dest="SAMPLE",
+        type=float,
+        default=1.0,
+        help="percentage of rows to sample for column sizes (default 1.0)",
+    )
+    parser.add_argument(
+        "--lz4",
+        dest="LZ4",
+        action="store_true",
+        default=False,
+        help="use lz4 compression for the content columns (PostgreSQL 14+)",
+    )
+    parser.add_argument(
+        "--rewrite",
+        dest="REWRITE",
+        action="store_true",
+        default=False,
+        help="recompress the content of all articles",
+    )
+    parser.add_argument(
+        "--batch",
+        dest="BATCH",
+        type=int,
+        default=500,
+        help="number of articles per transaction when rewriting (default 500)",
+    )
+    args = parser.parse_args()
+
+    try:
+        # Read configuration file
+        Settings.read(os.path.join(basepath, "config", "GreynirSimple.conf"))
+    except ConfigError as e:
+        print("Configuration error: {0}".format(e))
+        quit()
+
+    if args.LZ4 and not set_lz4():
+        return
+    if args.REWRITE:
+        rewrite(args.BATCH)
+    report(args.SAMPLE)
+
+
+if __name__ == "__main__":
+    main()
@@ -111,7 +111,7 @@ def gen_simple_trees(criteria):
         # Load tree from article
         try:
             tree = Tree(url=a.url, authority=a.authority)
-            tree.load(a.tree)
+            tree.load_stored(a.tree, a.tree_bin)
         except Exception as e:
             print("Exception loading tree in {0}: {1}".format(a.url, e))
             # Skip it
@@ -55,7 +55,7 @@ def gen_simple_trees(criteria, stats):
         tree = Tree(url = a.url, authority = a.authority)
         # Note the parse timestamp
         stats["parsed"] = a.parsed
-        tree.load(a.tree)
+        tree.load_stored(a.tree, a.tree_bin)
         for ix, stree in tree.simple_trees():
             yield stree, tree.score(ix), tree.length(ix)
 
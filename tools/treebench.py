@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+"""
+
+    Greynir: Natural language processing for Icelandic
+
+    Copyright (C) 2020 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+
+    Micro-benchmark for loading stored parse trees (see tree.py).
+
+    Trees are either sampled from the articles table (the default) or
+    read from a file containing trees in text format, separated by
+    empty lines. Each loader is timed over the whole sample, repeatedly,
+    and the best run is reported.
+
+    With --process, the memory used by fully loaded trees and the
+    throughput of Tree.process() are also measured, optionally running
+    a processor module from the processors directory.
+
+"""
+
+import os
+import sys
+import time
+import importlib
+import tracemalloc
+
+# Hack to make this Python program executable from the tools subdirectory
+basepath, _ = os.path.split(os.path.realpath(__file__))
+_TOOLS = os.sep + "tools"
+if basepath.endswith(_TOOLS):
+    basepath = basepath[0 : -len(_TOOLS)]
+    sys.path.append(basepath)
+
+from tree import TreeBase, Tree, TreeGist, TreeTokenList, TreeCodec
+
+
+def legacy_load(tree, txt):
+    """ The original line-splitting loader, for comparison """
+    for line in txt.split("\n"):
+        if not line:
+            continue
+        a = line.split(" ", maxsplit=1)
+        code = a[0]
+        n = int(code[1:])
+        f = getattr(tree, "handle_" + code[0], None)
+        if code[0] == "T":
+            tree.add_terminal(n, TreeBase._parse_T_slow(a[1]))
+        elif len(a) >= 2:
+            f(n, a[1])
+        else:
+            f(n)
+
+
+class NullSession:
+
+    """ Stand-in for an SQLAlchemy session that discards processor output """
+
+    def execute(self, *args, **kwargs):
+        pass
+
+    def add(self, row):
+        pass
+
+
+def bench_process(trees, processor, repeat):
+    """ Measure the memory footprint of fully loaded trees
+        and the throughput of Tree.process() """
+    tracemalloc.start()
+    loaded = []
+    for t in trees:
+        tree = Tree(lazy=False)
+        tree.load(t)
+        loaded.append(tree)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    num_nodes = sum(
+        1 + sum(1 for _ in sent.descendants())
+        for tree in loaded
+        for _, sent in tree.sentences()
+    )
+    print(
+        "{0:,} nodes use {1:,} bytes, {2:.0f} bytes/node".format(
+            num_nodes, size, size / num_nodes if num_nodes else 0.0
+        )
+    )
+    del loaded
+    session = NullSession()
+
+    def process(t):
+        tree = Tree(url="http://localhost/", lazy=False)
+        tree.load(t)
+        tree.process(session, processor)
+
+    name = "Tree.process({0})".format(processor.__name__ if processor else "")
+    best = bench(name, process, trees, repeat)
+    print(
+        "{0:<32} {1:8.0f} nodes/sec".format(
+            "Tree.process() throughput", num_nodes / best
+        )
+    )
+
+
+def sample_from_db(limit):
+    """ Fetch a sample of stored trees from the articles table """
+    from settings import Settings
+    from db import SessionContext
+    from db.models import Article
+
+    Settings.read(os.path.join(basepath, "config", "GreynirSimple.conf"))
+    with SessionContext(commit=True, read_only=True) as session:
+        q = (
+            session.query(Article.tree)
+            .filter(Article.tree != None)
+            .order_by(Article.parsed.desc())
+            .limit(limit)
+        )
+        return [r.tree for r in q]
+
+
+def sample_from_file(path):
+    """ Read trees in text format, separated by empty lines, from a file """
+    with open(path, "r", encoding="utf-8") as f:
+        return [t + "\n" for t in f.read().split("\n\n") if t.strip()]
+
+
+def bench(name, func, trees, repeat):
+    """ Time a loader function over all trees, returning the best time """
+    best = None
+    for _ in range(repeat):
+        TreeBase._parse_T.cache_clear()
+        t0 = time.perf_counter()
+        for t in trees:
+            func(t)
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    print(
+        "{0:<32} {1:8.1f} ms  {2:8.3f} ms/tree".format(
+            name, best * 1000.0, best * 1000.0 / len(trees)
+        )
+    )
+    return best
+
+
+def main():
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmarks parse tree loading")
+    parser.add_argument(
+        "--limit",
+        dest="LIMIT",
+        type=int,
+        default=200,
+        help="number of trees to sample from the database (default 200)",
+    )
+    parser.add_argument(
+        "--file",
+        dest="FILE",
+        type=str,
+        default=None,
+        help="read trees from a file instead of the database",
+    )
+    parser.add_argument(
+        "--repeat",
+        dest="REPEAT",
+        type=int,
+        default=5,
+        help="number of timed runs per loader (default 5)",
+    )
+    parser.add_argument(
+        "--process",
+        dest="PROCESS",
+        nargs="?",
+        const="",
+        default=None,
+        help="measure Tree.process(), optionally with the given processor module",
+    )
+    args = parser.parse_args()
+
+    trees = sample_from_file(args.FILE) if args.FILE else sample_from_db(args.LIMIT)
+    if not trees:
+        print("No trees to benchmark")
+        return
+    blobs = [TreeCodec.encode(t) for t in trees]
+    print(
+        "{0} trees, {1:,} bytes as text, {2:,} bytes in binary format".format(
+            len(trees),
+            sum(len(t.encode("utf-8")) for t in trees),
+            sum(len(b) for b in blobs),
+        )
+    )
+
+    loaders = [
+        ("Tree", lambda: Tree(lazy=False)),
+        ("Tree (lazy)", Tree),
+        ("TreeTokenList", TreeTokenList),
+        ("TreeGist", TreeGist),
+    ]
+    for name, factory in loaders:
+        base = bench(
+            name + " legacy", lambda t: legacy_load(factory(), t), trees, args.REPEAT
+        )
+        text = bench(name + " load()", lambda t: factory().load(t), trees, args.REPEAT)
+        binary = bench(
+            name + " load_binary()",
+            lambda b: factory().load_binary(b),
+            blobs,
+            args.REPEAT,
+        )
+        print(
+            "{0:<32} {1:8.2f}x text, {2:.2f}x binary".format(
+                name + " speedup", base / text, base / binary
+            )
+        )
+
+    if args.PROCESS is not None:
+        processor = (
+            importlib.import_module("processors." + args.PROCESS)
+            if args.PROCESS
+            else None
+        )
+        bench_process(trees, processor, args.REPEAT)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+"""
+
+    Greynir: Natural language processing for Icelandic
+
+    Copyright (C) 2020 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+
+    Utility script that converts the parse trees of existing articles
+    from the text format to the compact binary format of tree.TreeCodec,
+    storing the result in the tree_bin column of the articles table.
+    The column is added to the table if it does not already exist.
+
+"""
+
+import os
+import sys
+import time
+
+# Hack to make this Python program executable from the tools subdirectory
+basepath, _ = os.path.split(os.path.realpath(__file__))
+_TOOLS = os.sep + "tools"
+if basepath.endswith(_TOOLS):
+    basepath = basepath[0 : -len(_TOOLS)]
+    sys.path.append(basepath)
+
+from sqlalchemy import text, bindparam
+
+from settings import Settings, ConfigError
+from db import SessionContext
+from db.models import Article as ArticleModel
+from tree import TreeCodec
+
+
+def convert(batch_size, force=False, limit=None):
+    """ Encode article trees in batches of batch_size articles, each batch
+        being committed in its own transaction """
+
+    with SessionContext(commit=True) as session:
+        session.execute(
+            text("ALTER TABLE articles ADD COLUMN IF NOT EXISTS tree_bin bytea;")
+        )
+
+    table = ArticleModel.table()
+    upd = (
+        table.update()
+        .where(table.c.url == bindparam("b_url"))
+        .values(tree_bin=bindparam("b_tree_bin"))
+    )
+    last_url = ""
+    count = 0
+    t0 = time.time()
+    while limit is None or count < limit:
+        n = batch_size if limit is None else min(batch_size, limit - count)
+        with SessionContext(commit=True) as session:
+            q = session.query(ArticleModel.url, ArticleModel.tree).filter(
+                ArticleModel.tree != None
+            )
+            if force:
+                # Re-encode all trees, using the URL as a keyset cursor
+                q = q.filter(ArticleModel.url > last_url)
+            else:
+                q = q.filter(ArticleModel.tree_bin == None)
+            rows = q.order_by(ArticleModel.url).limit(n).all()
+            if not rows:
+                break
+            session.execute(
+                upd,
+                [
+                    dict(b_url=r.url, b_tree_bin=TreeCodec.encode(r.tree))
+                    for r in rows
+                ],
+            )
+            last_url = rows[-1].url
+        count += len(rows)
+        print(
+            "{0} articles converted in {1:.1f} seconds".format(
+                count, time.time() - t0
+            )
+        )
+    return count
+
+
+def main():
+
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Converts stored parse trees to the binary tree format"
+    )
+    parser.add_argument(
+        "--batch",
+        dest="BATCH",
+        type=int,
+        default=500,
+        help="number of articles per transaction (default 500)",
+    )
+    parser.add_argument(
+        "--limit",
+        dest="LIMIT",
+        type=int,
+        default=None,
+        help="maximum number of articles to convert",
+    )
+    parser.add_argument(
+        "--force",
+        dest="FORCE",
+        action="store_true",
+        default=False,
+        help="re-encode trees that have already been converted",
+    )
+    args = parser.parse_args()
+
+    try:
+        # Read configuration file
+        Settings.read(os.path.join(basepath, "config", "GreynirSimple.conf"))
+    except ConfigError as e:
+        print("Configuration error: {0}".format(e))
+        quit()
+
+    convert(args.BATCH, force=args.FORCE, limit=args.LIMIT)
+
+
+if __name__ == "__main__":
+    main()
@@ -44,6 +44,7 @@ else:
 from settings import Settings, ConfigError, Prepositions
 from tokenizer import tokenize, correct_spaces, TOK
 from reynir.bindb import BIN_Db
+from sqlalchemy.orm import undefer
 from db import SessionContext, DatabaseError, desc
 from db.models import Article, Trigram
 from tree import TreeTokenList, TerminalDescriptor
@@ -64,6 +65,7 @@ def dump_tokens(limit):
         # Iterate through the articles
         q = (
             session.query(Article)
+            .options(undefer(Article.tree), undefer(Article.tree_bin))
             .filter(Article.tree != None)
             .order_by(Article.timestamp)
         )
@@ -77,7 +79,7 @@ def dump_tokens(limit):
                 .format(a)
             )
             tree = TreeTokenList()
-            tree.load(a.tree)
+            tree.load_stored(a.tree, a.tree_bin)
             for ix, toklist in tree.sentences():
                 print("\nSentence {0}:".format(ix))
                 at_start = True
@@ -134,7 +136,9 @@ def make_trigrams(limit, output_tsv=False):
         fill_corrections()
         # Iterate through the articles
         q = (
-            session.query(Article.url, Article.timestamp, Article.tree)
+            session.query(
+                Article.url, Article.timestamp, Article.tree, Article.tree_bin
+            )
             .filter(Article.tree != None)
             .order_by(Article.timestamp)
         )
@@ -148,7 +152,7 @@ def make_trigrams(limit, output_tsv=False):
             for a in q:
                 #print("Processing article from {0.timestamp}: {0.url}".format(a))
                 tree = TreeTokenList()
-                tree.load(a.tree)
+                tree.load_stored(a.tree, a.tree_bin)
                 for ix, toklist in tree.sentences():
                     if toklist and len(toklist) > 1:
                         # For each sentence, start and end with empty strings
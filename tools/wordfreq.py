@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+"""
+
+    Greynir: Natural language processing for Icelandic
+
+    Copyright (C) 2020 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+
+    Utility script that maintains the daily word frequency rollup
+    (the wordfreq table), which the word frequency charts read from.
+
+    The scraper updates the rollup after each run, recomputing the days
+    of the articles whose words were indexed in the meantime. This script
+    performs the same update on demand, or, with --rebuild, recomputes
+    the entire rollup from the words table, e.g. after the table has
+    first been created.
+
+"""
+
+import os
+import sys
+import time
+
+# Hack to make this Python program executable from the tools subdirectory
+basepath, _ = os.path.split(os.path.realpath(__file__))
+_TOOLS = os.sep + "tools"
+if basepath.endswith(_TOOLS):
+    basepath = basepath[0 : -len(_TOOLS)]
+    sys.path.append(basepath)
+
+from settings import Settings, ConfigError
+from db import SessionContext
+from db.models import WordFrequency
+from scraper import Scraper
+
+
+def main():
+
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Updates the daily word frequency rollup"
+    )
+    parser.add_argument(
+        "--rebuild",
+        dest="REBUILD",
+        action="store_true",
+        default=False,
+        help="recompute the entire rollup from the words table",
+    )
+    args = parser.parse_args()
+
+    try:
+        # Read configuration file
+        Settings.read(os.path.join(basepath, "config", "GreynirSimple.conf"))
+    except ConfigError as e:
+        print("Configuration error: {0}".format(e))
+        quit()
+
+    t0 = time.time()
+    with SessionContext(commit=True) as session:
+        if args.REBUILD:
+            WordFrequency.rebuild(session)
+            print("Word frequency rollup rebuilt")
+        else:
+            cnt = Scraper().update_word_frequencies(session)
+            print("Word frequencies updated for the days of {0} articles".format(cnt))
+    print("Completed in {0:.1f} seconds".format(time.time() - t0))
+
+
+if __name__ == "__main__":
+    main()
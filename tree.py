@@ -27,12 +27,16 @@
 
 """
 
-from typing import Dict, Optional, List, Any, Union
+from typing import Dict, Optional, List, Any, Union, Tuple
 
 import json
 import re
+import struct
+import sys
 
+from array import array
 from collections import OrderedDict, namedtuple
+from functools import lru_cache
 
 from reynir.bindb import BIN_Db
 from reynir.binparser import BIN_Token
@@ -86,14 +90,24 @@ class Result:
         like so: [ op ]. When the "+" operator node is processed, it will automatically
         get an "operand" attribute containing [ left_op, right_op ].
 
+        The attributes are stored in the instance __dict__, which is also
+        available as r.dict. The node, state and params are kept in slots,
+        outside of the dict.
+
     """
 
+    __slots__ = ("_node", "_state", "_params", "__dict__")
+
     def __init__(self, node, state, params):
-        self.dict = dict()  # Our own custom dict for instance attributes
         self._node = node
         self._state = state
         self._params = params
 
+    @property
+    def dict(self):
+        """ The dictionary of attributes of this result """
+        return self.__dict__
+
     @property
     def node(self):
         return self._node
@@ -111,21 +125,11 @@ class Result:
             len(self._params) if self._params else 0, self.dict
         )
 
-    def __setattr__(self, key, val):
-        """ Fancy attribute setter using our own dict for instance attributes """
-        if key == "__dict__" or key == "dict" or key in self.__dict__:
-            # Relay to Python's default attribute resolution mechanism
-            super().__setattr__(key, val)
-        else:
-            # Set attribute in our own dict
-            self.dict[key] = val
-
     def __getattr__(self, key):
         """ Fancy attribute getter with special cases for _root and _nominative """
-        # Note: this is only called for attributes that are not found by 'normal' means
-        d = self.dict
-        if key in d:
-            return d[key]
+        # Note: this is only called for attributes that are not found by 'normal' means,
+        # i.e. not in the class or the instance dict
+        d = self.__dict__
         # Key not found: try lazy evaluation
         if key == "_nominative":
             # Lazy evaluation of the _nominative attribute
@@ -156,28 +160,28 @@ class Result:
         raise AttributeError("Result object has no attribute named '{0}'".format(key))
 
     def __contains__(self, key):
-        return key in self.dict
+        return key in self.__dict__
 
     def __getitem__(self, key):
-        return self.dict[key]
+        return self.__dict__[key]
 
     def __setitem__(self, key, val):
-        self.dict[key] = val
+        self.__dict__[key] = val
 
     def __delitem__(self, key):
-        del self.dict[key]
+        del self.__dict__[key]
 
     def get(self, key, default=None):
-        return self.dict.get(key, default)
+        return self.__dict__.get(key, default)
 
     def attribs(self):
         """ Enumerate all attributes, and values, of this result object """
-        for key, val in self.dict.items():
+        for key, val in self.__dict__.items():
             yield (key, val)
 
     def user_attribs(self):
         """ Enumerate all user-defined attributes and values of this result object """
-        for key, val in self.dict.items():
+        for key, val in self.__dict__.items():
             if isinstance(key, str) and not key.startswith("_") and not callable(val):
                 yield (key, val)
 
@@ -185,7 +189,7 @@ class Result:
         """ Copy all user attributes from p into this result """
         if p is self or p is None:
             return
-        d = self.dict
+        d = self.__dict__
         for key, val in p.user_attribs():
             # Pass all named parameters whose names do not start with an underscore
             # up to the parent, by default
@@ -213,7 +217,7 @@ class Result:
         """ Delete the attribs in alist from the result object """
         if isinstance(alist, str):
             alist = (alist,)
-        d = self.dict
+        d = self.__dict__
         for a in alist:
             if a in d:
                 del d[a]
@@ -305,6 +309,8 @@ class Node:
     """ Base class for terminal and nonterminal nodes reconstructed from
         trees in text format loaded from the scraper database """
 
+    __slots__ = ("child", "nxt")
+
     def __init__(self):
         self.child = None
         self.nxt = None
@@ -680,6 +686,22 @@ class TerminalNode(Node):
     # Cache of word roots (stems) keyed by (word, at_start, terminal)
     _root_cache = LRU_Cache(_root_lookup, maxsize=16384)
 
+    __slots__ = (
+        "td",
+        "token",
+        "text",
+        "_at_start",
+        "tokentype",
+        "is_word",
+        "augmented_terminal",
+        "aux",
+        "_aux",
+        "root_cache",
+        "nominative_cache",
+        "indefinite_cache",
+        "canonical_cache",
+    )
+
     def __init__(
         self,
         terminal: str,
@@ -702,11 +724,7 @@ class TerminalNode(Node):
         self.text = token[1:-1]  # Cut off quotes
         self._at_start = at_start
         self.tokentype = tokentype
-        self.is_word = tokentype in {"WORD", "PERSON"}
-        self.is_literal = td.is_literal
-        self.is_declinable = (not self.is_literal) and (
-            td.inferred_cat not in self._NOT_DECLINABLE
-        )
+        self.is_word = tokentype == "WORD" or tokentype == "PERSON"
         self.augmented_terminal = augmented_terminal
         # Auxiliary information, originally from token.t2 (JSON string)
         self.aux = aux
@@ -723,6 +741,15 @@ class TerminalNode(Node):
     def cat(self):
         return self.td.inferred_cat
 
+    @property
+    def is_literal(self):
+        return self.td.is_literal
+
+    @property
+    def is_declinable(self):
+        td = self.td
+        return (not td.is_literal) and (td.inferred_cat not in self._NOT_DECLINABLE)
+
     @property
     def at_start(self):
         """ Return True if the associated node spans the start of the sentence """
@@ -1042,6 +1069,8 @@ class PersonNode(TerminalNode):
 
     """ Specialized TerminalNode for person terminals """
 
+    __slots__ = ("fullnames",)
+
     def __init__(self, terminal, augmented_terminal, token, tokentype, aux, at_start):
         super().__init__(terminal, augmented_terminal, token, tokentype, aux, at_start)
         # Load the full names from the auxiliary JSON information
@@ -1123,14 +1152,24 @@ class NonterminalNode(Node):
 
     """ A Node corresponding to a nonterminal """
 
+    # Cache of (nt_base, variants, is_repeated) tuples keyed by nonterminal
+    _NT = dict()  # type: Dict[str, Tuple[str, frozenset, bool]]
+
+    __slots__ = ("nt", "nt_base", "variants", "is_repeated")
+
     def __init__(self, nonterminal):
-        super().__init__()
+        self.child = None
+        self.nxt = None
         self.nt = nonterminal
-        elems = nonterminal.split("_")
-        # Calculate the base name of this nonterminal (without variants)
-        self.nt_base = elems[0]
-        self.variants = set(elems[1:])
-        self.is_repeated = self.nt_base[-1] in _REPEAT_SUFFIXES
+        t = self._NT.get(nonterminal)
+        if t is None:
+            # Not found in cache: calculate the base name of this
+            # nonterminal (without variants) and the variant set
+            elems = nonterminal.split("_")
+            nt_base = elems[0]
+            t = (nt_base, frozenset(elems[1:]), nt_base[-1] in _REPEAT_SUFFIXES)
+            self._NT[nonterminal] = t
+        self.nt_base, self.variants, self.is_repeated = t
 
     def build_simple_tree(self, builder):
         builder.push_nonterminal(self.nt_base)
@@ -1221,6 +1260,122 @@ class NonterminalNode(Node):
         return result
 
 
+class TreeCodec:
+
+    """ Compact, versioned binary encoding of the text tree format.
+        The encoded form consists of a fixed header, a table of interned
+        strings (UTF-8, newline-separated) and three arrays: one byte per
+        text line containing the line code, the number following each code,
+        and the string table indices of the fields of T and N lines.
+        The arrays use the narrowest little-endian integer type that
+        fits their contents. Terminal descriptors are thus parsed once,
+        at encoding time, instead of every time a tree is loaded. """
+
+    MAGIC = b"GTB"
+    VERSION = 1
+    # Magic, version, byte length of string table, number of lines,
+    # number of string indices, type codes of number and index arrays
+    _HEADER = struct.Struct("<3sBIIIcc")
+
+    T = ord("T")
+    N = ord("N")
+
+    @staticmethod
+    def _pack(typecodes: str, values: List[int]) -> array:
+        """ Pack the values into an array of the narrowest fitting type """
+        for tc in typecodes:
+            a = array(tc)
+            bits = 8 * a.itemsize
+            if tc.islower():
+                lo, hi = -(1 << (bits - 1)), (1 << (bits - 1)) - 1
+            else:
+                lo, hi = 0, (1 << bits) - 1
+            if not values or (lo <= min(values) and max(values) <= hi):
+                a.extend(values)
+                return a
+        raise ValueError("Value out of range in tree encoding")
+
+    @classmethod
+    def encode(cls, txt: str) -> bytes:
+        """ Encode a tree in text format to the binary format """
+        strings = []  # type: List[str]
+        index = dict()  # type: Dict[str, int]
+        codes = bytearray()
+        nums = []  # type: List[int]
+        indices = []  # type: List[int]
+
+        def intern(s: str) -> int:
+            ix = index.get(s)
+            if ix is None:
+                assert "\n" not in s
+                ix = index[s] = len(strings)
+                strings.append(s)
+            return ix
+
+        for line in txt.split("\n"):
+            if not line:
+                continue
+            a = line.split(" ", maxsplit=1)
+            code = a[0]
+            codes.append(ord(code[0]))
+            nums.append(int(code[1:]))
+            if code[0] == "T":
+                indices.extend(intern(s) for s in TreeBase._parse_T(a[1]))
+            elif code[0] == "N":
+                indices.append(intern(a[1]))
+        anums = cls._pack("bhi", nums)
+        aindices = cls._pack("BHI", indices)
+        if sys.byteorder != "little":
+            anums.byteswap()
+            aindices.byteswap()
+        table = "\n".join(strings).encode("utf-8")
+        return b"".join(
+            (
+                cls._HEADER.pack(
+                    cls.MAGIC,
+                    cls.VERSION,
+                    len(table),
+                    len(codes),
+                    len(indices),
+                    anums.typecode.encode("ascii"),
+                    aindices.typecode.encode("ascii"),
+                ),
+                table,
+                codes,
+                anums.tobytes(),
+                aindices.tobytes(),
+            )
+        )
+
+    @classmethod
+    def decode(cls, data: bytes) -> Tuple[List[str], bytes, array, array]:
+        """ Decode binary data into a string table, line codes,
+            line numbers and string indices """
+        magic, version, tlen, nlines, nindices, ntc, itc = cls._HEADER.unpack_from(
+            data
+        )
+        if magic != cls.MAGIC or version != cls.VERSION:
+            raise ValueError(
+                "Unsupported binary tree format ({0!r}, version {1})".format(
+                    magic, version
+                )
+            )
+        pos = cls._HEADER.size
+        strings = bytes(data[pos : pos + tlen]).decode("utf-8").split("\n")
+        pos += tlen
+        codes = bytes(data[pos : pos + nlines])
+        pos += nlines
+        nums = array(ntc.decode("ascii"))
+        end = pos + nlines * nums.itemsize
+        nums.frombytes(data[pos:end])
+        indices = array(itc.decode("ascii"))
+        indices.frombytes(data[end : end + nindices * indices.itemsize])
+        if sys.byteorder != "little":
+            nums.byteswap()
+            indices.byteswap()
+        return strings, codes, nums, indices
+
+
 class TreeBase:
 
     """ A tree corresponding to a single parsed article """
@@ -1228,6 +1383,16 @@ class TreeBase:
     # A map of terminal types to node constructors
     _TC = {"person": PersonNode}
 
+    # A line of the text tree format: code, number and optional argument
+    _LINE_RE = re.compile(r"^(.)([^ \n]*)(?: ([^\n]*))?$", re.MULTILINE)
+
+    # The usual form of a T (Terminal) descriptor:
+    # terminal "token" [TOKENTYPE [auxiliary-json] | augmented_terminal]
+    _T_RE = re.compile(
+        r"('[^']*'\w*|\"[^\"]*\"\w*|[^ '\"][^ ]*) "
+        r"(\"[^\"]*\"|'[^']*')(?: ([^ ]+)(?: (.*))?)?"
+    )
+
     def __init__(self):
         self.s = OrderedDict()  # Sentence dictionary
         self.scores = dict()  # Sentence scores
@@ -1246,8 +1411,8 @@ class TreeBase:
 
     def sentences(self):
         """ Enumerate the sentences in this tree """
-        for ix, sent in self.s.items():
-            yield ix, sent
+        for ix in self.s:
+            yield ix, self[ix]
 
     def score(self, n):
         """ Return the score of the sentence with index n, or 0 if unknown """
@@ -1262,10 +1427,10 @@ class TreeBase:
         # Hack to allow nodes to access the BIN database
         with BIN_Db.get_db() as bin_db:
             state = dict(bin_db=bin_db)
-            for ix, sent in self.s.items():
+            for ix in self.s:
                 builder = SimpleTreeBuilder(nt_map, id_map, terminal_map)
                 builder.state = state
-                sent.build_simple_tree(builder)
+                self[ix].build_simple_tree(builder)
                 yield ix, builder.tree
 
     def push(self, n, node):
@@ -1282,7 +1447,7 @@ class TreeBase:
             self.stack[n].set_next(node)
             self.stack[n] = node
             if n + 1 < len(self.stack):
-                self.stack = self.stack[0 : n + 1]
+                del self.stack[n + 1 :]
 
     def handle_R(self, n):
         """ Greynir version info """
@@ -1311,7 +1476,7 @@ class TreeBase:
         # Store the root of the sentence tree at the appropriate index
         # in the dictionary
         assert self.n is not None
-        assert self.n not in self.s
+        assert self.s.get(self.n) is None
         assert self.stack is not None
         self.s[self.n] = self.stack[0]
         self.stack = None
@@ -1329,7 +1494,31 @@ class TreeBase:
         pass
 
     @staticmethod
+    @lru_cache(maxsize=32768)
     def _parse_T(s):
+        """ Parse a T (Terminal) descriptor, memoizing the result """
+        m = TreeBase._T_RE.fullmatch(s)
+        if m is None:
+            # Unusual descriptor: use the general parser
+            return TreeBase._parse_T_slow(s)
+        terminal, token, tokentype, aux = m.groups()
+        if tokentype is None:
+            # Default token type
+            return (terminal, terminal, token, "WORD", "", terminal.split("_", 1)[0])
+        if tokentype[0].islower():
+            # Augmented terminal, corresponding to a word token
+            return (terminal, tokentype, token, "WORD", "", terminal.split("_", 1)[0])
+        return (
+            terminal,
+            terminal,
+            token,
+            tokentype,
+            aux or "",
+            terminal.split("_", 1)[0],
+        )
+
+    @staticmethod
+    def _parse_T_slow(s):
         """ Parse a T (Terminal) descriptor """
         # The string s contains:
         # terminal "token" [TOKENTYPE] [auxiliary-json]
@@ -1382,7 +1571,11 @@ class TreeBase:
 
     def handle_T(self, n, s):
         """ Terminal """
-        terminal, augmented_terminal, token, tokentype, aux, cat = self._parse_T(s)
+        self.add_terminal(n, self._parse_T(s))
+
+    def add_terminal(self, n, t):
+        """ Add a terminal, given as a tuple from _parse_T(), to the tree """
+        terminal, augmented_terminal, token, tokentype, aux, cat = t
         constructor = self._TC.get(cat, TerminalNode)
         self.push(
             n,
@@ -1396,34 +1589,168 @@ class TreeBase:
         """ Nonterminal """
         self.push(n, NonterminalNode(nonterminal))
 
+    def _dispatch_table(self):
+        """ Return a dictionary of handler methods, keyed by line code """
+        return {code: getattr(self, "handle_" + code) for code in "RCLSQEPTN"}
+
     def load(self, txt):
         """ Loads a tree from the text format stored by the scraper """
-        for line in txt.split("\n"):
-            if not line:
-                continue
-            a = line.split(" ", maxsplit=1)
-            if not a:
-                continue
-            code = a[0]
-            n = int(code[1:])
-            f = getattr(self, "handle_" + code[0], None)
-            if f:
-                if len(a) >= 2:
-                    f(n, a[1])
-                else:
-                    f(n)
+        self._load_text(txt, 0, len(txt))
+
+    def _load_text(self, txt, start, end):
+        """ Load the lines of txt[start:end], which must start a line """
+        dispatch = self._dispatch_table()
+        for m in self._LINE_RE.finditer(txt, start, end):
+            code, n, arg = m.groups()
+            f = dispatch.get(code)
+            if f is None:
+                f = getattr(self, "handle_" + code, None)
+                assert f is not None, "*** No handler for {0}".format(m.group())
+            if arg is None:
+                f(int(n))
             else:
-                assert False, "*** No handler for {0}".format(line)
+                f(int(n), arg)
+
+    def load_binary(self, data):
+        """ Loads a tree from the binary format generated by TreeCodec.encode() """
+        strings, codes, nums, ix = TreeCodec.decode(data)
+        self._load_records(strings, codes, nums, ix, 0, len(codes), 0)
+
+    def _load_records(self, strings, codes, nums, ix, first, last, i):
+        """ Load the binary records with indices first...last-1, where i
+            is the position of the first record's fields in ix """
+        T, N = TreeCodec.T, TreeCodec.N
+        dispatch = self._dispatch_table()
+        for code, n in zip(codes[first:last], nums[first:last]):
+            if code == T:
+                self.add_terminal(
+                    n,
+                    (
+                        strings[ix[i]],
+                        strings[ix[i + 1]],
+                        strings[ix[i + 2]],
+                        strings[ix[i + 3]],
+                        strings[ix[i + 4]],
+                        strings[ix[i + 5]],
+                    ),
+                )
+                i += 6
+            elif code == N:
+                self.handle_N(n, strings[ix[i]])
+                i += 1
+            else:
+                f = dispatch.get(chr(code))
+                assert f is not None, "*** No handler for code {0}".format(chr(code))
+                f(n)
+
+    def load_stored(self, txt, data=None):
+        """ Loads a tree as stored in the articles table, preferring
+            the binary format if it is available """
+        if data:
+            self.load_binary(data)
+        elif txt:
+            self.load(txt)
 
 
 class Tree(TreeBase):
 
-    """ A processable tree corresponding to a single parsed article """
+    """ A processable tree corresponding to a single parsed article.
+        If lazy is True, the nodes of each sentence are only built when
+        the sentence is first accessed via __getitem__(), sentences(),
+        simple_trees() or process(). """
 
-    def __init__(self, url="", authority=1.0):
+    # Line codes that are handled when a tree is loaded lazily,
+    # i.e. those of the sentence header or error lines
+    _HEADER_CODES = "SCLRE"
+
+    # Start of a sentence in the text format
+    _S_RE = re.compile(r"^S", re.MULTILINE)
+
+    def __init__(self, url="", authority=1.0, lazy=True):
         super().__init__()
         self.url = url
         self.authority = authority
+        self.lazy = lazy
+        # Sentences whose nodes have not been built yet, keyed by index.
+        # The values are (loader function, arguments) tuples.
+        self._pending = dict()  # type: Dict[int, Tuple[Any, Tuple]]
+
+    def __getitem__(self, n):
+        """ Allow indexing to get sentence roots from the tree,
+            building the sentence nodes if not already done """
+        sent = self.s[n]
+        if sent is None and n in self._pending:
+            f, args = self._pending.pop(n)
+            self.n = n
+            self.stack = []
+            self.at_start = True
+            f(*args)
+            sent = self.s[n]
+        return sent
+
+    def _defer(self, f, args):
+        """ Defer loading the body of the current sentence, if any """
+        if self.n is not None:
+            self.s[self.n] = None
+            self._pending[self.n] = (f, args)
+            self.n = None
+            self.stack = None
+
+    def load(self, txt):
+        """ Loads a tree from the text format stored by the scraper,
+            building sentence nodes on demand if the tree is lazy """
+        if not self.lazy:
+            super().load(txt)
+            return
+        starts = [m.start() for m in self._S_RE.finditer(txt)]
+        if not starts or starts[0] > 0:
+            self._load_text(txt, 0, starts[0] if starts else len(txt))
+        starts.append(len(txt))
+        dispatch = self._dispatch_table()
+        header = self._HEADER_CODES
+        for k in range(len(starts) - 1):
+            pos, end = starts[k], starts[k + 1]
+            while pos < end:
+                m = self._LINE_RE.match(txt, pos, end)
+                if m is None:
+                    # Empty line
+                    pos += 1
+                    continue
+                code, n, arg = m.groups()
+                if code not in header:
+                    self._defer(self._load_text, (txt, pos, end))
+                    break
+                dispatch[code](int(n))
+                pos = m.end() + 1
+
+    def load_binary(self, data):
+        """ Loads a tree from the binary format generated by TreeCodec.encode(),
+            building sentence nodes on demand if the tree is lazy """
+        if not self.lazy:
+            super().load_binary(data)
+            return
+        strings, codes, nums, ix = TreeCodec.decode(data)
+        num_codes = len(codes)
+        start = codes.find(b"S")
+        if start < 0:
+            start = num_codes
+        self._load_records(strings, codes, nums, ix, 0, start, 0)
+        # Position of the current record's fields in ix
+        i = 6 * codes.count(b"T", 0, start) + codes.count(b"N", 0, start)
+        dispatch = self._dispatch_table()
+        header = self._HEADER_CODES.encode("ascii")
+        while start < num_codes:
+            end = codes.find(b"S", start + 1)
+            if end < 0:
+                end = num_codes
+            j = start
+            while j < end and codes[j] in header:
+                dispatch[chr(codes[j])](nums[j])
+                j += 1
+            if j < end:
+                self._defer(self._load_records, (strings, codes, nums, ix, j, end, i))
+                i += 6 * codes.count(b"T", j, end) + codes.count(b"N", j, end)
+            start = end
 
     def visit_children(self, state, node):
         """ Visit the children of node, obtain results from them and pass them to the node """
@@ -1482,9 +1809,9 @@ class Tree(TreeBase):
             if article_begin is not None:
                 article_begin(state)
             # Process the (parsed) sentences in the article
-            for index, tree in self.s.items():
+            for index in self.s:
                 state["index"] = index
-                self.process_sentence(state, tree)
+                self.process_sentence(state, self[index])
             # Call the article_end(state) function, if it exists
             if article_end is not None:
                 article_end(state)
@@ -1528,6 +1855,11 @@ class TreeGist(TreeBase):
         # No need to store anything for gists
         pass
 
+    def add_terminal(self, n, t):
+        """ Terminal """
+        # No need to store anything for gists
+        pass
+
     def handle_N(self, n, nonterminal):
         """ Nonterminal """
         # No need to store anything for gists
@@ -1554,9 +1886,8 @@ class TreeTokenList(TreeBase):
         self.stack = None
         self.n = None
 
-    def handle_T(self, n, s):
+    def add_terminal(self, n, t):
         """ Terminal """
-        t = self._parse_T(s)
         # Append to token list for current sentence
         assert self.stack is not None
         self.stack.append(TreeToken(*t))
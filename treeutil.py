@@ -28,7 +28,7 @@
 from typing import TYPE_CHECKING, List
 
 import time
-from collections import namedtuple
+from collections import namedtuple, defaultdict
 
 from nertokenizer import recognize_entities
 from db import SessionContext
@@ -233,6 +233,34 @@ class TreeUtility:
             wt = WordTuple(stem=name, cat="person_" + gender)
         return wt
 
+    @staticmethod
+    def word_bag(pgs):
+        """ Return a dictionary of (stem, cat) keys and occurrence counts,
+            recreated from the paragraphs of token dicts generated by
+            dump_tokens() for an article, i.e. the same word bag as was
+            obtained when the article was parsed. Sentences that were
+            not parsed are skipped. """
+        words = defaultdict(int)
+        for pg in pgs:
+            for sent in pg:
+                if any("err" in d for d in sent):
+                    continue
+                for d in sent:
+                    kind = d.get("k", TOK.WORD)
+                    wt = None
+                    if "m" in d and kind != TOK.PUNCTUATION:
+                        stem, cat = d["m"][0], d["m"][1]
+                        if cat != "fs":
+                            stem = stem.replace("-", "")
+                        wt = WordTuple(stem=stem, cat=cat)
+                    elif kind == TOK.ENTITY and "t" in d:
+                        wt = WordTuple(stem=d["x"], cat="entity")
+                    if kind == TOK.PERSON and "v" in d and "g" in d:
+                        wt = WordTuple(stem=d["v"], cat="person_" + d["g"])
+                    if wt is not None:
+                        words[wt] += 1
+        return words
+
     @staticmethod
     def _terminal_map(tree):
         """ Return a dict containing a map from original token indices
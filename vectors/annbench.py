@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+"""
+    Greynir: Natural language processing for Icelandic
+
+    Similarity index benchmark
+
+    Copyright (C) 2020 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+
+    This program measures the recall and latency of approximate similarity
+    search with the inverted file index (ivfindex.py) against the exact
+    search of the similarity server, for a range of probe counts.
+
+    By default, the topic vectors of the articles in the database are used,
+    and the queries are the topic vectors of randomly chosen articles.
+    With --random, a synthetic, clustered set of vectors is used instead.
+
+    Examples:
+
+        $ python annbench.py --queries 200 --n 10
+        $ python annbench.py --random 500000 --dims 200 --lists 2800
+
+"""
+
+import sys
+import time
+
+import numpy as np
+
+from topicmatrix import TopicMatrix
+from ivfindex import IVFIndex
+from builder import decode_vector
+
+
+def load_vectors():
+    """ Load the topic vectors of visible articles from the database """
+    from settings import Settings
+    from db import SessionContext
+    from db.models import Article, Root
+
+    Settings.read("Vectors.conf")
+    ids = []
+    vectors = []
+    with SessionContext(commit=True, read_only=True) as session:
+        q = (
+            session.query(Article)
+            .join(Root)
+            .filter(Root.visible)
+            .with_entities(Article.id, Article.topic_vector_bin, Article.topic_vector)
+        )
+        for a in q.yield_per(2000):
+            vec = decode_vector(a.topic_vector_bin, a.topic_vector)
+            if vec is not None and len(vec):
+                ids.append(a.id)
+                vectors.append(vec)
+    return ids, vectors
+
+
+def random_vectors(num, dims, seed=42):
+    """ Generate a clustered set of random vectors """
+    rng = np.random.default_rng(seed)
+    num_clusters = max(1, num // 500)
+    centers = rng.standard_normal((num_clusters, dims)).astype(np.float32)
+    vectors = centers[rng.integers(0, num_clusters, num)]
+    vectors += 0.5 * rng.standard_normal((num, dims)).astype(np.float32)
+    return [str(i) for i in range(num)], vectors
+
+
+def percentile(values, p):
+    return float(np.percentile(np.array(values), p)) * 1000.0
+
+
+def main():
+
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Measures recall and latency of approximate similarity search"
+    )
+    parser.add_argument(
+        "--random",
+        type=int,
+        default=0,
+        help="use this many synthetic vectors instead of the database",
+    )
+    parser.add_argument(
+        "--dims", type=int, default=200, help="dimensions of synthetic vectors"
+    )
+    parser.add_argument(
+        "--lists", type=int, default=0, help="number of lists (default: automatic)"
+    )
+    parser.add_argument(
+        "--probes",
+        type=str,
+        default="1,4,8,16,32,64,128",
+        help="comma-separated probe counts to measure",
+    )
+    parser.add_argument(
+        "--queries", type=int, default=200, help="number of queries"
+    )
+    parser.add_argument("--n", type=int, default=10, help="number of results")
+    args = parser.parse_args()
+
+    t0 = time.time()
+    if args.random:
+        ids, vectors = random_vectors(args.random, args.dims)
+    else:
+        ids, vectors = load_vectors()
+    if not ids:
+        print("No vectors found")
+        return 1
+    topics = TopicMatrix(len(vectors[0])).updated(ids, vectors)
+    del vectors
+    print("{0} vectors loaded in {1:.2f} seconds".format(len(topics), time.time() - t0))
+
+    t0 = time.time()
+    topics.ivf = IVFIndex.train(topics.matrix, args.lists, seed=1)
+    print(
+        "Index with {0} lists trained in {1:.2f} seconds".format(
+            topics.ivf.num_lists, time.time() - t0
+        )
+    )
+
+    rng = np.random.default_rng(7)
+    queries = [
+        topics.matrix[ix] for ix in rng.choice(len(topics), args.queries)
+    ]
+
+    times = []
+    truth = []
+    for q in queries:
+        t0 = time.perf_counter()
+        result = topics.most_similar(args.n, q, exact=True)
+        times.append(time.perf_counter() - t0)
+        truth.append(set(article_id for article_id, _ in result))
+    print(
+        "{0:>8} {1:>8} {2:>10} {3:>10}".format("probes", "recall", "mean ms", "p95 ms")
+    )
+    print(
+        "{0:>8} {1:>8.3f} {2:>10.2f} {3:>10.2f}".format(
+            "exact",
+            1.0,
+            1000.0 * sum(times) / len(times),
+            percentile(times, 95),
+        )
+    )
+    for probes in (int(p) for p in args.probes.split(",")):
+        times = []
+        hits = 0
+        for q, t in zip(queries, truth):
+            t0 = time.perf_counter()
+            result = topics.most_similar(args.n, q, probes=probes)
+            times.append(time.perf_counter() - t0)
+            hits += len(t.intersection(article_id for article_id, _ in result))
+        print(
+            "{0:>8} {1:>8.3f} {2:>10.2f} {3:>10.2f}".format(
+                probes,
+                hits / max(1, sum(len(t) for t in truth)),
+                1000.0 * sum(times) / len(times),
+                percentile(times, 95),
+            )
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
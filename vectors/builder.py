@@ -34,7 +34,10 @@
         already been filtered so that it only contains significant verbs,
         nouns, adjectives and person and entity names - all normalized
         (i.e. verbs to 'nafnháttur', nouns to nominative singular, and
-        adjectives to normal nominative singular masculine).
+        adjectives to normal nominative singular masculine). The stream is
+        cached on disk (in models/corpus-words.txt), so that the dictionary
+        and the corpus are built from a single pass over the words table,
+        which includes the articles parsed up to the checkpoint of the build.
 
     2) Generation of a Gensim dictionary (vocabulary) across the corpus stream,
         cutting out rare words, resulting in a word count vector
@@ -55,7 +58,9 @@
 
 """
 
+import os
 import sys
+import glob
 import getopt
 import json
 import time
@@ -67,11 +72,44 @@ from db import SessionContext
 from db.models import Article, Topic, ArticleTopic, Word
 from db.queries import TermTopicsQuery
 from similar import SimilarityClient
+from workerpool import WorkerPool
 
 import numpy as np
+from sqlalchemy import bindparam
 from gensim import corpora, models, matutils
 
 
+# Topic vectors are stored in the topic_vector_bin column of the
+# articles table as fixed-width arrays of little-endian float32 values
+VECTOR_DTYPE = np.dtype("<f4")
+
+
+# Number of rows fetched at a time from the server-side cursor over the words table
+CURSOR_ITERSIZE = 20000
+# Number of articles whose topics are assigned in each transaction
+TAG_BATCH_SIZE = 100
+# Progress is reported after every this many tagged articles
+TAG_REPORT_INTERVAL = 10000
+
+
+def encode_vector(vector):
+    """ Encode a topic vector for storage in the topic_vector_bin column """
+    return np.asarray(vector, dtype=VECTOR_DTYPE).tobytes()
+
+
+def decode_vector(vector_bin, vector_json=None):
+    """ Decode a stored topic vector into a float32 array, from its binary
+        form or, failing that, from its older JSON form. Returns None if
+        there is no vector. """
+    if vector_bin:
+        return np.frombuffer(vector_bin, dtype=VECTOR_DTYPE)
+    if vector_json:
+        vec = json.loads(vector_json)
+        if isinstance(vec, list):
+            return np.array(vec, dtype=np.float32)
+    return None
+
+
 def w_from_stem(stem, cat):
     """ Convert a (stem, cat) tuple to a bag-of-words key """
     return stem.lower().replace("-", "").replace(" ", "_") + "/" + cat
@@ -80,45 +118,128 @@ def w_from_stem(stem, cat):
 class CorpusIterator:
 
     """ Iterate through the Greynir words database, yielding a bag-of-words
-        for each article """
-
-    def __init__(self, dictionary=None):
+        for each article parsed within a time interval (since, until].
+        The words are streamed from the database through a named,
+        server-side cursor as plain tuples. If a cache file name is given,
+        the stream is also written to that file, and later iterations over
+        the same interval read it from there instead. The interval then
+        always has an upper bound, by default the time when the iterator
+        was created, so that all iterations see the same articles. """
+
+    def __init__(self, dictionary=None, cache=None, since=None, until=None):
         self._dictionary = dictionary
+        self._since = since
+        if cache and until is None:
+            until = datetime.utcnow()
+        self._until = until
+        self._cache = cache
+
+    def _cache_key(self):
+        """ Return a key that identifies the articles of the iteration """
+        return "{0}|{1}".format(self._since, self._until)
+
+    def _cache_valid(self, key):
+        """ Return True if the cache file exists and has the given key """
+        try:
+            with open(self._cache + ".key", "r") as f:
+                return f.read() == key and os.path.exists(self._cache)
+        except OSError:
+            return False
+
+    def _cached_bags(self):
+        """ Generate the bags of words from the cache file """
+        with open(self._cache, "r", encoding="utf-8") as f:
+            for line in f:
+                # Words contain no spaces, cf. w_from_stem()
+                yield line.rstrip("\n").split(" ")
+
+    def _db_bags(self, key=None):
+        """ Generate the bags of words from the words table, writing them
+            to the cache file if a cache key is given """
+        cache = None
+        if key is not None:
+            # Write to a temporary file that replaces the cache
+            # once the iteration is complete
+            cache = open(self._cache + ".tmp", "w", encoding="utf-8")
+        completed = False
+        try:
+            with SessionContext(commit=True, read_only=True) as session:
+                # Use a named cursor on the underlying database connection,
+                # which fetches the rows from the server in chunks, bypassing
+                # the overhead of the ORM
+                cursor = session.connection().connection.cursor(name="corpus_words")
+                cursor.itersize = CURSOR_ITERSIZE
+                try:
+                    # Fetch bags of words sorted by articles
+                    if self._since or self._until:
+                        cursor.execute(
+                            "select w.article_id, w.stem, w.cat, w.cnt "
+                            "from words w join articles a on a.id = w.article_id "
+                            "where a.parsed > %(since)s and a.parsed <= %(until)s "
+                            "order by w.article_id;",
+                            dict(
+                                since=self._since or datetime.min,
+                                until=self._until or datetime.utcnow(),
+                            ),
+                        )
+                    else:
+                        cursor.execute(
+                            "select article_id, stem, cat, cnt from words "
+                            "order by article_id;"
+                        )
+                    bag = []
+                    last_uuid = None
+                    for uuid, stem, cat, cnt in cursor:
+                        if uuid != last_uuid:
+                            if bag:
+                                # Finishing the last article: yield its bag
+                                if cache is not None:
+                                    cache.write(" ".join(bag) + "\n")
+                                yield bag
+                                bag = []
+                            # Beginning a new article with an empty bag
+                            last_uuid = uuid
+                        # Convert stem to lowercase and replace spaces with underscores
+                        w = w_from_stem(stem, cat)
+                        if cnt == 1:
+                            bag.append(w)
+                        else:
+                            bag.extend([w] * cnt)
+                    if (last_uuid is not None) and bag:
+                        if cache is not None:
+                            cache.write(" ".join(bag) + "\n")
+                        yield bag
+                finally:
+                    cursor.close()
+            completed = True
+        finally:
+            if cache is not None:
+                cache.close()
+                if completed:
+                    os.replace(self._cache + ".tmp", self._cache)
+                    with open(self._cache + ".key", "w") as f:
+                        f.write(key)
+                else:
+                    os.remove(self._cache + ".tmp")
 
     def __iter__(self):
         """ Iterate through articles (documents) """
-        print("Starting iteration through corpus from words table")
         if self._dictionary is not None:
             xform = lambda x: self._dictionary.doc2bow(x)
         else:
             xform = lambda x: x
-        with SessionContext(commit=True) as session:
-            # Fetch bags of words sorted by articles
-            q = (
-                session.query(Word.article_id, Word.stem, Word.cat, Word.cnt)
-                .order_by(Word.article_id)
-                .yield_per(2000)
-            )
-            bag = []
-            last_uuid = None
-            for uuid, stem, cat, cnt in q:
-                if uuid != last_uuid:
-                    if bag:
-                        # Finishing the last article: yield its bag
-                        # print("Yielding bag of {0} words".format(len(bag)))
-                        yield xform(bag)
-                        bag = []
-                    # Beginning a new article with an empty bag
-                    last_uuid = uuid
-                # Convert stem to lowercase and replace spaces with underscores
-                w = w_from_stem(stem, cat)
-                if cnt == 1:
-                    bag.append(w)
-                else:
-                    bag.extend([w] * cnt)
-            if (last_uuid is not None) and bag:
-                # print("Yielding bag of {0} words".format(len(bag)))
-                yield xform(bag)
+        key = None
+        if self._cache:
+            key = self._cache_key()
+            if self._cache_valid(key):
+                print("Starting iteration through corpus from {0}".format(self._cache))
+                for bag in self._cached_bags():
+                    yield xform(bag)
+                print("Finished iteration through corpus from {0}".format(self._cache))
+                return
+        print("Starting iteration through corpus from words table")
+        for bag in self._db_bags(key):
+            yield xform(bag)
         print("Finished iteration through corpus from words table")
 
 
@@ -141,12 +262,27 @@ class ReynirCorpus:
     # Default number of dimensions in topic vectors
     _DEFAULT_DIMENSIONS = 200
 
+    # Words must occur in at least this many articles to be in the dictionary
+    _NO_BELOW = 3
+    # A full rebuild is recommended when the words that are missing from
+    # the dictionary, but occur in enough new articles, amount to this
+    # fraction of the dictionary
+    _MAX_GROWTH = 0.05
+    # Number of incrementally updated LSI model versions to keep
+    _KEEP_VERSIONS = 3
+
     # Work file names
     _DICTIONARY_FILE = "./models/reynir.dict"
+    _WORDS_CACHE_FILE = "./models/corpus-words.txt"
     _PLAIN_CORPUS_FILE = "./models/corpus.mm"
     _TFIDF_CORPUS_FILE = "./models/corpus-tfidf.mm"
     _TFIDF_MODEL_FILE = "./models/tfidf.model"
     _LSI_MODEL_FILE = "./models/lsi-{0}.model"
+    _LSI_VERSION_MODEL_FILE = "./models/lsi-{0}.v{1}.model"
+    _LSI_VERSION_FILE = "./models/lsi-{0}.json"
+    # Format of the checkpoint time stamp in the version file
+    _CHECKPOINT_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+    _PENDING_WORDS_FILE = "./models/pending-words.json"
     _LDA_MODEL_FILE = "./models/lda-{0}.model"
 
     def __init__(self, verbose=False, dimensions=None):
@@ -157,18 +293,74 @@ class ReynirCorpus:
         self._model_name = None
         self._topics = None
         self._dimensions = dimensions or ReynirCorpus._DEFAULT_DIMENSIONS
+        # The upper bound of the parse time of the articles in the
+        # dictionary, as created by create_dictionary()
+        self._corpus_until = None
+        # The version of the LSI model and the time up to which
+        # parsed articles have been included in it
+        self._version, self._checkpoint = self._read_version()
 
     @property
     def dimensions(self):
         return self._dimensions
 
-    def create_dictionary(self):
-        """ Iterate through the article database
-            and create a fresh Gensim dictionary """
-        ci = CorpusIterator()
+    @property
+    def version(self):
+        return self._version
+
+    @property
+    def checkpoint(self):
+        return self._checkpoint
+
+    def _read_version(self):
+        """ Read the current LSI model version and checkpoint """
+        try:
+            with open(self._LSI_VERSION_FILE.format(self._dimensions), "r") as f:
+                v = json.load(f)
+            checkpoint = datetime.strptime(v["checkpoint"], self._CHECKPOINT_FORMAT)
+            return v["version"], checkpoint
+        except (OSError, ValueError, KeyError):
+            # No version file: the model was built before versioning
+            return 0, None
+
+    def _write_version(self, version, checkpoint):
+        """ Make the given LSI model version current. The version file
+            is replaced atomically, after the model has been saved. """
+        fname = self._LSI_VERSION_FILE.format(self._dimensions)
+        with open(fname + ".tmp", "w") as f:
+            json.dump(
+                dict(
+                    version=version,
+                    checkpoint=checkpoint.strftime(self._CHECKPOINT_FORMAT),
+                ),
+                f,
+            )
+        os.replace(fname + ".tmp", fname)
+        self._version, self._checkpoint = version, checkpoint
+
+    def _lsi_model_file(self, version):
+        """ Return the file name of the given LSI model version """
+        if not version:
+            # Version 0 is the model from the last full build
+            return self._LSI_MODEL_FILE.format(self._dimensions)
+        return self._LSI_VERSION_MODEL_FILE.format(self._dimensions, version)
+
+    def _remove_versions(self, below):
+        """ Remove the files of LSI model versions 1..below-1 """
+        for version in range(1, below):
+            for fname in glob.glob(self._lsi_model_file(version) + "*"):
+                os.remove(fname)
+
+    def create_dictionary(self, until=None):
+        """ Iterate through the article database and create a fresh
+            Gensim dictionary from the articles parsed up to the given
+            time (by default, now). The words are cached on disk for
+            create_plain_corpus(). """
+        self._corpus_until = until or datetime.utcnow()
+        ci = CorpusIterator(cache=self._WORDS_CACHE_FILE, until=self._corpus_until)
         dic = ReynirDictionary(ci)
         # Drop words that only occur only once or twice in the entire set
-        dic.filter_extremes(no_below=3, keep_n=None)
+        dic.filter_extremes(no_below=self._NO_BELOW, keep_n=None)
         dic.save(self._DICTIONARY_FILE)
         self._dictionary = dic
 
@@ -176,14 +368,21 @@ class ReynirCorpus:
         """ Load a dictionary from a previously prepared file """
         self._dictionary = ReynirDictionary.load(self._DICTIONARY_FILE)
 
-    def create_plain_corpus(self):
+    def create_plain_corpus(self, until=None):
         """ Create a plain vector corpus, where each vector represents a
             document. Each element of the vector contains the count of
             the corresponding word (as indexed by the dictionary) in
-            the document. """
+            the document. The corpus contains the articles parsed up to
+            the given time, by default the same articles as the dictionary
+            that create_dictionary() created, whose words are then read
+            from the cache that it wrote. """
         if self._dictionary is None:
             self.load_dictionary()
-        dci = CorpusIterator(dictionary=self._dictionary)
+        dci = CorpusIterator(
+            dictionary=self._dictionary,
+            cache=self._WORDS_CACHE_FILE,
+            until=until or self._corpus_until,
+        )
         corpora.MmCorpus.serialize(self._PLAIN_CORPUS_FILE, dci)
 
     def load_plain_corpus(self):
@@ -214,8 +413,9 @@ class ReynirCorpus:
         """ Load a TFIDF corpus from file """
         return corpora.MmCorpus(self._TFIDF_CORPUS_FILE)
 
-    def create_lsi_model(self, **kwargs):
-        """ Create an LSI model from the entire words database table """
+    def create_lsi_model(self, checkpoint=None, **kwargs):
+        """ Create an LSI model from the entire words database table,
+            which includes the articles parsed up to the checkpoint time """
         corpus_tfidf = self.load_tfidf_corpus()
         if self._dictionary is None:
             self.load_dictionary()
@@ -230,14 +430,88 @@ class ReynirCorpus:
         #    lsi.print_topics(num_topics = self._dimensions)
         # Save the generated model
         lsi.save(self._LSI_MODEL_FILE.format(self._dimensions))
-
-    def load_lsi_model(self):
-        """ Load a previously generated LSI model """
+        # The new model supersedes any incrementally updated versions
+        self._write_version(0, checkpoint or datetime.utcnow())
+        self._remove_versions(self._last_version() + 1)
+        if os.path.exists(self._PENDING_WORDS_FILE):
+            os.remove(self._PENDING_WORDS_FILE)
+
+    def _last_version(self):
+        """ Return the highest LSI model version on disk """
+        pattern = self._LSI_VERSION_MODEL_FILE.format(self._dimensions, "*")
+        versions = [0]
+        for fname in glob.glob(pattern):
+            try:
+                versions.append(int(fname.rsplit(".v", 1)[1].split(".")[0]))
+            except (IndexError, ValueError):
+                pass
+        return max(versions)
+
+    def load_lsi_model(self, mmap="r"):
+        """ Load the current version of a previously generated LSI model """
         self._model = models.LsiModel.load(
-            self._LSI_MODEL_FILE.format(self._dimensions), mmap="r"
+            self._lsi_model_file(self._version), mmap=mmap
         )
         self._model_name = "lsi"
 
+    def update_lsi_model(self, until=None):
+        """ Fold the articles parsed since the last checkpoint (and up to
+            the given time) into the LSI model, saving the result as a new
+            version of the model. The dictionary and the TF-IDF model are
+            not changed, so words that are not in the dictionary are left
+            out; they are however counted, and once enough of them occur in
+            enough articles, a full rebuild is recommended. Returns the
+            number of articles added. """
+        if self._checkpoint is None:
+            raise ValueError("No checkpoint: a full model build is needed first")
+        until = until or datetime.utcnow()
+        if self._dictionary is None:
+            self.load_dictionary()
+        if self._tfidf is None:
+            self.load_tfidf_model()
+        # The model is modified, so it is loaded into memory
+        self.load_lsi_model(mmap=None)
+        try:
+            with open(self._PENDING_WORDS_FILE, "r") as f:
+                pending = json.load(f)
+        except (OSError, ValueError):
+            pending = dict()
+        num_docs = 0
+
+        def documents():
+            """ Generate the TF-IDF vectors of the new articles, while
+                counting the articles where each unknown word occurs """
+            nonlocal num_docs
+            ci = CorpusIterator(since=self._checkpoint, until=until)
+            for bag in ci:
+                for w in set(bag):
+                    if w not in self._dictionary:
+                        pending[w] = pending.get(w, 0) + 1
+                num_docs += 1
+                yield self._tfidf[self._dictionary.doc2bow(bag)]
+
+        self._model.add_documents(documents())
+        if num_docs:
+            version = self._version + 1
+            self._model.save(self._lsi_model_file(version))
+            self._write_version(version, until)
+            self._remove_versions(version - self._KEEP_VERSIONS + 1)
+        else:
+            # Nothing new: just move the checkpoint
+            self._write_version(self._version, until)
+        with open(self._PENDING_WORDS_FILE + ".tmp", "w") as f:
+            json.dump(pending, f, ensure_ascii=False)
+        os.replace(self._PENDING_WORDS_FILE + ".tmp", self._PENDING_WORDS_FILE)
+        new_words = sum(1 for cnt in pending.values() if cnt >= self._NO_BELOW)
+        if new_words > self._MAX_GROWTH * len(self._dictionary):
+            print(
+                "{0} words that are not in the dictionary occur in at least "
+                "{1} new articles: a full model build is recommended".format(
+                    new_words, self._NO_BELOW
+                )
+            )
+        return num_docs
+
     def create_lda_model(self, **kwargs):
         """ Create a Latent Dirichlet Allocation (LDA) model from the
             entire words database table """
@@ -315,7 +589,10 @@ class ReynirCorpus:
                 topic.vector = json.dumps(d)
 
     def load_topics(self):
-        """ Load the topics into a dict of topic vectors by topic id """
+        """ Load the topics into a dict of topic vectors by topic id,
+            and into a matrix of normalized topic vectors, one row per
+            topic, for calculating the similarity of an article to all
+            topics at once """
         self._topics = {}
         with SessionContext(commit=True) as session:
             for topic in session.query(Topic).all():
@@ -327,6 +604,32 @@ class ReynirCorpus:
                             vector=topic_vector,
                             threshold=topic.threshold,
                         )
+        self._topic_ids = list(self._topics.keys())
+        m = np.array(
+            [
+                matutils.sparse2full(t["vector"], self._dimensions)
+                for t in self._topics.values()
+            ],
+            dtype=np.float64,
+        ).reshape(len(self._topic_ids), self._dimensions)
+        norms = np.linalg.norm(m, axis=1, keepdims=True)
+        norms[norms == 0.0] = 1.0
+        self._topic_matrix = m / norms
+        self._topic_thresholds = np.array(
+            [t["threshold"] for t in self._topics.values()], dtype=np.float64
+        )
+
+    def load_models(self):
+        """ Load the dictionary, the TFIDF and LSI models and the topics,
+            if not already loaded """
+        if self._dictionary is None:
+            self.load_dictionary()
+        if self._tfidf is None:
+            self.load_tfidf_model()
+        if self._model is None:
+            self.load_lsi_model()
+        if self._topics is None:
+            self.load_topics()
 
     def get_topic_vector(self, terms):
         """ Calculate a topic vector corresponding to the given list
@@ -428,10 +731,10 @@ class ReynirCorpus:
                     # Sum up the topic vectors of the documents where the term
                     # appears, weighted by the number of times it appears
                     # print("Found stem/cat '{0}'/{1} in {2} documents via words table".format(clean_stem, cat, len(q)))
-                    for tv_json, cnt in q:
+                    for tv_bin, tv_json, cnt in q:
                         # Get the term vector of a single document where the term appears
-                        if tv_json and cnt:
-                            tv = np.array(json.loads(tv_json))
+                        tv = decode_vector(tv_bin, tv_json) if cnt else None
+                        if tv is not None:
                             # Multiply the vector by the number of times the term appears
                             total_cnt += cnt
                             term_vector += tv * cnt
@@ -463,98 +766,179 @@ class ReynirCorpus:
 
         return topic_vector, term_weights
 
-    def assign_article_topics(self, article_id, heading, process_all=False):
-        """ Assign the appropriate topics to the given article in the database """
-        if self._dictionary is None:
-            self.load_dictionary()
-        if self._tfidf is None:
-            self.load_tfidf_model()
-        if self._model is None:
-            self.load_lsi_model()
-        if self._topics is None:
-            self.load_topics()
+    def article_topics(self, wlist):
+        """ Calculate the topic vector of an article from its list of words,
+            returning it as a dense array (or None if the article has no
+            topic vector), along with a list of (topic id, topic name,
+            similarity) tuples for the topics of the article """
+        if not self._topics or not wlist:
+            return None, []
+        bag = self._dictionary.doc2bow(wlist)
+        tfidf = self._tfidf[bag]
+        article_vector = self._model[tfidf]
+        if not article_vector:
+            return None, []
+        vec = matutils.sparse2full(article_vector, self._dimensions)
+        # Calculate the cosine similarity between the article and all topics
+        norm = np.linalg.norm(vec)
+        if norm == 0.0:
+            return vec, []
+        similarities = self._topic_matrix.dot(vec) / norm
+        if self._verbose:
+            for topic_id, similarity in zip(self._topic_ids, similarities):
+                print(
+                    "   Similarity to topic {0} is {1:.3f}".format(
+                        self._topics[topic_id]["name"], similarity
+                    )
+                )
+        # Similar enough: these are topics of the article
+        topics = []
+        for ix in np.flatnonzero(similarities >= self._topic_thresholds):
+            topic_id = self._topic_ids[ix]
+            topics.append(
+                (topic_id, self._topics[topic_id]["name"], float(similarities[ix]))
+            )
+        return vec, topics
+
+    def assign_article_topics(self, article_ids, process_all=False):
+        """ Assign the appropriate topics to the given articles in the
+            database, within a single transaction """
+        self.load_models()
         with SessionContext(commit=True) as session:
-            q = (
-                session.query(Word.stem, Word.cat, Word.cnt)
-                .filter(Word.article_id == article_id)
-                .all()
+            headings = dict(
+                session.query(Article.id, Article.heading).filter(
+                    Article.id.in_(article_ids)
+                )
             )
-            wlist = []
-            for stem, cat, cnt in q:
+            q = session.query(Word.article_id, Word.stem, Word.cat, Word.cnt).filter(
+                Word.article_id.in_(article_ids)
+            )
+            wlists = defaultdict(list)
+            for article_id, stem, cat, cnt in q:
                 # Convert stem to lowercase and replace spaces with underscores
                 w = w_from_stem(stem, cat)
                 if cnt == 1:
-                    wlist.append(w)
+                    wlists[article_id].append(w)
                 else:
-                    wlist.extend([w] * cnt)
-            topics = []
-            article_vector = []
-            if self._topics and wlist:
-                bag = self._dictionary.doc2bow(wlist)
-                tfidf = self._tfidf[bag]
-                article_vector = self._model[tfidf]
-                topic_names = []
+                    wlists[article_id].extend([w] * cnt)
+            article_topics = []
+            updates = []
+            now = datetime.utcnow()
+            for article_id in article_ids:
+                if article_id not in headings:
+                    continue
+                heading = headings[article_id]
                 if self._verbose:
                     print("{0} : {1}".format(article_id, heading))
-                for topic_id, topic_info in self._topics.items():
-                    topic_name = topic_info["name"]
-                    topic_vector = topic_info["vector"]
-                    topic_threshold = topic_info["threshold"]
-                    # Calculate the cosine similarity between the article and the topic
-                    similarity = matutils.cossim(article_vector, topic_vector)
-                    if self._verbose:
-                        print(
-                            "   Similarity to topic {0} is {1:.3f}".format(
-                                topic_name, similarity
-                            )
+                vec, topics = self.article_topics(wlists[article_id])
+                if topics and not process_all:
+                    print(
+                        "Article '{0}':\n   topics {1}".format(
+                            heading, [(name, sim) for _, name, sim in topics]
                         )
-                    if similarity >= topic_threshold:
-                        # Similar enough: this is a topic of the article
-                        topics.append(topic_id)
-                        topic_names.append((topic_name, similarity))
-                if topic_names and not process_all:
-                    print("Article '{0}':\n   topics {1}".format(heading, topic_names))
-            # Topics found (if any): delete previous ones (if any)
+                    )
+                article_topics.extend(
+                    dict(article_id=article_id, topic_id=topic_id)
+                    for topic_id, _, _ in topics
+                )
+                # Update the indexed timestamp and the article topic vector,
+                # stored as a dense array of floats
+                updates.append(
+                    dict(
+                        b_id=article_id,
+                        b_indexed=now,
+                        b_bin=None if vec is None else encode_vector(vec),
+                    )
+                )
+            if not updates:
+                return 0
+            # Delete previous topics of the articles (if any)...
             session.execute(
                 ArticleTopic.table()
                 .delete()
-                .where(ArticleTopic.article_id == article_id)
+                .where(ArticleTopic.article_id.in_(list(headings.keys())))
             )
             # ...and add the new ones
-            for topic_id in topics:
-                session.add(ArticleTopic(article_id=article_id, topic_id=topic_id))
-            # Update the indexed timestamp and the article topic vector
-            a = session.query(Article).filter(Article.id == article_id).one_or_none()
-            if a is not None:
-                a.indexed = datetime.utcnow()
-                if article_vector:
-                    # Store a pure list of floats
-                    topic_vector = [t[1] for t in article_vector]
-                    a.topic_vector = json.dumps(topic_vector)
-                else:
-                    a.topic_vector = None
-
-    def assign_topics(self, limit=None, process_all=False, uuid=None):
-        """ Assign topics to all articles that have no such assignment yet """
+            if article_topics:
+                session.execute(ArticleTopic.table().insert().values(article_topics))
+            table = Article.table()
+            session.execute(
+                table.update()
+                .where(table.c.id == bindparam("b_id"))
+                .values(
+                    indexed=bindparam("b_indexed"),
+                    # The JSON form of the topic vector is superseded
+                    topic_vector=None,
+                    topic_vector_bin=bindparam("b_bin"),
+                ),
+                updates,
+            )
+        return len(updates)
+
+    def _assign_batch(self, article_ids):
+        """ Assign topics to a batch of articles, within a worker process """
+        return self.assign_article_topics(article_ids, process_all=True)
+
+    def assign_topics(self, limit=None, process_all=False, uuid=None, workers=1):
+        """ Assign topics to all articles that have no such assignment yet,
+            in batches of articles that are each processed in a single
+            transaction. With more than one worker, the batches are
+            processed in parallel by forked worker processes that share
+            the models loaded by the parent. """
         with SessionContext(commit=True) as session:
             # Fetch articles that haven't been indexed (or have been parsed since),
             # and that have at least one associated Word in the words table.
-            q = session.query(Article.id, Article.heading)
+            q = session.query(Article.id)
             if uuid:
                 q = q.filter(Article.id == uuid)
             elif not process_all:
                 q = q.filter(
                     (Article.indexed == None) | (Article.indexed < Article.parsed)
                 )
-            q = q.join(Word).group_by(Article.id, Article.heading)
+            q = q.join(Word).group_by(Article.id)
             if uuid:
                 q = q.all()
             elif limit is None:
                 q = q.yield_per(2000)
             else:
                 q = q[0:limit]
-        for article_id, heading in q:
-            self.assign_article_topics(article_id, heading, process_all=process_all)
+            article_ids = [article_id for article_id, in q]
+        batches = [
+            article_ids[i : i + TAG_BATCH_SIZE]
+            for i in range(0, len(article_ids), TAG_BATCH_SIZE)
+        ]
+        self.load_models()
+        cnt = 0
+        t0 = time.time()
+
+        def report(n):
+            nonlocal cnt
+            cnt += n
+            if cnt // TAG_REPORT_INTERVAL != (cnt - n) // TAG_REPORT_INTERVAL:
+                print(
+                    "{0} articles tagged in {1:.1f} seconds".format(
+                        cnt, time.time() - t0
+                    )
+                )
+
+        if workers <= 1 or len(batches) <= 1:
+            for batch in batches:
+                report(self.assign_article_topics(batch, process_all=process_all))
+            return cnt
+        # Close the parent's database connections, so that the workers,
+        # which are forked with a copy of the connection pool, open their
+        # own connections instead of sharing the parent's. The parent
+        # does not use the database while the workers are running.
+        SessionContext.db.dispose()
+        with WorkerPool(self._assign_batch, workers) as pool:
+            for batch, n in pool.imap_unordered(batches):
+                if n is None:
+                    print(
+                        "Tagging failed for a batch of {0} articles".format(len(batch))
+                    )
+                else:
+                    report(n)
+        return cnt
 
 
 def build_model(verbose=False):
@@ -566,18 +950,20 @@ def build_model(verbose=False):
 
     t0 = time.time()
 
+    # Articles parsed after this point are folded in by the next update
+    checkpoint = datetime.utcnow()
     rc = ReynirCorpus(verbose=verbose)
     print("Creating dictionary")
-    rc.create_dictionary()
+    rc.create_dictionary(until=checkpoint)
     print("Creating plain corpus")
-    rc.create_plain_corpus()
+    rc.create_plain_corpus(until=checkpoint)
     print("Creating TF-IDF model")
     rc.create_tfidf_model()
     print("Creating TF-IDF corpus")
     rc.create_tfidf_corpus()
     # rc.create_lda_model(passes = 15)
     print("Creating LSI model")
-    rc.create_lsi_model()
+    rc.create_lsi_model(checkpoint=checkpoint)
 
     t1 = time.time()
 
@@ -587,6 +973,32 @@ def build_model(verbose=False):
     print("Time: {0}\n".format(ts))
 
 
+def update_model(verbose=False):
+    """ Fold newly parsed articles into the LSI model and recalculate
+        the topic vectors from keywords with the updated model """
+
+    print("------ Greynir starting model update -------")
+    ts = "{0}".format(datetime.utcnow())[0:19]
+    print("Time: {0}".format(ts))
+
+    t0 = time.time()
+
+    rc = ReynirCorpus(verbose=verbose)
+    print("Updating LSI model version {0}".format(rc.version))
+    cnt = rc.update_lsi_model()
+    print("{0} articles added, model version is now {1}".format(cnt, rc.version))
+    if cnt:
+        rc.calculate_topics()
+
+    t1 = time.time()
+
+    print("\n------ Model update completed -------")
+    print("Total time: {0:.2f} seconds".format(t1 - t0))
+    ts = "{0}".format(datetime.utcnow())[0:19]
+    print("Time: {0}\n".format(ts))
+    return cnt
+
+
 def calculate_topics(verbose=False):
     """ Recalculate topic vectors from keywords """
 
@@ -597,7 +1009,7 @@ def calculate_topics(verbose=False):
     print("------ Greynir recalculation complete -------")
 
 
-def tag_articles(limit, verbose=False, process_all=False, uuid=None):
+def tag_articles(limit, verbose=False, process_all=False, uuid=None, workers=1):
     """ Tag all untagged articles or articles that
         have been parsed since they were tagged """
 
@@ -608,6 +1020,8 @@ def tag_articles(limit, verbose=False, process_all=False, uuid=None):
         print("Processing all articles")
     elif limit:
         print("Limit: {0} articles".format(limit))
+    if workers > 1:
+        print("Worker processes: {0}".format(workers))
     ts = "{0}".format(datetime.utcnow())[0:19]
     print("Time: {0}".format(ts))
 
@@ -615,21 +1029,73 @@ def tag_articles(limit, verbose=False, process_all=False, uuid=None):
 
     rc = ReynirCorpus(verbose=verbose)
     rc.load_lsi_model()
-    rc.assign_topics(limit, process_all, uuid)
+    cnt = rc.assign_topics(limit, process_all, uuid, workers)
 
     t1 = time.time()
 
     print("\n------ Tagging completed -------")
+    print("Articles tagged: {0}".format(cnt))
     print("Total time: {0:.2f} seconds".format(t1 - t0))
     ts = "{0}".format(datetime.utcnow())[0:19]
     print("Time: {0}\n".format(ts))
 
 
-def notify_similarity_server():
+def convert_vectors(batch_size=1000):
+    """ Convert the topic vectors of articles from the older JSON form
+        to the binary form, in batches of batch_size articles, each
+        batch being committed in its own transaction """
+
+    print("------ Greynir converting topic vectors -------")
+    with SessionContext(commit=True) as session:
+        session.execute(
+            "ALTER TABLE articles ADD COLUMN IF NOT EXISTS topic_vector_bin bytea;"
+        )
+    table = Article.table()
+    upd = (
+        table.update()
+        .where(table.c.url == bindparam("b_url"))
+        .values(topic_vector_bin=bindparam("b_bin"), topic_vector=None)
+    )
+
+    def convert(url, tv_json):
+        tv = decode_vector(None, tv_json)
+        return dict(b_url=url, b_bin=None if tv is None else encode_vector(tv))
+
+    last_url = ""
+    count = 0
+    t0 = time.time()
+    while True:
+        with SessionContext(commit=True) as session:
+            q = (
+                session.query(Article)
+                .filter(Article.topic_vector != None)
+                .filter(Article.url > last_url)
+                .with_entities(Article.url, Article.topic_vector)
+                .order_by(Article.url)
+                .limit(batch_size)
+            )
+            rows = q.all()
+            if not rows:
+                break
+            session.execute(upd, [convert(url, tv_json) for url, tv_json in rows])
+            last_url = rows[-1].url
+        count += len(rows)
+        print(
+            "{0} topic vectors converted in {1:.1f} seconds".format(
+                count, time.time() - t0
+            )
+        )
+    print("------ Conversion completed -------")
+
+
+def notify_similarity_server(reload=False):
     """ Notify the similarity server - if running - that article tags have been updated """
     try:
         client = SimilarityClient()
-        client.refresh_topics()
+        if reload:
+            client.reload_topics()
+        else:
+            client.refresh_topics()
         client.close()
     except Exception as e:
         print("Exception in notify_similarity_server(): {0}".format(e))
@@ -653,12 +1119,17 @@ __doc__ = """
         -h, --help       : Show this help text
         -l N, --limit=N  : Limit processing to N articles
         -a, --all        : Process all articles
+        -w N, --workers=N: Tag articles using N worker processes (default 1)
         -v, --verbose    : Show diagnostics while processing
 
     Commands:
         tag [uuid] : tag any untagged articles (or the article with the given uuid)
         topics     : recalculate topic vectors from keywords
         model      : rebuild dictionary and model from parsed articles
+        update     : add articles parsed since the last build or update
+                     to the model, as a new version of it, and
+                     recalculate topic vectors
+        convert    : convert stored topic vectors from JSON to binary form
 
 """
 
@@ -670,7 +1141,9 @@ def _main(argv=None):
     try:
         try:
             opts, args = getopt.getopt(
-                argv[1:], "hl:van", ["help", "limit=", "verbose", "all", "notify"]
+                argv[1:],
+                "hl:vanw:",
+                ["help", "limit=", "verbose", "all", "notify", "workers="],
             )
         except getopt.error as msg:
             raise Usage(msg)
@@ -680,6 +1153,7 @@ def _main(argv=None):
         verbose = False
         process_all = False
         notify = False
+        workers = 1
 
         # Process options
         for o, a in opts:
@@ -699,6 +1173,11 @@ def _main(argv=None):
                 process_all = True
             elif o in ("-n", "--notify"):
                 notify = True
+            elif o in ("-w", "--workers"):
+                try:
+                    workers = max(1, int(a))
+                except ValueError:
+                    raise Usage("Invalid number of workers: {0}".format(a))
 
         # if process_all and limit_specified:
         #    raise Usage("--all and --limit cannot be used together")
@@ -724,11 +1203,16 @@ def _main(argv=None):
             if process_all and not limit_specified:
                 limit = None
             tag_articles(
-                limit=limit, verbose=verbose, process_all=process_all, uuid=uuid
+                limit=limit,
+                verbose=verbose,
+                process_all=process_all,
+                uuid=uuid,
+                workers=workers,
             )
             if notify:
-                # Inform the similarity server that we have new article tags
-                notify_similarity_server()
+                # Inform the similarity server that we have new article tags;
+                # if all articles were tagged, it reloads them all
+                notify_similarity_server(reload=process_all and not limit_specified)
         elif arg == "topics":
             # Calculate topics
             if la > 1:
@@ -739,6 +1223,20 @@ def _main(argv=None):
             if la > 1:
                 raise Usage("Too many arguments")
             build_model(verbose=verbose)
+        elif arg == "update":
+            # Update model incrementally
+            if la > 1:
+                raise Usage("Too many arguments")
+            try:
+                update_model(verbose=verbose)
+            except ValueError as e:
+                print(str(e), file=sys.stderr)
+                return 1
+        elif arg == "convert":
+            # Convert topic vectors to binary form
+            if la > 1:
+                raise Usage("Too many arguments")
+            convert_vectors()
         else:
             raise Usage("Unknown command: '{0}'".format(arg))
 
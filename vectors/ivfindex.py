@@ -0,0 +1,187 @@
+"""
+    Greynir: Natural language processing for Icelandic
+
+    Inverted file index for approximate similarity search
+
+    Copyright (C) 2020 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+
+    This module implements an inverted file (IVF) index over the rows
+    of a matrix of unit-length topic vectors, for approximate nearest
+    neighbour search by cosine similarity.
+
+    The vectors are partitioned into lists by spherical k-means
+    clustering: each list holds the rows that are closest to one of the
+    cluster centroids. A query only scores the rows in the lists whose
+    centroids are closest to the query vector (the probes), instead of
+    all rows. The more lists are probed, the higher the recall and the
+    latency; tools such as vectors/annbench.py measure both against
+    the exact search.
+
+    The index refers to rows of the matrix by position and does not
+    keep copies of the vectors. New rows are assigned to the list of
+    their closest centroid as they are added, while the centroids stay
+    fixed until the index is trained anew. The centroids can be saved to
+    disk, together with an identifier of the model that produced the
+    vectors, so that a restarted server need not train the index again.
+    When loaded, all rows are assigned to lists anew, since the vectors
+    may have changed in the meantime; if the model has changed, the
+    centroids no longer fit the vectors and the index is not loaded.
+
+"""
+
+import os
+import math
+
+import numpy as np
+
+
+class IVFIndex:
+
+    """ An inverted file index over the rows of a matrix of unit vectors """
+
+    # Number of k-means iterations when training
+    ITERATIONS = 8
+    # Number of training vectors sampled per list
+    SAMPLES_PER_LIST = 32
+    # Number of rows assigned to lists at a time, to limit memory use
+    CHUNK_SIZE = 4096
+
+    def __init__(self, centroids, assign, trained_size):
+        # The normalized cluster centroids, one row per list
+        self.centroids = centroids
+        # The list number of each row of the matrix
+        self.assign = assign
+        # The number of rows in the matrix when the index was trained
+        self.trained_size = trained_size
+        # The rows sorted by list, and the offset of each list within them
+        self.order = np.argsort(assign, kind="stable").astype(np.int32)
+        self.offsets = np.searchsorted(
+            assign[self.order], np.arange(len(centroids) + 1)
+        )
+
+    @property
+    def num_lists(self):
+        return len(self.centroids)
+
+    @staticmethod
+    def default_lists(num_rows):
+        """ Return a reasonable number of lists for a matrix of the given size """
+        return max(1, int(4 * math.sqrt(num_rows)))
+
+    @classmethod
+    def nearest(cls, centroids, rows):
+        """ Return the number of the closest centroid to each row """
+        result = np.empty(len(rows), dtype=np.int32)
+        for i in range(0, len(rows), cls.CHUNK_SIZE):
+            chunk = rows[i : i + cls.CHUNK_SIZE]
+            result[i : i + len(chunk)] = np.argmax(chunk.dot(centroids.T), axis=1)
+        return result
+
+    @classmethod
+    def train(cls, matrix, num_lists=0, seed=None):
+        """ Cluster the rows of the matrix into lists by spherical
+            k-means, on a sample of the rows, and return an index
+            with all rows assigned to lists """
+        rng = np.random.default_rng(seed)
+        n = len(matrix)
+        num_lists = min(num_lists or cls.default_lists(n), n)
+        if num_lists <= 0:
+            raise ValueError("Cannot train an index on an empty matrix")
+        sample_size = min(n, num_lists * cls.SAMPLES_PER_LIST)
+        sample = matrix[np.sort(rng.choice(n, sample_size, replace=False))]
+        centroids = sample[rng.choice(sample_size, num_lists, replace=False)].copy()
+        for _ in range(cls.ITERATIONS):
+            nearest = cls.nearest(centroids, sample)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, nearest, sample)
+            norms = np.linalg.norm(sums, axis=1)
+            empty = norms == 0.0
+            if empty.any():
+                # Reseed empty lists with random sample vectors
+                sums[empty] = sample[rng.choice(sample_size, int(empty.sum()))]
+                norms[empty] = np.linalg.norm(sums[empty], axis=1)
+            norms[norms == 0.0] = 1.0
+            centroids = (sums / norms[:, np.newaxis]).astype(np.float32)
+        return cls(centroids, cls.nearest(centroids, matrix), n)
+
+    def updated(self, matrix, rows):
+        """ Return a new index where the given rows of the matrix, which
+            are either new (appended) rows or rows whose vectors have
+            changed, are assigned to the lists of their closest centroids """
+        assign = np.empty(len(matrix), dtype=np.int32)
+        n = min(len(self.assign), len(matrix))
+        assign[0:n] = self.assign[0:n]
+        rows = np.asarray(rows, dtype=np.int64)
+        if len(rows):
+            assign[rows] = self.nearest(self.centroids, matrix[rows])
+        return IVFIndex(self.centroids, assign, self.trained_size)
+
+    def search(self, matrix, n, vector, probes, live=None):
+        """ Return a tuple of arrays (rows, scores) for the n rows of the
+            matrix with the highest similarity to the given unit vector,
+            in descending order of similarity, among the rows in the
+            lists of the closest centroids. If a boolean mask of live
+            rows is given, other rows are skipped. """
+        probes = min(probes, self.num_lists)
+        cs = self.centroids.dot(vector)
+        if probes < len(cs):
+            lists = np.argpartition(-cs, probes - 1)[0:probes]
+        else:
+            lists = np.arange(len(cs))
+        offsets = self.offsets
+        candidates = np.concatenate(
+            [self.order[offsets[k] : offsets[k + 1]] for k in lists]
+        )
+        if live is not None:
+            candidates = candidates[live[candidates]]
+        scores = matrix[candidates].dot(vector)
+        if n < len(scores):
+            top = np.argpartition(-scores, n - 1)[0:n]
+        else:
+            top = np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return candidates[top], scores[top]
+
+    def save(self, fname, model):
+        """ Save the centroids of the index to a file, along with a string
+            that identifies the model that produced the vectors. The file
+            is replaced atomically. """
+        tmp = fname + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez(
+                f,
+                centroids=self.centroids,
+                trained_size=np.array([self.trained_size]),
+                model=np.array([model]),
+            )
+        os.replace(tmp, fname)
+
+    @classmethod
+    def load(cls, fname, matrix, model):
+        """ Load an index from a file and assign all rows of the given
+            matrix to its lists. Returns None if the file does not exist,
+            if it was saved for another model, or if it does not fit
+            the matrix. """
+        if not os.path.exists(fname):
+            return None
+        with np.load(fname) as f:
+            if "model" not in f or str(f["model"][0]) != model:
+                return None
+            centroids = f["centroids"]
+            trained_size = int(f["trained_size"][0])
+        if centroids.shape[1] != matrix.shape[1]:
+            return None
+        return cls(centroids, cls.nearest(centroids, matrix), trained_size)
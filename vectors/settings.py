@@ -223,6 +223,31 @@ class Settings:
     except ValueError:
         raise ConfigError("Invalid environment variable value: DB_PORT = {0}".format(DB_PORT))
 
+    # Database connection pool (see the main settings.py)
+    DB_POOL_SIZE = os.environ.get('GREYNIR_DB_POOL_SIZE', '5')
+    DB_MAX_OVERFLOW = os.environ.get('GREYNIR_DB_MAX_OVERFLOW', '10')
+    DB_POOL_TIMEOUT = os.environ.get('GREYNIR_DB_POOL_TIMEOUT', '30')
+    DB_POOL_RECYCLE = os.environ.get('GREYNIR_DB_POOL_RECYCLE', '1800')
+    DB_PRE_PING = os.environ.get('GREYNIR_DB_PRE_PING', '1')
+    DB_PGBOUNCER = os.environ.get('GREYNIR_DB_PGBOUNCER', '0')
+    try:
+        DB_POOL_SIZE = int(DB_POOL_SIZE)
+        DB_MAX_OVERFLOW = int(DB_MAX_OVERFLOW)
+        DB_POOL_TIMEOUT = float(DB_POOL_TIMEOUT)
+        DB_POOL_RECYCLE = int(DB_POOL_RECYCLE)
+        DB_PRE_PING = bool(int(DB_PRE_PING))
+        DB_PGBOUNCER = bool(int(DB_PGBOUNCER))
+    except ValueError:
+        raise ConfigError(
+            "Invalid environment variable value: GREYNIR_DB_POOL_SIZE = {0}, "
+            "GREYNIR_DB_MAX_OVERFLOW = {1}, GREYNIR_DB_POOL_TIMEOUT = {2}, "
+            "GREYNIR_DB_POOL_RECYCLE = {3}, GREYNIR_DB_PRE_PING = {4}, "
+            "GREYNIR_DB_PGBOUNCER = {5}".format(
+                DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT,
+                DB_POOL_RECYCLE, DB_PRE_PING, DB_PGBOUNCER
+            )
+        )
+
     # Flask server host and port
     HOST = os.environ.get('GREYNIR_HOST', 'localhost')
     PORT = os.environ.get('GREYNIR_PORT', '5000')
@@ -242,6 +267,52 @@ class Settings:
     except ValueError:
         raise ConfigError("Invalid environment variable value: SIMSERVER_PORT = {0}".format(SIMSERVER_PORT))
 
+    # Size of the similarity client's connection pool, and the timeout
+    # in seconds of each call to the similarity server
+    SIMSERVER_POOL_SIZE = os.environ.get('SIMSERVER_POOL_SIZE', '4')
+    SIMSERVER_TIMEOUT = os.environ.get('SIMSERVER_TIMEOUT', '5.0')
+    try:
+        SIMSERVER_POOL_SIZE = int(SIMSERVER_POOL_SIZE)
+        SIMSERVER_TIMEOUT = float(SIMSERVER_TIMEOUT)
+    except ValueError:
+        raise ConfigError(
+            "Invalid environment variable value: SIMSERVER_POOL_SIZE = {0}, "
+            "SIMSERVER_TIMEOUT = {1}".format(SIMSERVER_POOL_SIZE, SIMSERVER_TIMEOUT)
+        )
+
+    # Approximate nearest neighbour search in the similarity server, using an
+    # inverted file index (see ivfindex.py) with the given number of lists
+    # (0 = chosen from the number of articles), probing the given number of
+    # lists per query. The index is saved to the given file for fast restarts.
+    SIMSERVER_ANN = os.environ.get('SIMSERVER_ANN', '0')
+    SIMSERVER_ANN_LISTS = os.environ.get('SIMSERVER_ANN_LISTS', '0')
+    SIMSERVER_ANN_PROBES = os.environ.get('SIMSERVER_ANN_PROBES', '32')
+    SIMSERVER_ANN_FILE = os.environ.get('SIMSERVER_ANN_FILE', './models/ivf-index.npz')
+    try:
+        SIMSERVER_ANN = bool(int(SIMSERVER_ANN))
+        SIMSERVER_ANN_LISTS = int(SIMSERVER_ANN_LISTS)
+        SIMSERVER_ANN_PROBES = int(SIMSERVER_ANN_PROBES)
+    except ValueError:
+        raise ConfigError(
+            "Invalid environment variable value: SIMSERVER_ANN = {0}, "
+            "SIMSERVER_ANN_LISTS = {1}, SIMSERVER_ANN_PROBES = {2}"
+            .format(SIMSERVER_ANN, SIMSERVER_ANN_LISTS, SIMSERVER_ANN_PROBES)
+        )
+
+    # Number of worker threads serving similarity requests
+    SIMSERVER_WORKERS = os.environ.get('SIMSERVER_WORKERS', '8')
+    try:
+        SIMSERVER_WORKERS = int(SIMSERVER_WORKERS)
+    except ValueError:
+        raise ConfigError(
+            "Invalid environment variable value: SIMSERVER_WORKERS = {0}"
+            .format(SIMSERVER_WORKERS)
+        )
+
+    # Path prefix of the snapshot of the topic matrix that the similarity
+    # server saves and memory-maps on startup (empty = no snapshot)
+    SIMSERVER_SNAPSHOT = os.environ.get('SIMSERVER_SNAPSHOT', './models/topics')
+
     # Configuration settings from the Greynir.conf file
 
     @staticmethod
@@ -269,6 +340,22 @@ class Settings:
                 Settings.SIMSERVER_HOST = val
             elif par == 'simserver_port':
                 Settings.SIMSERVER_PORT = int(val)
+            elif par == 'simserver_pool_size':
+                Settings.SIMSERVER_POOL_SIZE = int(val)
+            elif par == 'simserver_timeout':
+                Settings.SIMSERVER_TIMEOUT = float(val)
+            elif par == 'simserver_ann':
+                Settings.SIMSERVER_ANN = bool(val)
+            elif par == 'simserver_ann_lists':
+                Settings.SIMSERVER_ANN_LISTS = int(val)
+            elif par == 'simserver_ann_probes':
+                Settings.SIMSERVER_ANN_PROBES = int(val)
+            elif par == 'simserver_ann_file':
+                Settings.SIMSERVER_ANN_FILE = val
+            elif par == 'simserver_workers':
+                Settings.SIMSERVER_WORKERS = int(val)
+            elif par == 'simserver_snapshot':
+                Settings.SIMSERVER_SNAPSHOT = val
             elif par == 'debug':
                 Settings.DEBUG = bool(val)
             else:
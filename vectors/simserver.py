@@ -23,7 +23,21 @@
     This module implements a similarity query server. The server can
     answer queries about articles that are similar to a given article
     or topic vector. This assumes that articles already have topic vectors
-    that are stored in the topic_vector column in the articles database table.
+    that are stored in the topic_vector_bin column (or, for articles that
+    have not been converted, the JSON topic_vector column) in the articles
+    database table.
+
+    The topic matrix is saved as a snapshot on disk (see SIMSERVER_SNAPSHOT
+    in settings.py) after a full load and periodically thereafter. On
+    startup, the snapshot is memory-mapped and only the vectors of articles
+    indexed since it was saved are read from the database.
+
+    By default, similarity queries are exact, comparing the query vector
+    with the topic vectors of all articles. Setting SIMSERVER_ANN=1 in the
+    environment (or simserver_ann = true in Vectors.conf) enables an
+    approximate search using an inverted file index (see ivfindex.py),
+    whose recall and latency can be measured with annbench.py. A client
+    can still request an exact search by passing exact=True.
 
     The similarity server by default accepts TCP connections on port 5001.
     For security, this port should be closed from outside access via iptables or
@@ -62,24 +76,26 @@
 
 """
 
-import json
 import time
-import math
-import heapq
 import sys
-import operator
-
-import numpy as np
 
 from threading import Thread, Lock
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from multiprocessing import AuthenticationError
-from multiprocessing.connection import Listener, Client
+from multiprocessing import AuthenticationError, Pipe
+from multiprocessing.connection import Listener, Client, wait
 
 from settings import Settings, ConfigError
 from db import SessionContext, desc
 from db.models import Article, Root
-from builder import ReynirCorpus
+from builder import ReynirCorpus, decode_vector
+from ivfindex import IVFIndex
+from topicmatrix import TopicMatrix
+
+
+# A new snapshot of the topic matrix is saved when this many
+# vectors have been added or replaced since the last one
+SNAPSHOT_INTERVAL = 10000
 
 
 class InternalError(RuntimeError):
@@ -89,67 +105,223 @@ class InternalError(RuntimeError):
         super().__init__(s)
 
 
+class ClientError(RuntimeError):
+    """ Exception class for handling erroneous requests from clients """
+
+    def __init__(self, request):
+        super().__init__("Invalid request received: {0!r}".format(request))
+
+
 class SimilarityServer:
 
-    """ A class that manages an in-memory dictionary of articles
-        and their topic vectors, and allows similarity queries of that
-        dictionary. The dictionary is refreshed upon request from the
-        articles database table.
+    """ A class that manages an in-memory matrix of article topic vectors,
+        and allows similarity queries of that matrix. The matrix is
+        refreshed upon request from the articles database table.
+        Queries run on the current snapshot of the matrix without locking,
+        while refreshes and reloads create a new snapshot in a background
+        thread and swap it in. Client requests are served by a bounded pool
+        of worker threads, and several similarity queries can be sent in
+        one batch request.
     """
 
     def __init__(self):
-        # Do an initial load of all article topic vectors
+        # The lock serializes refreshes and reloads of the topic vectors
         self._lock = Lock()
         self._timestamp = None
-        self._atopics = {}
-        self._corpus = None
-
-    def _load_topics(self):
-        """ Load all article topics into the self._atopics dictionary """
-        self._atopics = {}
+        # The model (a ReynirCorpus) and the topic matrix of the vectors
+        # that it produced, which are swapped together, so that queries
+        # always project terms with the model of the matrix they search
+        self._state = (None, None)
+        # Number of vectors added since the last snapshot was saved
+        self._unsaved = 0
+        # Pending background update of the topic vectors, if any
+        self._update_lock = Lock()
+        self._update_pending = None
+        self._updating = False
+        # Client connections that are waiting for a request, and a pipe
+        # that wakes up the dispatcher when that set changes
+        self._idle_lock = Lock()
+        self._idle = set()
+        self._wakeup_r, self._wakeup_w = Pipe(duplex=False)
+        self._pool = None
+
+    @property
+    def _corpus(self):
+        return self._state[0]
+
+    @property
+    def _topics(self):
+        return self._state[1]
+
+    def _read_topics(self, q, dimensions):
+        """ Read (article id, topic vector) rows from the query q,
+            returning a list of ids and a parallel list of vectors """
+        ids = []
+        vectors = []
+        for a in q:
+            vec = decode_vector(a.topic_vector_bin, a.topic_vector)
+            if vec is None:
+                continue
+            if len(vec) == dimensions:
+                ids.append(a.id)
+                vectors.append(vec)
+            else:
+                print("Warning: faulty topic vector for article {0}".format(a.id))
+        return ids, vectors
+
+    def _load_topics(self, corpus):
+        """ Load all article topics into a new topic matrix, and swap
+            it in along with the model that produced them """
         with SessionContext(commit=True, read_only=True) as session:
             print("Starting load of all article topic vectors")
             t0 = time.time()
             # Do the next refresh from this time point
-            self._timestamp = datetime.utcnow()
+            timestamp = datetime.utcnow()
             q = (
                 session.query(Article)
                 .join(Root)
                 .filter(Root.visible)
-                .with_entities(Article.id, Article.topic_vector)
+                .with_entities(
+                    Article.id, Article.topic_vector_bin, Article.topic_vector
+                )
             )
-
-            for a in q.yield_per(2000):
-                if a.topic_vector:
-                    # Load topic vector in to a numpy array
-                    vec = json.loads(a.topic_vector)
-                    if isinstance(vec, list) and len(vec) == self._corpus.dimensions:
-                        self._atopics[a.id] = np.array(vec)
-                    else:
-                        print(
-                            "Warning: faulty topic vector for article {0}".format(a.id)
-                        )
-
+            ids, vectors = self._read_topics(q.yield_per(2000), corpus.dimensions)
+            topics = TopicMatrix(corpus.dimensions).updated(ids, vectors)
+            del vectors
+            if Settings.SIMSERVER_ANN:
+                self._attach_index(topics, corpus)
+            # Swap in the new matrix
+            self._state = (corpus, topics)
+            self._timestamp = timestamp
             t1 = time.time()
             print(
                 "Loading of {0} topic vectors completed in {1:.2f} seconds".format(
-                    len(self._atopics), t1 - t0
+                    len(topics), t1 - t0
+                )
+            )
+        self._save_snapshot()
+
+    def _start_topics(self):
+        """ Load the topic vectors when the server starts: map the snapshot
+            of the topic matrix, if there is one, and top it up with the
+            vectors of articles indexed since it was saved. Otherwise,
+            load all topic vectors from the database. """
+        snapshot = None
+        if Settings.SIMSERVER_SNAPSHOT:
+            t0 = time.time()
+            try:
+                snapshot = TopicMatrix.load(
+                    Settings.SIMSERVER_SNAPSHOT, self._corpus.dimensions
+                )
+            except Exception as ex:
+                print("Unable to load topic vector snapshot: {0}".format(ex))
+            if snapshot is not None:
+                topics, timestamp = snapshot
+                print(
+                    "Snapshot of {0} topic vectors from {1} mapped "
+                    "in {2:.2f} seconds".format(len(topics), timestamp, time.time() - t0)
+                )
+                if Settings.SIMSERVER_ANN:
+                    self._attach_index(topics, self._corpus)
+                self._state = (self._corpus, topics)
+                self._timestamp = timestamp
+                self.refresh_topics()
+                return
+        with self._lock:
+            self._load_topics(self._corpus)
+
+    def _save_snapshot(self):
+        """ Save a snapshot of the current topic matrix, if enabled """
+        self._unsaved = 0
+        if not Settings.SIMSERVER_SNAPSHOT:
+            return
+        t0 = time.time()
+        try:
+            self._topics.save(Settings.SIMSERVER_SNAPSHOT, self._timestamp)
+        except Exception as ex:
+            print("Unable to save topic vector snapshot: {0}".format(ex))
+            return
+        print(
+            "Snapshot of {0} topic vectors saved in {1:.2f} seconds".format(
+                len(self._topics), time.time() - t0
+            )
+        )
+
+    @staticmethod
+    def _model_key(corpus):
+        """ Return a string that identifies the version of the model
+            that produced the topic vectors """
+        return "{0}|{1}".format(corpus.version, corpus.checkpoint)
+
+    def _attach_index(self, topics, corpus):
+        """ Attach an inverted file index to a freshly loaded topic matrix,
+            loading it from disk if it was trained for the given model,
+            or otherwise training it """
+        if not len(topics):
+            return
+        t0 = time.time()
+        fname = Settings.SIMSERVER_ANN_FILE
+        ivf = None
+        try:
+            ivf = IVFIndex.load(fname, topics.matrix, self._model_key(corpus))
+        except Exception as ex:
+            print("Unable to load similarity index from {0}: {1}".format(fname, ex))
+        if ivf is not None and len(topics) > 2 * ivf.trained_size:
+            # The archive has more than doubled since the index was
+            # trained: train it again to keep the lists balanced
+            ivf = None
+        if ivf is None:
+            ivf = IVFIndex.train(topics.matrix, Settings.SIMSERVER_ANN_LISTS)
+            print(
+                "Similarity index with {0} lists trained in {1:.2f} seconds".format(
+                    ivf.num_lists, time.time() - t0
+                )
+            )
+            self._save_index(ivf, corpus)
+        else:
+            print(
+                "Similarity index with {0} lists loaded in {1:.2f} seconds".format(
+                    ivf.num_lists, time.time() - t0
+                )
+            )
+        topics.ivf = ivf
+
+    def _save_index(self, ivf, corpus):
+        """ Save the centroids of a newly trained inverted file index """
+        try:
+            ivf.save(Settings.SIMSERVER_ANN_FILE, self._model_key(corpus))
+        except Exception as ex:
+            print(
+                "Unable to save similarity index to {0}: {1}".format(
+                    Settings.SIMSERVER_ANN_FILE, ex
                 )
             )
 
     def article_topic(self, article_id):
         """ Return the topic vector of the article having the given uuid,
             or None if no such article exists """
-        return self._atopics.get(article_id)
+        return self._topics.vector(article_id)
 
     def reload_topics(self):
-        """ Reload all article topic vectors from the database """
+        """ Reload all article topic vectors from the database, and
+            switch to a new version of the model, if there is one """
         with self._lock:
-            # Can't serve queries while we're doing this
-            self._load_topics()
+            corpus = ReynirCorpus()
+            if (corpus.version, corpus.checkpoint) == (
+                self._corpus.version,
+                self._corpus.checkpoint,
+            ):
+                corpus = self._corpus
+            else:
+                # Load the new model up front, before any query uses it
+                print("Loading model version {0}".format(corpus.version))
+                corpus.load_models()
+            # The new model and the topic vectors are swapped in together,
+            # once they have been loaded
+            self._load_topics(corpus)
 
     def refresh_topics(self):
-        """ Load any new article topics into the _atopics dict """
+        """ Load any new article topics into the topic matrix """
         with self._lock:
             with SessionContext(commit=True, read_only=True) as session:
                 # Do the next refresh from this time point
@@ -159,68 +331,69 @@ class SimilarityServer:
                     .join(Root)
                     .filter(Root.visible)
                     .filter(Article.indexed >= self._timestamp)
-                    .with_entities(Article.id, Article.topic_vector)
+                    .with_entities(
+                        Article.id, Article.topic_vector_bin, Article.topic_vector
+                    )
                 )
+                corpus, topics = self._state
+                ids, vectors = self._read_topics(q.yield_per(100), corpus.dimensions)
+                self._state = (corpus, topics.updated(ids, vectors))
                 self._timestamp = ts
-                count = 0
-                for a in q.yield_per(100):
-                    if a.topic_vector:
-                        # Load topic vector in to a numpy array
-                        vec = json.loads(a.topic_vector)
-                        if (
-                            isinstance(vec, list)
-                            and len(vec) == self._corpus.dimensions
-                        ):
-                            self._atopics[a.id] = np.array(vec)
-                            count += 1
-                        else:
-                            print(
-                                "Warning: faulty topic vector for article {0}".format(
-                                    a.id
-                                )
-                            )
                 print(
-                    "Completed refresh_topics, {0} article vectors added".format(count)
-                )
-
-    def _iter_similarities(self, vector):
-        """ Generator of (id, similarity) tuples for all articles to the given vector """
-        base = np.array(vector)
-        norm_base = np.dot(base, base)  # This is faster than linalg.norm()
-        if norm_base < 1.0e-6:
-            # No data to search by
-            return
-
-        def cosine_similarity(v):
-            """ Compute cosine similarity of v1 to v2: (v1 dot v2)/(|v1|*|v2|) """
-            norm_v = np.dot(v, v)  # This is faster than linalg.norm()
-            dot_product = np.dot(v, base)
-            return float(dot_product / math.sqrt(norm_v * norm_base))
-
-        for article_id, topic_vector in self._atopics.items():
-            try:
-                cs = cosine_similarity(topic_vector)
-                yield article_id, cs
-            except Exception as ex:
-                # If there is an error in the calculations, probably
-                # due to a faulty topic vector, simply don't include
-                # the article
-                print(
-                    "Error in cosine similarity for article {0}: {1}".format(
-                        article_id, ex
+                    "Completed refresh_topics, {0} article vectors added".format(
+                        len(ids)
                     )
                 )
-                pass
+            # Save a new snapshot once enough vectors have been added
+            # since the last one, to keep restarts quick
+            self._unsaved += len(ids)
+            if self._unsaved >= SNAPSHOT_INTERVAL:
+                self._save_snapshot()
 
-    def find_similar(self, n, vector):
+    def find_similar(self, n, vector, exact=False, topics=None):
         """ Return the N articles with the highest similarity score to the given vector,
-            as a list of tuples (article_uuid, similarity) """
-        if vector is None or len(vector) == 0 or all(e == 0.0 for e in vector):
+            as a list of tuples (article_uuid, similarity). The search is approximate
+            if the similarity index is enabled, unless exact is True. The current
+            topic matrix is searched unless another one is given. """
+        if vector is None or len(vector) == 0:
             return []
-        with self._lock:
-            return heapq.nlargest(
-                n, self._iter_similarities(vector), key=operator.itemgetter(1)
-            )
+        if topics is None:
+            topics = self._topics
+        return topics.most_similar(
+            n, vector, exact=exact, probes=Settings.SIMSERVER_ANN_PROBES
+        )
+
+    def request_update(self, cmd):
+        """ Schedule a refresh or a reload of the topic vectors, to run in
+            a background thread so that no worker is held up by it. Requests
+            that arrive while an update is running are coalesced into one
+            update that runs after it, a reload taking precedence. """
+        with self._update_lock:
+            if cmd == "reload" or self._update_pending is None:
+                self._update_pending = cmd
+            if self._updating:
+                return
+            self._updating = True
+        Thread(target=self._update_loop, daemon=True).start()
+
+    def _update_loop(self):
+        """ Run pending updates of the topic vectors until there are none """
+        while True:
+            with self._update_lock:
+                cmd = self._update_pending
+                self._update_pending = None
+                if cmd is None:
+                    self._updating = False
+                    return
+            try:
+                if cmd == "reload":
+                    self.reload_topics()
+                else:
+                    self.refresh_topics()
+            except Exception as ex:
+                print("Exception when updating topic vectors: {0}".format(ex))
+            finally:
+                sys.stdout.flush()
 
     def run(self, host, port):
         """ Run a similarity server serving requests that come in at the given port """
@@ -245,14 +418,26 @@ class SimilarityServer:
         )
 
         with Listener(address, authkey=secret_password) as listener:
-            self._corpus = ReynirCorpus()
-            self._load_topics()
+            corpus = ReynirCorpus()
+            # Load the model up front, rather than lazily in the worker threads
+            corpus.load_models()
+            self._state = (corpus, None)
+            self._start_topics()
+            # Requests are served by a bounded pool of worker threads.
+            # A dispatcher thread waits for requests on the idle client
+            # connections and hands each connection with a pending
+            # request to the pool, which returns it to the idle set
+            # once the request has been served.
+            self._pool = ThreadPoolExecutor(
+                max_workers=Settings.SIMSERVER_WORKERS,
+                thread_name_prefix="simserver",
+            )
+            Thread(target=self._dispatch_loop, daemon=True).start()
             while True:
                 try:
                     conn = listener.accept()
                     print("Connection accepted from {0}".format(listener.last_accepted))
-                    # Launch a thread to handle commands from this client
-                    Thread(target=self._command_loop, args=(conn,)).start()
+                    self._make_idle(conn)
                 except AuthenticationError:
                     print("Authentication failed for client")
                     pass
@@ -262,96 +447,148 @@ class SimilarityServer:
                 finally:
                     sys.stdout.flush()
 
-    def _command_loop(self, conn):
-        """ Run a command loop for this server inside a client thread """
-
-        class ClientError(RuntimeError):
-            """ Local exception class for handling erroneous requests from clients """
-
-            def __init__(self, request):
-                super().__init__("Invalid request received: {0!r}".format(request))
-
-        with conn:
-            # conn is automatically closed when leaving the 'with' scope
-            while True:
-                try:
-                    request = conn.recv()
+    def _make_idle(self, conn):
+        """ Add a client connection to the idle set and wake the dispatcher """
+        with self._idle_lock:
+            self._idle.add(conn)
+        self._wakeup_w.send_bytes(b"")
+
+    def _dispatch_loop(self):
+        """ Wait for requests on idle client connections and submit
+            each connection that has a pending request to the worker pool """
+        while True:
+            with self._idle_lock:
+                conns = list(self._idle)
+            try:
+                ready = wait(conns + [self._wakeup_r])
+            except Exception as ex:
+                print("Exception when waiting for requests: {0}".format(ex))
+                sys.stdout.flush()
+                continue
+            for conn in ready:
+                if conn is self._wakeup_r:
+                    # Drain the wakeup pipe; the idle set is read again
+                    while self._wakeup_r.poll():
+                        self._wakeup_r.recv_bytes()
+                    continue
+                with self._idle_lock:
+                    self._idle.discard(conn)
+                self._pool.submit(self._serve, conn)
+
+    def _serve(self, conn):
+        """ Serve a single request from a client connection, within a worker
+            thread, and then return the connection to the idle set, unless
+            it has been closed """
+        keep = False
+        try:
+            keep = self._serve_request(conn)
+        finally:
+            if keep:
+                self._make_idle(conn)
+            else:
+                conn.close()
+            sys.stdout.flush()
+
+    def _serve_request(self, conn):
+        """ Receive a request from a client and send back the reply, if
+            any. Returns False if the connection should be closed. """
+        try:
+            request = conn.recv()
 
-                    # Requests are sent as Python dict objects
-                    if not isinstance(request, dict):
-                        raise ClientError(request)
+            # Requests are sent as Python dict objects
+            if not isinstance(request, dict):
+                raise ClientError(request)
 
-                    # The main command should be a string under the 'cmd' key
+            # The main command should be a string under the 'cmd' key
+            try:
+                cmd = request["cmd"].strip().lower()
+            except:
+                raise ClientError(request)
+
+            if cmd == "logout":
+                print("Client logged out")
+                return False
+
+            if cmd == "similar":
+                # Run a similarity query and send the reply back to the client
+                conn.send(self._similar(request))
+            elif cmd == "batch":
+                # Run several similarity queries, sent in a list under the
+                # 'requests' key, and reply with a list of their results
+                # under the 'results' key, in the same order
+                requests = request.get("requests")
+                if not isinstance(requests, list):
+                    raise ClientError(request)
+                results = []
+                for r in requests:
                     try:
-                        cmd = request["cmd"].strip().lower()
-                    except:
-                        raise ClientError(request)
-
-                    if cmd == "logout":
-                        print("Client logged out")
-                        break
-
-                    if cmd == "similar":
-                        # Run a similarity query
-                        # Obtain number of desired results
-                        try:
-                            n = int(request.get("n", 10))
-                        except:
-                            n = 10
-                        topic = None
-                        result = dict()
-                        if "id" in request:
-                            try:
-                                # Compare similarity to an article identified by UUID
-                                uuid = request["id"].strip().lower()
-                                topic = self.article_topic(uuid)
-                            except:
-                                raise ClientError(request)
-                        elif "terms" in request:
-                            # Compare similarity to the given terms, which are assumed to
-                            # be normalized, i.e. of the form (stem, category).
-                            # Examples: ('sjómaður', 'kk'), ('Jóna Hrönn Bolladóttir', 'person_kvk')
-                            terms = request["terms"]
-                            if not isinstance(terms, list):
-                                raise ClientError(request)
-                            # Convert the list of search terms to a topic vector
-                            topic, term_weights = self._corpus.get_topic_vector(terms)
-                            result["weights"] = term_weights
-                        elif "topic" in request:
-                            # Compare similarity to the given topic vector
-                            topic = request["topic"]
-                            if not isinstance(topic, list):
-                                raise ClientError(request)
-                        else:
-                            raise ClientError(request)
-                        # Launch the command and send the reply back to the client
-                        t0 = time.time()
-                        result["articles"] = self.find_similar(n, topic)
-                        t1 = time.time()
-                        conn.send(result)
-                    elif cmd == "refresh":
-                        # Load any new article topic vectors from the articles table
-                        self.refresh_topics()
-                    elif cmd == "reload":
-                        # Reload all article topic vectors from the articles table
-                        self.reload_topics()
-                    else:
-                        print("Unknown command: {0}".format(cmd))
-
-                except EOFError:
-                    print("Client closed connection")
-                    break
-
-                except ClientError as e:
-                    # Print a message and continue listening to commands
-                    print(str(e))
-
-                except Exception as ex:
-                    print("Exception in client thread loop: {0}".format(ex))
-                    break
-
-                finally:
-                    sys.stdout.flush()
+                        results.append(self._similar(r))
+                    except ClientError as e:
+                        print(str(e))
+                        results.append(dict(articles=[]))
+                conn.send(dict(results=results))
+            elif cmd == "refresh" or cmd == "reload":
+                # Load any new article topic vectors, or all of them,
+                # from the articles table, in the background
+                self.request_update(cmd)
+            else:
+                print("Unknown command: {0}".format(cmd))
+
+        except EOFError:
+            print("Client closed connection")
+            return False
+
+        except ClientError as e:
+            # Print a message and continue listening to commands
+            print(str(e))
+
+        except Exception as ex:
+            print("Exception when serving request: {0}".format(ex))
+            return False
+
+        return True
+
+    def _similar(self, request):
+        """ Run a similarity query and return its result as a dict """
+        if not isinstance(request, dict):
+            raise ClientError(request)
+        # Obtain number of desired results
+        try:
+            n = int(request.get("n", 10))
+        except:
+            n = 10
+        topic = None
+        result = dict()
+        # Use the same model and topic matrix throughout the query,
+        # even if they are swapped in the meantime
+        corpus, topics = self._state
+        if "id" in request:
+            try:
+                # Compare similarity to an article identified by UUID
+                uuid = request["id"].strip().lower()
+                topic = topics.vector(uuid)
+            except:
+                raise ClientError(request)
+        elif "terms" in request:
+            # Compare similarity to the given terms, which are assumed to
+            # be normalized, i.e. of the form (stem, category).
+            # Examples: ('sjómaður', 'kk'), ('Jóna Hrönn Bolladóttir', 'person_kvk')
+            terms = request["terms"]
+            if not isinstance(terms, list):
+                raise ClientError(request)
+            # Convert the list of search terms to a topic vector
+            topic, term_weights = corpus.get_topic_vector(terms)
+            result["weights"] = term_weights
+        elif "topic" in request:
+            # Compare similarity to the given topic vector
+            topic = request["topic"]
+            if not isinstance(topic, list):
+                raise ClientError(request)
+        else:
+            raise ClientError(request)
+        exact = bool(request.get("exact", False))
+        result["articles"] = self.find_similar(n, topic, exact, topics)
+        return result
 
 
 if __name__ == "__main__":
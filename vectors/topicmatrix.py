@@ -0,0 +1,240 @@
+"""
+    Greynir: Natural language processing for Icelandic
+
+    Topic matrix of the similarity server
+
+    Copyright (C) 2020 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+
+    This module implements the in-memory matrix of article topic vectors
+    that the similarity server (simserver.py) queries, along with saving
+    and loading snapshots of it on disk.
+
+"""
+
+import os
+
+import numpy as np
+
+from datetime import datetime
+
+from ivfindex import IVFIndex
+
+
+class TopicMatrix:
+
+    """ A snapshot of the topic vectors of articles, kept as the rows of
+        a contiguous float32 matrix, normalized to unit length, along
+        with a parallel list of article ids. The cosine similarity of
+        a query vector to all articles is then a single matrix-vector
+        product. The matrix has spare rows at the end, so that vectors
+        can be appended without copying it each time.
+
+        A snapshot is never modified once it has been created, so that
+        queries can run on it without locking while a new snapshot is
+        being made. A new or replaced vector is therefore always written
+        to a spare row; the row of a replaced vector is left in place as
+        a dead row, whose article id is None and whose entry in the live
+        mask is False, until the matrix is compacted. """
+
+    # Growth factor of the matrix when it runs out of spare rows
+    GROWTH = 1.25
+    # The matrix is compacted when this fraction of its rows are dead
+    MAX_DEAD = 0.1
+    # Format of the snapshot time stamp in saved files
+    TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+    def __init__(self, dimensions):
+        self.dimensions = dimensions
+        self.ids = []
+        self.index = {}
+        self.dead = 0
+        # True for each row in use that is not dead
+        self.live = np.zeros(0, dtype=bool)
+        self._buffer = np.zeros((0, dimensions), dtype=np.float32)
+        # Optional inverted file index for approximate search
+        self.ivf = None
+
+    def __len__(self):
+        """ The number of articles in the matrix """
+        return len(self.index)
+
+    @property
+    def matrix(self):
+        """ The rows of the matrix that are in use, including dead rows """
+        return self._buffer[0 : len(self.ids)]
+
+    def vector(self, article_id):
+        """ Return the normalized topic vector of the given article, or None """
+        ix = self.index.get(article_id)
+        return None if ix is None else self._buffer[ix]
+
+    @staticmethod
+    def normalize(vectors):
+        """ Return a float32 matrix of the given vectors, normalized """
+        m = np.array(vectors, dtype=np.float32)
+        norms = np.linalg.norm(m, axis=1, keepdims=True)
+        # Leave null vectors alone, their similarity to anything is zero
+        norms[norms == 0.0] = 1.0
+        return m / norms
+
+    def updated(self, ids, vectors):
+        """ Return a new snapshot with the given vectors added or replaced.
+            The vectors are written to the spare rows of this snapshot's
+            matrix, which this snapshot does not use. Only the latest
+            snapshot should be updated, since the snapshots made from it
+            share its spare rows. """
+        tm = TopicMatrix(self.dimensions)
+        tm.ids = list(self.ids)
+        tm.index = dict(self.index)
+        tm.dead = self.dead
+        tm.live = self.live
+        tm._buffer = self._buffer
+        tm.ivf = self.ivf
+        if not ids:
+            return tm
+        m = self.normalize(vectors)
+        start = len(tm.ids)
+        replaced = []
+        for article_id in ids:
+            ix = tm.index.get(article_id)
+            if ix is not None:
+                # Replaced vector: its old row becomes dead
+                tm.ids[ix] = None
+                replaced.append(ix)
+            tm.index[article_id] = len(tm.ids)
+            tm.ids.append(article_id)
+        tm.dead += len(replaced)
+        # The live mask is shared with this snapshot, so make a new one
+        tm.live = np.ones(len(tm.ids), dtype=bool)
+        tm.live[0:start] = self.live
+        tm.live[replaced] = False
+        if len(tm.ids) > len(tm._buffer):
+            # Out of spare rows: allocate a larger matrix
+            size = max(len(tm.ids), int(len(tm._buffer) * self.GROWTH) + 1024)
+            buffer = np.zeros((size, self.dimensions), dtype=np.float32)
+            buffer[0:start] = self.matrix
+            tm._buffer = buffer
+        tm._buffer[start : len(tm.ids)] = m
+        if tm.ivf is not None:
+            tm.ivf = tm.ivf.updated(tm.matrix, range(start, len(tm.ids)))
+        if tm.dead > self.MAX_DEAD * len(tm.ids):
+            tm = tm.compacted()
+        return tm
+
+    def compacted(self):
+        """ Return a new snapshot without dead rows, in a new matrix """
+        live = np.flatnonzero(self.live)
+        tm = TopicMatrix(self.dimensions)
+        tm.ids = [self.ids[ix] for ix in live]
+        tm.index = {article_id: ix for ix, article_id in enumerate(tm.ids)}
+        tm.live = np.ones(len(live), dtype=bool)
+        tm._buffer = np.zeros(
+            (int(len(live) * self.GROWTH) + 1024, self.dimensions), dtype=np.float32
+        )
+        tm._buffer[0 : len(live)] = self._buffer[live]
+        if self.ivf is not None:
+            tm.ivf = IVFIndex(
+                self.ivf.centroids, self.ivf.assign[live], self.ivf.trained_size
+            )
+        return tm
+
+    def most_similar(self, n, vector, exact=False, probes=32):
+        """ Return the n articles with the highest cosine similarity
+            to the given vector, as a list of (article id, similarity)
+            tuples in descending order of similarity. Unless exact is
+            True, the inverted file index is used if present, probing
+            the given number of its lists. """
+        base = np.array(vector, dtype=np.float32)
+        norm_base = np.dot(base, base)
+        if norm_base < 1.0e-6 or n <= 0 or not self.index:
+            # No data to search by
+            return []
+        base /= np.sqrt(norm_base)
+        if self.ivf is not None and not exact:
+            live = self.live if self.dead else None
+            top, scores = self.ivf.search(self.matrix, n, base, probes, live)
+        else:
+            scores = self.matrix.dot(base)
+            if self.dead:
+                # Dead rows sort last and are left out below
+                scores[~self.live] = -np.inf
+            if n < len(scores):
+                # Find the top n scores without sorting all of them
+                top = np.argpartition(-scores, n - 1)[0:n]
+            else:
+                top = np.arange(len(scores))
+            top = top[np.argsort(-scores[top], kind="stable")]
+            scores = scores[top]
+            if self.dead:
+                # There may be fewer than n live rows
+                keep = self.live[top]
+                top, scores = top[keep], scores[keep]
+        return [(self.ids[ix], float(score)) for ix, score in zip(top, scores)]
+
+    def save(self, prefix, timestamp):
+        """ Save the matrix to a file named prefix-<timestamp>.npy, and
+            the article ids and timestamp to prefix.npz, which refers to
+            the matrix file. The .npz file is replaced atomically once the
+            matrix has been written, after which older matrix files are
+            removed. """
+        if self.dead:
+            return self.compacted().save(prefix, timestamp)
+        dirname, basename = os.path.split(prefix)
+        mname = "{0}-{1}.npy".format(prefix, timestamp.strftime("%Y%m%d%H%M%S%f"))
+        with open(mname + ".tmp", "wb") as f:
+            np.save(f, self.matrix)
+        os.replace(mname + ".tmp", mname)
+        with open(prefix + ".npz.tmp", "wb") as f:
+            np.savez(
+                f,
+                ids=np.array(self.ids, dtype=str),
+                timestamp=np.array([timestamp.strftime(self.TIMESTAMP_FORMAT)]),
+                matrix=np.array([os.path.basename(mname)]),
+            )
+        os.replace(prefix + ".npz.tmp", prefix + ".npz")
+        for fname in os.listdir(dirname or "."):
+            if (
+                fname.startswith(basename + "-")
+                and fname.endswith(".npy")
+                and fname != os.path.basename(mname)
+            ):
+                os.remove(os.path.join(dirname, fname))
+
+    @classmethod
+    def load(cls, prefix, dimensions):
+        """ Load a snapshot saved by save(), returning a tuple of the
+            topic matrix and the timestamp of the snapshot, or None if
+            there is no snapshot of the given dimensions. The matrix file
+            is memory-mapped read-only, so that it is paged in on demand. """
+        if not os.path.exists(prefix + ".npz"):
+            return None
+        with np.load(prefix + ".npz") as f:
+            ids = f["ids"].tolist()
+            timestamp = datetime.strptime(
+                str(f["timestamp"][0]), cls.TIMESTAMP_FORMAT
+            )
+            mname = str(f["matrix"][0])
+        matrix = np.load(
+            os.path.join(os.path.dirname(prefix), mname), mmap_mode="r"
+        )
+        if matrix.dtype != np.float32 or matrix.shape != (len(ids), dimensions):
+            return None
+        tm = cls(dimensions)
+        tm.ids = ids
+        tm.index = {article_id: ix for ix, article_id in enumerate(ids)}
+        tm.live = np.ones(len(ids), dtype=bool)
+        tm._buffer = matrix
+        return tm, timestamp
@@ -0,0 +1,266 @@
+"""
+
+    Greynir: Natural language processing for Icelandic
+
+    Worker pool module
+
+    Copyright (C) 2020 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+
+    This module implements a pool of long-lived worker processes that
+    are recycled when they have completed a given number of tasks or
+    when their resident memory exceeds a given limit.
+
+    Workers are forked from the parent process, so any large state that
+    the parent has loaded before creating the pool, such as the parser
+    grammar, is shared with the workers instead of being loaded anew by
+    each of them. Replacement workers are likewise forked from the parent
+    and start out warm.
+
+    Unlike multiprocessing.Pool, the parent dispatches each task to a
+    particular worker, so a worker that dies unexpectedly is detected,
+    its task is reported as failed (with a result of None) and a new
+    worker takes its place.
+
+"""
+
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import os
+import gc
+import logging
+import resource
+import multiprocessing
+from multiprocessing.connection import wait
+
+
+# Size of a memory page, used to interpret /proc/self/statm
+_PAGE_SIZE = resource.getpagesize()
+
+
+def rss_mb() -> float:
+    """ Return the resident set size of the current process, in megabytes """
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE / (1024.0 * 1024.0)
+    except (OSError, IndexError, ValueError):
+        # Not on Linux: fall back to the peak RSS, which is in kilobytes
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def _worker_main(conn, func, max_tasks: int, max_rss: float, on_exit) -> None:
+    """ Main loop of a worker process: receive tasks from the parent,
+        run them and send back (result, retiring) tuples """
+    num_tasks = 0
+    while True:
+        try:
+            arg = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if arg is None:
+            # Orderly shutdown
+            break
+        try:
+            result = func(arg)
+        except Exception as e:
+            logging.warning("Exception in worker process: {0!r}".format(e))
+            result = None
+        num_tasks += 1
+        retiring = bool(
+            (max_tasks and num_tasks >= max_tasks) or (max_rss and rss_mb() > max_rss)
+        )
+        conn.send((result, retiring))
+        if retiring:
+            break
+    conn.close()
+    if on_exit is not None:
+        try:
+            on_exit()
+        except Exception as e:
+            logging.warning("Exception when worker process exits: {0!r}".format(e))
+
+
+class _Worker:
+
+    """ The parent's handle on a worker process """
+
+    __slots__ = ("process", "conn", "task")
+
+    def __init__(self, process, conn) -> None:
+        self.process = process
+        self.conn = conn
+        # The argument of the task that the worker is running, if any
+        self.task: Any = None
+
+
+class WorkerPool:
+
+    """ A pool of long-lived, recyclable worker processes that call
+        func(arg) for each argument sent to them """
+
+    def __init__(
+        self,
+        func: Callable[[Any], Any],
+        processes: Optional[int] = None,
+        max_tasks: int = 0,
+        max_rss: float = 0.0,
+        on_exit: Optional[Callable[[], None]] = None,
+    ) -> None:
+        """ Create a pool of worker processes. A worker is replaced after
+            max_tasks tasks, or when its resident memory exceeds max_rss
+            megabytes after a task. Zero means no limit. If on_exit is
+            given, each worker calls it before exiting, for instance to
+            log statistics of its process. """
+        self._func = func
+        self._on_exit = on_exit
+        self._processes = processes or multiprocessing.cpu_count() or 1
+        self._max_tasks = max_tasks
+        self._max_rss = max_rss
+        self._ctx = multiprocessing.get_context("fork")
+        self._workers: List[_Worker] = []
+        # Statistics
+        self.num_tasks = 0
+        self.num_recycled = 0
+        self.num_crashed = 0
+
+    def __enter__(self) -> "WorkerPool":
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def start(self) -> None:
+        """ Fork the worker processes """
+        # Move the objects loaded so far into a permanent generation that
+        # the garbage collector leaves alone, so that the workers do not
+        # touch (and thereby copy) the memory pages they occupy.
+        # gc.freeze() is only available in CPython 3.7 and later.
+        gc.collect()
+        if hasattr(gc, "freeze"):
+            gc.freeze()
+        while len(self._workers) < self._processes:
+            self._workers.append(self._spawn())
+
+    def _spawn(self) -> _Worker:
+        """ Fork a new worker process """
+        parent_conn, child_conn = self._ctx.Pipe()
+        p = self._ctx.Process(
+            target=_worker_main,
+            args=(
+                child_conn,
+                self._func,
+                self._max_tasks,
+                self._max_rss,
+                self._on_exit,
+            ),
+            daemon=True,
+        )
+        p.start()
+        child_conn.close()
+        return _Worker(p, parent_conn)
+
+    def _replace(self, w: _Worker) -> _Worker:
+        """ Replace a worker that has exited or is about to exit,
+            returning the new worker """
+        w.conn.close()
+        w.process.join()
+        new_worker = self._spawn()
+        self._workers[self._workers.index(w)] = new_worker
+        return new_worker
+
+    def imap_unordered(self, iterable: Iterable[Any]) -> Iterator[Tuple[Any, Any]]:
+        """ Run the tasks given by iterable on the workers, yielding
+            (argument, result) tuples in order of completion. The result
+            is None if the task raised an exception or the worker died. """
+        it = iter(iterable)
+        exhausted = False
+        busy: Dict[Any, _Worker] = dict()
+        while True:
+            # Dispatch tasks to idle workers
+            for w in list(self._workers):
+                if exhausted:
+                    break
+                if w.task is not None:
+                    continue
+                try:
+                    arg = next(it)
+                except StopIteration:
+                    exhausted = True
+                    break
+                try:
+                    w.conn.send(arg)
+                except OSError:
+                    # The worker died while idle: send the task to a new one
+                    self.num_crashed += 1
+                    w = self._replace(w)
+                    w.conn.send(arg)
+                w.task = arg
+                busy[w.conn] = w
+                busy[w.process.sentinel] = w
+            if not busy:
+                break
+            for obj in wait(list(busy.keys())):
+                w = busy.get(obj)
+                if w is None:
+                    # Both the connection and the sentinel of a worker
+                    # were ready, and the worker has already been handled
+                    continue
+                del busy[w.conn]
+                del busy[w.process.sentinel]
+                arg, w.task = w.task, None
+                result = None
+                retiring = True
+                try:
+                    if w.conn.poll():
+                        result, retiring = w.conn.recv()
+                    else:
+                        raise EOFError
+                except (EOFError, OSError):
+                    # The worker died without delivering a result
+                    self.num_crashed += 1
+                    logging.warning(
+                        "Worker process {0} exited with code {1}".format(
+                            w.process.pid, w.process.exitcode
+                        )
+                    )
+                else:
+                    if retiring:
+                        self.num_recycled += 1
+                self.num_tasks += 1
+                if retiring:
+                    self._replace(w)
+                yield arg, result
+
+    def close(self) -> None:
+        """ Shut down the worker processes """
+        for w in self._workers:
+            try:
+                w.conn.send(None)
+            except (OSError, ValueError):
+                pass
+        for w in self._workers:
+            w.process.join(timeout=10.0)
+            if w.process.is_alive():
+                w.process.terminate()
+                w.process.join()
+            w.conn.close()
+        self._workers = []
+        if hasattr(gc, "unfreeze"):
+            gc.unfreeze()
+        logging.info(
+            "Worker pool closed after {0} tasks, {1} workers recycled, "
+            "{2} crashed".format(self.num_tasks, self.num_recycled, self.num_crashed)
+        )